@@ -16,10 +16,12 @@
 from qgis.PyQt.QtCore import QSettings, QTranslator, QCoreApplication
 from qgis.PyQt.QtGui import QIcon
 from qgis.PyQt.QtWidgets import QAction
+from qgis.core import QgsApplication
 import os.path
 
 # Import the dialog file directly
 from .RelazioniPlugin_dialog import RelazioniPluginDialog
+from .RelazioniPlugin_processing import ProviderRelazioni
 
 
 class RelazioniPlugin:
@@ -30,6 +32,12 @@ class RelazioniPlugin:
         self.iface = iface
         self.plugin_dir = os.path.dirname(__file__)
         self.dlg = None
+        self.provider = None
+
+    def initProcessing(self):
+        """Register the Processing provider, also when the plugin is loaded by qgis_process."""
+        self.provider = ProviderRelazioni()
+        QgsApplication.processingRegistry().addProvider(self.provider)
 
     def initGui(self):
         """Create the menu entries and toolbar icons inside the QGIS GUI."""
@@ -40,10 +48,13 @@ class RelazioniPlugin:
         self.iface.addToolBarIcon(self.action)
         self.iface.addPluginToMenu("&Relation Manager", self.action)
 
+        self.initProcessing()
+
     def unload(self):
         """Remove the plugin menu item and icon."""
         self.iface.removePluginMenu("&Relation Manager", self.action)
         self.iface.removeToolBarIcon(self.action)
+        QgsApplication.processingRegistry().removeProvider(self.provider)
 
     def run(self):
         """Run method that performs all the real work."""
@@ -0,0 +1,78 @@
+"""Reverse indexes of the project relationships.
+
+Answering "which relationships touch this layer" or "which relationships
+use this field" must not walk every relationship: the indexes map a layer
+id, and a ``(layer id, field)`` pair, to the ids of the relationships
+using them, and are updated one relationship at a time.
+"""
+
+
+class IndiceRelazioni:
+    """Layer id -> relationship ids and (layer id, field) -> relationship ids."""
+
+    def __init__(self):
+        """Constructor."""
+        # id relazione -> (layer padre, layer figlio, campi padre, campi figlio)
+        self._voci = {}
+        self._per_layer = {}
+        self._per_campo = {}
+
+    def __len__(self):
+        """Number of indexed relationships."""
+        return len(self._voci)
+
+    def svuota(self):
+        """Forget every relationship."""
+        self._voci.clear()
+        self._per_layer.clear()
+        self._per_campo.clear()
+
+    def aggiungi(self, relazione_id, layer_padre, layer_figlio, chiavi):
+        """Index a relationship, replacing the one with the same id if any.
+
+        :param chiavi: dict child field -> parent field.
+        """
+        self.rimuovi(relazione_id)
+        campi_padre = tuple(chiavi.values())
+        campi_figlio = tuple(chiavi.keys())
+        self._voci[relazione_id] = (layer_padre, layer_figlio, campi_padre, campi_figlio)
+        for layer, campi in ((layer_padre, campi_padre), (layer_figlio, campi_figlio)):
+            self._per_layer.setdefault(layer, set()).add(relazione_id)
+            for campo in campi:
+                self._per_campo.setdefault((layer, campo), set()).add(relazione_id)
+
+    def rimuovi(self, relazione_id):
+        """Remove a relationship from the indexes."""
+        voce = self._voci.pop(relazione_id, None)
+        if voce is None:
+            return
+        layer_padre, layer_figlio, campi_padre, campi_figlio = voce
+        for layer, campi in ((layer_padre, campi_padre), (layer_figlio, campi_figlio)):
+            self._scarta(self._per_layer, layer, relazione_id)
+            for campo in campi:
+                self._scarta(self._per_campo, (layer, campo), relazione_id)
+
+    @staticmethod
+    def _scarta(indice, chiave, relazione_id):
+        """Remove a relationship id from an index entry, dropping the entry when empty."""
+        ids = indice.get(chiave)
+        if ids is not None:
+            ids.discard(relazione_id)
+            if not ids:
+                del indice[chiave]
+
+    def relazioni_layer(self, layer_id):
+        """Return the ids of the relationships having the layer as parent or child."""
+        return frozenset(self._per_layer.get(layer_id, ()))
+
+    def relazioni_campo(self, layer_id, campo):
+        """Return the ids of the relationships using a field of a layer as key."""
+        return frozenset(self._per_campo.get((layer_id, campo), ()))
+
+    def layer(self):
+        """Return the ids of the layers used by at least one relationship."""
+        return self._per_layer.keys()
+
+    def campi(self):
+        """Return the ``(layer id, field)`` pairs used as key by at least one relationship."""
+        return self._per_campo.keys()
@@ -0,0 +1,76 @@
+from PyQt5.QtWidgets import QHBoxLayout, QLabel, QPushButton, QVBoxLayout, QWidget
+
+from .RelazioniPlugin_layer import crea_combo_campi
+
+
+class EditorChiavi(QWidget):
+    """Editor of the key pairs of a (possibly composite) relationship.
+
+    Every row holds a parent key combo and a child key combo that follow
+    the layers selected in the given layer combos; the child combo only
+    lists fields type-compatible with the parent key of the same row.
+    """
+
+    def __init__(self, catalogo, combo_layer_padre, combo_layer_figlio, chiavi=None, parent=None):
+        """Constructor.
+
+        :param chiavi: dict child field -> parent field used to pre-fill the rows.
+        """
+        super().__init__(parent)
+        self.catalogo = catalogo
+        self.combo_layer_padre = combo_layer_padre
+        self.combo_layer_figlio = combo_layer_figlio
+
+        # Una voce per riga: (widget riga, combo chiave padre, combo chiave figlio)
+        self._righe = []
+
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        self._layout_righe = QVBoxLayout()
+        layout.addLayout(self._layout_righe)
+
+        btnAggiungi = QPushButton("Add Key Pair")
+        btnAggiungi.clicked.connect(lambda: self.aggiungi_coppia())
+        layout.addWidget(btnAggiungi)
+
+        for chiave_figlio, chiave_padre in (chiavi or {}).items():
+            self.aggiungi_coppia(chiave_padre, chiave_figlio)
+        if not self._righe:
+            self.aggiungi_coppia()
+
+    def aggiungi_coppia(self, chiave_padre=None, chiave_figlio=None):
+        """Add a row for a key pair."""
+        riga = QWidget()
+        layout = QHBoxLayout(riga)
+        layout.setContentsMargins(0, 0, 0, 0)
+
+        combo_padre = crea_combo_campi(self.catalogo, self.combo_layer_padre, chiave_padre)
+        combo_figlio = crea_combo_campi(self.catalogo, self.combo_layer_figlio, chiave_figlio, combo_padre)
+        btnRimuovi = QPushButton("Remove")
+
+        layout.addWidget(QLabel("Parent:"))
+        layout.addWidget(combo_padre, 1)
+        layout.addWidget(QLabel("Child:"))
+        layout.addWidget(combo_figlio, 1)
+        layout.addWidget(btnRimuovi)
+
+        voce = (riga, combo_padre, combo_figlio)
+        btnRimuovi.clicked.connect(lambda: self.rimuovi_coppia(voce))
+        self._righe.append(voce)
+        self._layout_righe.addWidget(riga)
+
+    def rimuovi_coppia(self, voce):
+        """Remove a key pair row, always keeping at least one."""
+        if len(self._righe) <= 1:
+            return
+        self._righe.remove(voce)
+        voce[0].deleteLater()
+
+    def coppie(self):
+        """Return the ``(child, parent)`` key pairs, in row order."""
+        return [(combo_figlio.currentText(), combo_padre.currentText())
+                for _, combo_padre, combo_figlio in self._righe]
+
+    def chiavi(self):
+        """Return the key pairs as a dict child field -> parent field."""
+        return dict(self.coppie())
@@ -0,0 +1,296 @@
+"""Relationship catalog of a project, usable without the dialog.
+
+:class:`CatalogoRelazioni` lists, compares, validates, applies, exports and
+imports the relationships of a project without any widget or modal
+message: problems are returned as ``(name, reason)`` pairs or error
+strings, so the same operations run from the dialog, the QGIS Python
+console, ``qgis_process`` scripts and tests::
+
+    catalogo = CatalogoRelazioni(QgsProject.instance())
+    esito = catalogo.importa('/path/relations.jsonl')
+
+Every function here must run on the main thread, since it touches the
+project; the file formats are those of :mod:`RelazioniPlugin_task`.
+"""
+
+from qgis.core import QgsProject, QgsRelation, QgsVectorLayer
+
+from .RelazioniPlugin_storico import CAMPI_DEFINIZIONE, differenze, record_relazione
+from .RelazioniPlugin_task import (
+    crea_relazione, indice_layer, leggi_relazioni, nome_relazione, scrivi_relazioni, valida_chiavi,
+    valida_relazione
+)
+from .RelazioniPlugin_undo import ComandoRelazioni, ModificheRelazioni
+
+FILTRO_FILE_RELAZIONI = "JSON Files (*.json);;JSON Lines (*.jsonl)"
+
+
+def dettagli_relazione(relation, nomi_campi=None):
+    """Build the detail record of a relationship.
+
+    :param nomi_campi: optional callable returning the set of field names of
+        a layer id, such as the cached :meth:`CatalogoLayer.nomi_campi`.
+    """
+    layer_padre = relation.referencedLayer()
+    layer_figlio = relation.referencingLayer()
+    chiavi = dict(relation.fieldPairs())
+    valida = False
+    if layer_padre and layer_figlio:
+        if nomi_campi is None:
+            campi_padre, campi_figlio = set(layer_padre.fields().names()), set(layer_figlio.fields().names())
+        else:
+            campi_padre, campi_figlio = nomi_campi(layer_padre.id()), nomi_campi(layer_figlio.id())
+        # QgsRelation.isValid() non segue i campi rimossi dopo la creazione
+        valida = not valida_chiavi(chiavi, campi_padre, campi_figlio)
+    return {
+        'id': relation.id(),
+        'nome': relation.name(),
+        'layer_padre': layer_padre.name() if layer_padre else '',
+        'layer_figlio': layer_figlio.name() if layer_figlio else '',
+        'layer_padre_id': relation.referencedLayerId(),
+        'layer_figlio_id': relation.referencingLayerId(),
+        'chiavi': chiavi,
+        'forza': 'Composition' if relation.strength() == QgsRelation.Composition else 'Association',
+        'valida': valida
+    }
+
+
+def formato_esportazione(dettagli):
+    """Return the ``(relazione_id, relazione)`` pair of a detail record in the export format."""
+    return dettagli['id'], {
+        'nome': dettagli['nome'],
+        'referencing_layer': dettagli['layer_figlio'],
+        'referenced_layer': dettagli['layer_padre'],
+        'chiavi': dict(dettagli['chiavi'])
+    }
+
+
+def e_jsonl(file_path):
+    """Tell from its extension whether a file is in the JSON Lines format."""
+    return file_path.lower().endswith('.jsonl')
+
+
+class CatalogoRelazioni:
+    """Headless operations on the relationships of a project."""
+
+    def __init__(self, project=None, undo_stack=None, catalogo_layer=None):
+        """Constructor.
+
+        :param project: the project, the current one by default.
+        :param undo_stack: optional undo stack receiving every change as a
+            single command; without it the changes are applied directly.
+        :param catalogo_layer: optional :class:`CatalogoLayer` whose cached
+            layers and fields are used to resolve layer names.
+        """
+        self.project = project or QgsProject.instance()
+        self.undo_stack = undo_stack
+        self.catalogo_layer = catalogo_layer
+
+    @property
+    def relation_manager(self):
+        """The relation manager of the project."""
+        return self.project.relationManager()
+
+    def definizioni(self):
+        """Return the current relationships as a snapshot (relationship id -> record)."""
+        nomi_campi = self._cache_nomi_campi()
+        return {relazione_id: record_relazione(dettagli_relazione(relation, nomi_campi))
+                for relazione_id, relation in self.relation_manager.relations().items()}
+
+    def elenca(self):
+        """Return the current relationships as ``(relazione_id, relazione)`` pairs in the export format."""
+        nomi_campi = self._cache_nomi_campi()
+        return [formato_esportazione(dettagli_relazione(relation, nomi_campi))
+                for relation in self.relation_manager.relations().values()]
+
+    def valida(self, relazioni):
+        """Check relationships in the export format against the project layers.
+
+        :param relazioni: iterable of ``(relazione_id, relazione)`` pairs.
+        :returns: ``(valide, fallite)``: the definitions with the layer ids
+            resolved, ready for :meth:`applica`, and the ``(name, reason)``
+            pairs of the rejected relationships.
+        """
+        layer_per_nome, campi_per_layer = indice_layer(self.project)
+        valide = []
+        fallite = []
+        for relazione_id, relazione in relazioni:
+            definizione, errore = valida_relazione(relazione_id, relazione, layer_per_nome, campi_per_layer)
+            if errore:
+                fallite.append((nome_relazione(relazione_id, relazione), errore))
+            else:
+                valide.append(definizione)
+        return valide, fallite
+
+    def costruisci(self, relazione_id, nuova_relazione):
+        """Build a relationship from layer names, validating all its key pairs at once.
+
+        :param nuova_relazione: dict with ``nome``, ``layer_padre``, ``layer_figlio``
+            (layer names) and ``chiavi`` (child field -> parent field).
+        :returns: ``(relation, None)``, or ``(None, reason)`` if it is not valid.
+        """
+        layer_figlio = self._layer(nuova_relazione['layer_figlio'])
+        layer_padre = self._layer(nuova_relazione['layer_padre'])
+        if not layer_figlio or not layer_padre:
+            return None, "Parent or child layer not found."
+
+        chiavi = nuova_relazione['chiavi']
+        if not chiavi:
+            return None, "Define at least one key pair."
+
+        non_valide = valida_chiavi(chiavi, self._nomi_campi(layer_padre), self._nomi_campi(layer_figlio))
+        if non_valide:
+            return None, "Key fields not found:\n" + "\n".join(
+                f"{chiave_padre} -> {chiave_figlio}" for chiave_figlio, chiave_padre in non_valide)
+
+        return crea_relazione({
+            'id': relazione_id,
+            'nome': nuova_relazione['nome'],
+            'layer_padre_id': layer_padre.id(),
+            'layer_figlio_id': layer_figlio.id(),
+            'chiavi': chiavi
+        }), None
+
+    def _layer(self, nome):
+        """Return the first vector layer with the given name, or None."""
+        if self.catalogo_layer is not None:
+            return self.catalogo_layer.layer(nome)
+        for layer in self.project.mapLayersByName(nome):
+            if isinstance(layer, QgsVectorLayer):
+                return layer
+        return None
+
+    def _nomi_campi(self, layer):
+        """Return the set of field names of a layer."""
+        if self.catalogo_layer is not None:
+            return self.catalogo_layer.nomi_campi(layer.id())
+        return frozenset(layer.fields().names())
+
+    def _cache_nomi_campi(self):
+        """Return a callable giving the field names of a layer id, read once per batch."""
+        if self.catalogo_layer is not None:
+            return self.catalogo_layer.nomi_campi
+        nomi = {}
+
+        def nomi_campi(layer_id):
+            if layer_id not in nomi:
+                layer = self.project.mapLayer(layer_id)
+                nomi[layer_id] = frozenset(layer.fields().names()) if layer else frozenset()
+            return nomi[layer_id]
+        return nomi_campi
+
+    def differenze(self, definizioni, sostituisci=False):
+        """Compare validated definitions with the current relationships.
+
+        :param sostituisci: if True the definitions are the whole target set,
+            so the current relationships missing from them count as removed.
+        :returns: ``(aggiunte, modificate, rimosse)`` as for
+            :func:`RelazioniPlugin_storico.differenze`; definitions without a
+            strength are associations.
+        """
+        correnti = self.definizioni()
+        obiettivo = {}
+        for definizione in definizioni:
+            record = {campo: definizione.get(campo) for campo in CAMPI_DEFINIZIONE}
+            record['forza'] = record['forza'] or 'Association'
+            obiettivo[definizione['id']] = record
+        if not sostituisci:
+            correnti = {relazione_id: record for relazione_id, record in correnti.items()
+                        if relazione_id in obiettivo}
+        return differenze(correnti, obiettivo)
+
+    def prepara(self, definizioni, rimuovi=()):
+        """Collect the changes applying validated definitions.
+
+        :param rimuovi: ids of relationships to remove.
+        :returns: ``(modifiche, esito)``: the :class:`ModificheRelazioni` and a
+            dict with the names of the relationships to load (``caricate``) and
+            the ``(name, reason)`` pairs of the rejected ones (``fallite``).
+        """
+        modifiche = ModificheRelazioni()
+        esito = {'caricate': [], 'fallite': []}
+        for relazione_id in rimuovi:
+            modifiche.rimuovi(relazione_id)
+        for definizione in definizioni:
+            relation = crea_relazione(definizione)
+            if relation.isValid():
+                modifiche.aggiungi(relation)
+                esito['caricate'].append(relation.name())
+            else:
+                esito['fallite'].append((relation.name(), "Invalid relationship definition"))
+        return modifiche, esito
+
+    def applica_modifiche(self, relazioni, testo):
+        """Apply a change of relationships at once, with a single change signal.
+
+        :param relazioni: dict relationship id -> new :class:`QgsRelation`, or
+            None to remove the relationship.
+        :param testo: description of the change on the undo stack.
+        """
+        nomi_campi = self._cache_nomi_campi()
+        prima = {}
+        dopo = {}
+        for relazione_id, relation in relazioni.items():
+            corrente = self.relation_manager.relation(relazione_id)
+            # relation() restituisce una relazione vuota per gli id sconosciuti
+            prima[relazione_id] = record_relazione(dettagli_relazione(corrente, nomi_campi)) if corrente.id() else None
+            dopo[relazione_id] = record_relazione(dettagli_relazione(relation, nomi_campi)) if relation else None
+
+        comando = ComandoRelazioni(self.relation_manager, testo, prima, dopo)
+        if self.undo_stack is not None:
+            # push() applica subito il comando
+            self.undo_stack.push(comando)
+        else:
+            comando.redo()
+
+    def applica(self, definizioni, rimuovi=(), testo="Apply relationships"):
+        """Add or replace validated definitions and remove relationships in one batch.
+
+        :returns: the ``esito`` dict of :meth:`prepara`.
+        """
+        modifiche, esito = self.prepara(definizioni, rimuovi)
+        if len(modifiche):
+            self.applica_modifiche(modifiche.relazioni, testo)
+        return esito
+
+    def esporta(self, file_path, jsonl=None):
+        """Write the current relationships to a JSON or JSON Lines file.
+
+        :param jsonl: the format, from the file extension by default.
+        :returns: the number of relationships written.
+        :raises OSError: if the file cannot be written.
+        """
+        relazioni = self.elenca()
+        with open(file_path, 'w', encoding='utf-8') as file:
+            scrivi_relazioni(relazioni, file, e_jsonl(file_path) if jsonl is None else jsonl)
+        return len(relazioni)
+
+    def importa(self, file_path, jsonl=None, sostituisci=False):
+        """Validate the relationships of a file and apply the valid ones in one batch.
+
+        :param jsonl: the format, from the file extension by default.
+        :param sostituisci: if True the relationships missing from the file are removed.
+        :returns: dict with the names of the loaded relationships (``caricate``)
+            and the ``(name, reason)`` pairs of the rejected ones (``fallite``).
+        :raises OSError: if the file cannot be read.
+        :raises ValueError: if the file format is invalid.
+        """
+        nel_file = set()
+
+        def traccia(relazioni):
+            # Anche le relazioni scartate restano nel progetto se sono nel file
+            for relazione_id, relazione in relazioni:
+                nel_file.add(relazione_id)
+                yield relazione_id, relazione
+
+        with open(file_path, 'rb') as file:
+            relazioni, _ = leggi_relazioni(file, e_jsonl(file_path) if jsonl is None else jsonl)
+            valide, fallite = self.valida(traccia(relazioni))
+
+        rimuovi = ()
+        if sostituisci:
+            rimuovi = [relazione_id for relazione_id in self.relation_manager.relations()
+                       if relazione_id not in nel_file]
+        esito = self.applica(valide, rimuovi, f"Imported {len(valide)} relationships")
+        esito['fallite'] = fallite + esito['fallite']
+        return esito
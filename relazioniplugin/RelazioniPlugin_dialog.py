@@ -1,13 +1,49 @@
 from PyQt5.QtWidgets import (
-    QDialog, QVBoxLayout, QListWidget, QPushButton, QFileDialog, 
-    QMessageBox, QInputDialog, QComboBox, QLabel, QFormLayout, 
-    QDialogButtonBox, QLineEdit, QTabWidget, QWidget
+    QDialog, QVBoxLayout, QListWidget, QListWidgetItem, QTableView, QAbstractItemView, QPushButton, QFileDialog, 
+    QMessageBox, QInputDialog, QLabel, QFormLayout, 
+    QDialogButtonBox, QLineEdit, QTabWidget, QWidget, QProgressBar, QHBoxLayout, QCheckBox,
+    QTableWidget, QTableWidgetItem, QSpinBox
 )
-from PyQt5.QtGui import QIcon
-from qgis.core import QgsProject, QgsRelation
-import json
+from PyQt5.QtCore import Qt, QSettings, QTimer
+from PyQt5.QtGui import QIcon, QKeySequence
+from qgis.core import QgsApplication, QgsProject
+from qgis.utils import iface
+import os
+import sqlite3
 import uuid
-from datetime import datetime
+from collections import Counter
+from contextlib import contextmanager
+
+from .RelazioniPlugin_chiavi import EditorChiavi
+from .RelazioniPlugin_core import FILTRO_FILE_RELAZIONI, CatalogoRelazioni, e_jsonl, formato_esportazione
+from .RelazioniPlugin_indici import (
+    AnalisiIndiciTask, CreaIndiciTask, MisuraIndiciTask, crea_indice_provider, da_creare, prepara_indici
+)
+from .RelazioniPlugin_integrita import (
+    StatisticheRelazioneTask, VerificaIntegritaSqlTask, VerificaIntegritaTask, chiave_cache_statistiche,
+    prepara_statistiche, prepara_verifica, prepara_verifica_sql
+)
+from .RelazioniPlugin_inventario import InventarioRelazioni
+from .RelazioniPlugin_layer import CatalogoLayer, crea_combo_filtrabile
+from .RelazioniPlugin_model import FiltroRelazioniProxy, RelazioniModel
+from .RelazioniPlugin_storico import (
+    ANNULLA, CREA, DUPLICA, ELIMINA, IMPORTA, IN_MEMORIA, LIMITE_PREDEFINITO, MODIFICA, RIPETI, RIPRISTINA,
+    StoricoRelazioni, differenze, percorso_storico, record_relazione
+)
+from .RelazioniPlugin_undo import ModificheRelazioni
+from .RelazioniPlugin_task import (
+    EsportaRelazioniTask, ImportaRelazioniTask, IndicizzaInventarioTask, crea_relazione, indice_layer
+)
+
+CHIAVE_SALVATAGGIO_AUTOMATICO = "relazioniplugin/salvataggio_automatico"
+CHIAVE_LIMITE_STORICO = "relazioniplugin/limite_storico"
+CHIAVE_CARTELLA_INVENTARIO = "relazioniplugin/cartella_inventario"
+
+# Indice delle relazioni di tutti i progetti, condiviso tra le sessioni
+FILE_INVENTARIO = "relazioniplugin_inventory.sqlite"
+# Righe mostrate al massimo da una ricerca nell'inventario
+LIMITE_RISULTATI_INVENTARIO = 1000
+RITARDO_SALVATAGGIO_MS = 5000
 
 class RelazioniPluginDialog(QDialog):
     def __init__(self):
@@ -21,8 +57,32 @@ class RelazioniPluginDialog(QDialog):
         # Create layout and widgets manually
         layout = QVBoxLayout()
 
-        # Relationships list
-        self.listaRelazioni = QListWidget()
+        # Shared cache of the project layers and fields used by the combos
+        self.catalogoLayer = CatalogoLayer(QgsProject.instance(), self)
+
+        # Relationships table, kept in sync with the relation manager by the model
+        self.modelloRelazioni = RelazioniModel(QgsProject.instance().relationManager(), self,
+                                               self.catalogoLayer.nomi_campi)
+        self.catalogoLayer.layerRinominato.connect(
+            lambda layer_id: self.modelloRelazioni.aggiorna_relazioni(self.modelloRelazioni.impatto(layer_id)))
+        self.catalogoLayer.campiModificati.connect(
+            lambda layer_id, campi: self.modelloRelazioni.aggiorna_relazioni(
+                self.modelloRelazioni.impatto(layer_id, campi)))
+
+        # Filter-as-you-type on relationship, layer and key field names
+        self.filtroRelazioni = FiltroRelazioniProxy(self.modelloRelazioni, self)
+        self.txtFiltro = QLineEdit()
+        self.txtFiltro.setPlaceholderText("Filter by relationship, layer or field name...")
+        self.txtFiltro.setClearButtonEnabled(True)
+        self.txtFiltro.textChanged.connect(self.filtroRelazioni.imposta_testo)
+        layout.addWidget(self.txtFiltro)
+
+        self.listaRelazioni = QTableView()
+        self.listaRelazioni.setModel(self.filtroRelazioni)
+        self.listaRelazioni.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.listaRelazioni.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.listaRelazioni.verticalHeader().hide()
+        self.listaRelazioni.horizontalHeader().setStretchLastSection(True)
         layout.addWidget(self.listaRelazioni)
 
         # Buttons with icons
@@ -47,7 +107,96 @@ class RelazioniPluginDialog(QDialog):
         self.btnStorico = QPushButton(QIcon(':/plugins/relazioniplugin/history.png'), "View History")
         layout.addWidget(self.btnStorico)
 
-        self.setLayout(layout)
+        # Undo/redo of the relationship changes, kept on the project undo stack
+        self.undoStack = QgsProject.instance().undoStack()
+        layoutUndo = QHBoxLayout()
+        self.btnAnnullaModifica = QPushButton("Undo")
+        self.btnAnnullaModifica.setShortcut(QKeySequence.Undo)
+        layoutUndo.addWidget(self.btnAnnullaModifica)
+        self.btnRipetiModifica = QPushButton("Redo")
+        self.btnRipetiModifica.setShortcut(QKeySequence.Redo)
+        layoutUndo.addWidget(self.btnRipetiModifica)
+        layout.addLayout(layoutUndo)
+        self.btnAnnullaModifica.setEnabled(self.undoStack.canUndo())
+        self.btnRipetiModifica.setEnabled(self.undoStack.canRedo())
+        self.undoStack.canUndoChanged.connect(self.btnAnnullaModifica.setEnabled)
+        self.undoStack.canRedoChanged.connect(self.btnRipetiModifica.setEnabled)
+        self.undoStack.undoTextChanged.connect(self.btnAnnullaModifica.setToolTip)
+        self.undoStack.redoTextChanged.connect(self.btnRipetiModifica.setToolTip)
+
+        # Operazioni sulle relazioni senza interfaccia, le stesse disponibili da console e script
+        self.catalogo = CatalogoRelazioni(QgsProject.instance(), self.undoStack, self.catalogoLayer)
+
+        # Referential integrity check of all the relationships
+        layoutIntegrita = QHBoxLayout()
+        self.btnIntegrita = QPushButton("Check Integrity")
+        layoutIntegrita.addWidget(self.btnIntegrita)
+        self.btnIntegritaSql = QPushButton("Check Integrity in Database")
+        layoutIntegrita.addWidget(self.btnIntegritaSql)
+        self.chkSelezionaOrfani = QCheckBox("Select orphan features")
+        layoutIntegrita.addWidget(self.chkSelezionaOrfani)
+        layout.addLayout(layoutIntegrita)
+
+        # Cardinality statistics of the selected relationship, key index advisor
+        layoutAnalisi = QHBoxLayout()
+        self.btnStatistiche = QPushButton("Relationship Statistics")
+        layoutAnalisi.addWidget(self.btnStatistiche)
+        self.btnIndici = QPushButton("Index Advisor")
+        layoutAnalisi.addWidget(self.btnIndici)
+        layout.addLayout(layoutAnalisi)
+        # Istogrammi già calcolati: id relazione -> (chiave dei dati, istogramma, statistiche, metodo)
+        self._cache_statistiche = {}
+
+        # Project saving: debounced auto-save or explicit "Save now"
+        layoutSalvataggio = QHBoxLayout()
+        self.chkSalvataggioAutomatico = QCheckBox("Auto-save project after changes")
+        self.chkSalvataggioAutomatico.setChecked(
+            QSettings().value(CHIAVE_SALVATAGGIO_AUTOMATICO, True, type=bool))
+        layoutSalvataggio.addWidget(self.chkSalvataggioAutomatico)
+        self.btnSalva = QPushButton("Save Now")
+        layoutSalvataggio.addWidget(self.btnSalva)
+        layout.addLayout(layoutSalvataggio)
+
+        # Le modifiche ravvicinate vengono salvate una volta sola, alla fine della raffica
+        self._timer_salvataggio = QTimer(self)
+        self._timer_salvataggio.setSingleShot(True)
+        self._timer_salvataggio.setInterval(RITARDO_SALVATAGGIO_MS)
+        self._timer_salvataggio.timeout.connect(self.salva_progetto)
+
+        # Progress of the background import/export, hidden while idle
+        layoutProgresso = QHBoxLayout()
+        self.barraProgresso = QProgressBar()
+        self.barraProgresso.setRange(0, 100)
+        layoutProgresso.addWidget(self.barraProgresso)
+        self.btnAnnulla = QPushButton("Cancel")
+        layoutProgresso.addWidget(self.btnAnnulla)
+        self.barraProgresso.hide()
+        self.btnAnnulla.hide()
+        self._task = None
+
+        # Relationships, layer graph and inventory tabs, above the shared progress bar
+        self.schede = QTabWidget()
+        paginaRelazioni = QWidget()
+        paginaRelazioni.setLayout(layout)
+        self.schede.addTab(paginaRelazioni, "Relationships")
+        self.paginaGrafo = self._crea_pagina_grafo()
+        self.schede.addTab(self.paginaGrafo, "Layer Graph")
+        self.schede.addTab(self._crea_pagina_inventario(), "Project Inventory")
+        layoutDialogo = QVBoxLayout()
+        layoutDialogo.addWidget(self.schede)
+        layoutDialogo.addLayout(layoutProgresso)
+        self.setLayout(layoutDialogo)
+
+        # Il grafo si ridisegna una volta per raffica di modifiche, e solo se visibile
+        self._grafo_da_aggiornare = True
+        self._timer_grafo = QTimer(self)
+        self._timer_grafo.setSingleShot(True)
+        self._timer_grafo.setInterval(0)
+        self._timer_grafo.timeout.connect(self.aggiorna_pagina_grafo)
+        for segnale in (self.modelloRelazioni.modelReset, self.modelloRelazioni.rowsInserted,
+                        self.modelloRelazioni.rowsRemoved, self.modelloRelazioni.dataChanged):
+            segnale.connect(self._grafo_modificato)
+        self.schede.currentChanged.connect(lambda: self.aggiorna_pagina_grafo())
 
         # Connect buttons to their functions
         self.btnEsporta.clicked.connect(self.esporta_relazioni)
@@ -57,127 +206,667 @@ class RelazioniPluginDialog(QDialog):
         self.btnElimina.clicked.connect(self.elimina_relazione)
         self.btnCrea.clicked.connect(self.crea_nuova_relazione)
         self.btnStorico.clicked.connect(self.visualizza_storico)
+        self.btnAnnullaModifica.clicked.connect(self.annulla_modifica)
+        self.btnRipetiModifica.clicked.connect(self.ripeti_modifica)
+        self.btnAnnulla.clicked.connect(self.annulla_task)
+        self.btnIntegrita.clicked.connect(self.verifica_integrita)
+        self.btnIntegritaSql.clicked.connect(self.verifica_integrita_sql)
+        self.btnStatistiche.clicked.connect(self.mostra_statistiche_relazione)
+        self.btnIndici.clicked.connect(self.analizza_indici)
+
+        # Buttons starting a background task, disabled while one is running
+        self._pulsanti_task = [
+            self.btnEsporta, self.btnCarica, self.btnIntegrita, self.btnIntegritaSql, self.btnStatistiche, self.btnIndici,
+            self.btnIndicizzaInventario
+        ]
+        self.btnSalva.clicked.connect(lambda: self.salva_progetto(esplicito=True))
+        self.chkSalvataggioAutomatico.toggled.connect(self.imposta_salvataggio_automatico)
+
+        # Persistent history journal, reopened whenever the project file changes
+        self.storico = None
+        self._percorso_storico = None
+        # Cronologia in memoria di un progetto mai salvato, in attesa del suo primo salvataggio
+        self._storico_non_salvato = None
+        self._apri_storico()
+        QgsProject.instance().fileNameChanged.connect(self._apri_storico)
+        QgsProject.instance().projectSaved.connect(self._progetto_salvato)
+        QgsProject.instance().cleared.connect(self._progetto_chiuso)
+        QgsProject.instance().readProject.connect(lambda: self._scarta_storico_non_salvato())
+
+    def _crea_pagina_grafo(self):
+        """Create the tab analyzing the graph of the layers linked by relationships."""
+        pagina = QWidget()
+        layout = QVBoxLayout(pagina)
+        self.etichettaGrafo = QLabel()
+        self.etichettaGrafo.setWordWrap(True)
+        layout.addWidget(self.etichettaGrafo)
+        self.tabellaGrafo = QTableWidget(0, 5)
+        self.tabellaGrafo.setHorizontalHeaderLabels(("Layer", "Depth", "Parent Of", "Child Of", "In Cycle"))
+        self.tabellaGrafo.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.tabellaGrafo.verticalHeader().hide()
+        self.tabellaGrafo.horizontalHeader().setStretchLastSection(True)
+        self.tabellaGrafo.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.tabellaGrafo.setSelectionMode(QAbstractItemView.SingleSelection)
+        layout.addWidget(self.tabellaGrafo)
+        btnImpattoLayer = QPushButton("Layer Deletion Impact")
+        btnImpattoLayer.clicked.connect(self.mostra_impatto_layer)
+        layout.addWidget(btnImpattoLayer)
+        return pagina
+
+    def _crea_pagina_inventario(self):
+        """Create the tab searching the relationships of the project files of a folder."""
+        pagina = QWidget()
+        layout = QVBoxLayout(pagina)
+
+        layoutCartella = QHBoxLayout()
+        self.campoCartellaInventario = QLineEdit(QSettings().value(CHIAVE_CARTELLA_INVENTARIO, "", type=str))
+        self.campoCartellaInventario.setPlaceholderText("Folder with .qgs/.qgz projects")
+        layoutCartella.addWidget(self.campoCartellaInventario)
+        btnSfoglia = QPushButton("Browse…")
+        btnSfoglia.clicked.connect(self.scegli_cartella_inventario)
+        layoutCartella.addWidget(btnSfoglia)
+        self.btnIndicizzaInventario = QPushButton("Index Folder")
+        self.btnIndicizzaInventario.setToolTip("Read the relationships of the projects changed since the last indexing")
+        self.btnIndicizzaInventario.clicked.connect(self.indicizza_inventario)
+        layoutCartella.addWidget(self.btnIndicizzaInventario)
+        layout.addLayout(layoutCartella)
+
+        layoutRicerca = QHBoxLayout()
+        self.campoLayerInventario = QLineEdit()
+        self.campoLayerInventario.setPlaceholderText("Layer name contains…")
+        layoutRicerca.addWidget(self.campoLayerInventario)
+        self.campoSorgenteInventario = QLineEdit()
+        self.campoSorgenteInventario.setPlaceholderText("Data source contains…")
+        layoutRicerca.addWidget(self.campoSorgenteInventario)
+        btnCerca = QPushButton("Search")
+        btnCerca.clicked.connect(lambda: self.cerca_inventario())
+        layoutRicerca.addWidget(btnCerca)
+        layout.addLayout(layoutRicerca)
+
+        self.tabellaInventario = QTableWidget(0, 5)
+        self.tabellaInventario.setHorizontalHeaderLabels(
+            ("Project", "Relationship", "Parent Layer", "Child Layer", "Keys"))
+        self.tabellaInventario.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.tabellaInventario.verticalHeader().hide()
+        self.tabellaInventario.horizontalHeader().setStretchLastSection(True)
+        self.tabellaInventario.setSelectionBehavior(QAbstractItemView.SelectRows)
+        layout.addWidget(self.tabellaInventario)
+        self.etichettaInventario = QLabel()
+        self.etichettaInventario.setWordWrap(True)
+        layout.addWidget(self.etichettaInventario)
+        return pagina
+
+    @staticmethod
+    def _percorso_inventario():
+        """Return the SQLite file of the relationship inventory, in the QGIS profile folder."""
+        return os.path.join(QgsApplication.qgisSettingsDirPath(), FILE_INVENTARIO)
+
+    def scegli_cartella_inventario(self):
+        """Choose the folder of the project files to index."""
+        cartella = QFileDialog.getExistingDirectory(self, "Project Folder", self.campoCartellaInventario.text())
+        if cartella:
+            self.campoCartellaInventario.setText(cartella)
+
+    def indicizza_inventario(self):
+        """Index the project files of the chosen folder in the background, then search."""
+        cartella = self.campoCartellaInventario.text().strip()
+        if not cartella or not os.path.isdir(cartella):
+            QMessageBox.warning(self, "Project Inventory", "Choose an existing folder to index.")
+            return
+        QSettings().setValue(CHIAVE_CARTELLA_INVENTARIO, cartella)
 
-        # Load relationships on startup
-        self.carica_lista_relazioni()
+        task = IndicizzaInventarioTask(self._percorso_inventario(), cartella)
 
-        # Initialize history storage
-        self.history = []
+        def al_completamento():
+            esito = task.esito
+            testo = (f"{esito['aggiunti']} projects added, {esito['aggiornati']} updated, "
+                     f"{esito['invariati']} unchanged, {esito['rimossi']} removed.")
+            if esito['errori']:
+                testo += f" {len(esito['errori'])} could not be read:\n" + "\n".join(
+                    f"{percorso}: {errore}" for percorso, errore in esito['errori'])
+            self.cerca_inventario(testo)
 
-    def carica_lista_relazioni(self):
-        """List all relationships in the QGIS project."""
-        self.listaRelazioni.clear()
+        self._avvia_task(task, al_completamento)
+
+    def cerca_inventario(self, testo=None):
+        """Show the indexed relationships matching the layer and data source filters."""
+        try:
+            inventario = InventarioRelazioni(self._percorso_inventario())
+            try:
+                risultati = inventario.cerca(self.campoLayerInventario.text().strip(),
+                                             self.campoSorgenteInventario.text().strip(),
+                                             LIMITE_RISULTATI_INVENTARIO + 1)
+                progetti, relazioni = len(inventario), inventario.numero_relazioni()
+            finally:
+                inventario.chiudi()
+        except (OSError, sqlite3.Error) as errore:
+            QMessageBox.warning(self, "Project Inventory", f"The inventory cannot be read: {errore}")
+            return
+
+        riepilogo = f"{len(risultati[:LIMITE_RISULTATI_INVENTARIO])} matches"
+        if len(risultati) > LIMITE_RISULTATI_INVENTARIO:
+            riepilogo = f"First {LIMITE_RISULTATI_INVENTARIO} matches"
+            del risultati[LIMITE_RISULTATI_INVENTARIO:]
+        riepilogo += f" among {relazioni} relationships of {progetti} indexed projects."
+        self.etichettaInventario.setText(f"{testo}\n{riepilogo}" if testo else riepilogo)
+
+        self.tabellaInventario.setRowCount(len(risultati))
+        for riga, (progetto, relazione_id, relazione) in enumerate(risultati):
+            chiavi = ", ".join(f"{figlio} → {padre}" for figlio, padre in relazione['chiavi'].items())
+            valori = (progetto, relazione['nome'], relazione['referenced_layer'],
+                      relazione['referencing_layer'], chiavi)
+            for colonna, valore in enumerate(valori):
+                self.tabellaInventario.setItem(riga, colonna, QTableWidgetItem(valore))
+            self.tabellaInventario.item(riga, 1).setToolTip(relazione_id)
+        self.tabellaInventario.resizeColumnsToContents()
+
+    def _grafo_modificato(self):
+        """Schedule a refresh of the layer graph tab after a relationship change."""
+        self._grafo_da_aggiornare = True
+        self._timer_grafo.start()
+
+    def aggiorna_pagina_grafo(self):
+        """Show the depth, fan-out and cycles of the layer graph, in topological order."""
+        if not self._grafo_da_aggiornare or self.schede.currentWidget() is not self.paginaGrafo:
+            return
+        self._grafo_da_aggiornare = False
+
+        grafo = self.modelloRelazioni.grafo
+        analisi = grafo.analizza()
         project = QgsProject.instance()
 
-        # Get the relation manager
-        relation_manager = project.relationManager()
+        def nome_layer(layer_id):
+            layer = project.mapLayer(layer_id)
+            return layer.name() if layer else layer_id
+
+        nel_ciclo = {layer_id for ciclo in analisi['cicli'] for layer_id in ciclo}
+        testo = f"{len(analisi['ordine'])} layers, {len(grafo)} relationships, maximum depth {analisi['profondita_massima']}."
+        if analisi['cicli']:
+            testo += "\nCycles, which can make QGIS forms recurse:\n" + "\n".join(
+                " → ".join(nome_layer(layer_id) for layer_id in ciclo) for ciclo in analisi['cicli'])
+        else:
+            testo += " No cycles."
+        self.etichettaGrafo.setText(testo)
+
+        self.tabellaGrafo.setRowCount(len(analisi['ordine']))
+        for riga, layer_id in enumerate(analisi['ordine']):
+            valori = (nome_layer(layer_id), str(analisi['profondita'][layer_id]), str(analisi['fan_out'][layer_id]),
+                      str(grafo.fan_in(layer_id)), "Yes" if layer_id in nel_ciclo else "")
+            for colonna, valore in enumerate(valori):
+                self.tabellaGrafo.setItem(riga, colonna, QTableWidgetItem(valore))
+            self.tabellaGrafo.item(riga, 0).setData(Qt.UserRole, layer_id)
+        self.tabellaGrafo.resizeColumnsToContents()
+
+    def _righe_impatto(self, relazioni):
+        """Build the impact table rows of ``(relazione_id, profondita)`` pairs.
+
+        Child feature counts come from the providers and linked children from
+        the cached relationship statistics; nothing is scanned.
+        """
+        project = QgsProject.instance()
+        righe = []
+        for relazione_id, profondita in relazioni:
+            dettagli = self.modelloRelazioni.dettagli(relazione_id)
+            if dettagli is None:
+                continue
+            layer_figlio = project.mapLayer(dettagli['layer_figlio_id'])
+            numero = layer_figlio.featureCount() if layer_figlio else -1
+            in_cache = self._cache_statistiche.get(relazione_id)
+            collegati = "-"
+            if in_cache and in_cache[2]['padri']:
+                statistiche = in_cache[2]
+                collegati = f"{statistiche['figli']} ({statistiche['media']:.1f} per parent)"
+            righe.append((str(profondita), dettagli['nome'], dettagli['layer_padre'], dettagli['layer_figlio'],
+                          str(numero) if numero >= 0 else "?", collegati))
+        return righe
+
+    def _mostra_impatto(self, titolo, testo, relazioni, azione=None):
+        """Show the relationships affected by a deletion, with their estimated child features."""
+        self._mostra_tabella(titolo, ("Depth", "Relationship", "Parent Layer", "Child Layer", "Child Features",
+                                      "Linked Children (cached)"), self._righe_impatto(relazioni), testo, azione)
+
+    def mostra_impatto_layer(self):
+        """Show the relationships lost and the chains hanging from the layer selected in the graph tab."""
+        riga = self.tabellaGrafo.currentRow()
+        if riga < 0:
+            QMessageBox.warning(self, "Layer Deletion Impact", "Select a layer.")
+            return
+        layer_id = self.tabellaGrafo.item(riga, 0).data(Qt.UserRole)
+
+        # Relazioni che spariscono con il layer, poi le catene che ne dipendono
+        dirette = sorted(self.modelloRelazioni.impatto(layer_id), key=str)
+        a_valle = [(relazione_id, profondita) for relazione_id, profondita
+                   in self.modelloRelazioni.grafo.a_valle(layer_id) if relazione_id not in dirette]
+        self._mostra_impatto(
+            "Layer Deletion Impact",
+            f"Removing layer {self.tabellaGrafo.item(riga, 0).text()} removes the relationships at depth 0; "
+            f"the ones below hang from it.",
+            [(relazione_id, 0) for relazione_id in dirette] + a_valle)
+
+    def _conferma_ciclo(self, relation, escludi=None):
+        """Ask for confirmation if a relationship would close a cycle of layers.
+
+        :param escludi: optional id of the relationship being replaced.
+        """
+        if not self.modelloRelazioni.grafo.chiuderebbe_ciclo(
+                relation.referencedLayerId(), relation.referencingLayerId(), escludi):
+            return True
+        risposta = QMessageBox.question(
+            self, "Cycle",
+            "This relationship closes a cycle of parent/child relationships, which can make QGIS forms "
+            "recurse.\nSave it anyway?",
+            QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+        return risposta == QMessageBox.Yes
+
+    def _apri_storico(self):
+        """Open the history journal of the current project.
+
+        The in-memory journal of a project that had no file is kept aside
+        until :meth:`_progetto_salvato` tells whether the new file name comes
+        from saving that same project, rather than from opening another one.
+        """
+        project = QgsProject.instance()
+        # I progetti salvati in un database non hanno una cartella in cui tenere il diario
+        file_progetto = project.fileName() if project.projectStorage() is None else ''
+        percorso = percorso_storico(file_progetto)
+        if self.storico is not None and self._percorso_storico == percorso:
+            return
+        self._percorso_storico = percorso
+        limite = QSettings().value(CHIAVE_LIMITE_STORICO, LIMITE_PREDEFINITO, type=int)
+        try:
+            storico = StoricoRelazioni(percorso, limite)
+        except (sqlite3.Error, OSError) as errore:
+            iface.messageBar().pushWarning(
+                "Relationship Manager",
+                f"The relationship history cannot be saved to {percorso} ({errore}); "
+                "it is kept in memory until QGIS is closed.")
+            storico = StoricoRelazioni(IN_MEMORIA, limite)
+        self._scarta_storico_non_salvato()
+        if self.storico is not None:
+            if self.storico.in_memoria and not storico.in_memoria and len(self.storico):
+                self._storico_non_salvato = self.storico
+            else:
+                self.storico.chiudi()
+        self.storico = storico
+
+    def _progetto_salvato(self):
+        """Carry the history of a project saved for the first time over to its new, empty journal."""
+        non_salvato = self._storico_non_salvato
+        self._storico_non_salvato = None
+        if non_salvato is None:
+            return
+        if not self.storico.in_memoria and not len(self.storico):
+            non_salvato.copia_in(self.storico)
+        non_salvato.chiudi()
+
+    def _progetto_chiuso(self):
+        """Forget the in-memory history of a project that is closed without being saved."""
+        self._scarta_storico_non_salvato()
+        if self.storico is not None and self.storico.in_memoria and len(self.storico):
+            self.storico.chiudi()
+            self.storico = StoricoRelazioni(IN_MEMORIA, self.storico.limite)
+
+    def _scarta_storico_non_salvato(self):
+        """Close the in-memory history kept aside, if another project took its place."""
+        if self._storico_non_salvato is not None:
+            self._storico_non_salvato.chiudi()
+            self._storico_non_salvato = None
+
+    def _segna_modificato(self):
+        """Mark the project as modified and schedule a deferred save if auto-save is on."""
+        QgsProject.instance().setDirty(True)
+        if self.chkSalvataggioAutomatico.isChecked():
+            # Riavvia il timer: più modifiche ravvicinate producono un solo salvataggio
+            self._timer_salvataggio.start()
+
+    def salva_progetto(self, esplicito=False):
+        """Write the project to disk, cancelling any pending deferred save."""
+        self._timer_salvataggio.stop()
+        project = QgsProject.instance()
+        if not project.fileName():
+            if esplicito:
+                QMessageBox.warning(self, "Save", "The project has never been saved: save it from QGIS first.")
+            return False
 
-        # Iterate through all relations and add to the list
-        for relation in relation_manager.relations().values():
-            self.listaRelazioni.addItem(f'{relation.id()}: {relation.name()}')
+        salvato = project.write()
+        if esplicito:
+            if salvato:
+                QMessageBox.information(self, "Save", "Project saved successfully!")
+            else:
+                QMessageBox.warning(self, "Save", f"Could not save the project: {project.error()}")
+        return salvato
+
+    def imposta_salvataggio_automatico(self, attivo):
+        """Enable or disable the deferred auto-save, remembering the choice."""
+        QSettings().setValue(CHIAVE_SALVATAGGIO_AUTOMATICO, attivo)
+        if not attivo:
+            self._timer_salvataggio.stop()
+
+    def _id_relazione_selezionata(self):
+        """Return the id of the selected relationship, or None."""
+        indice = self.listaRelazioni.currentIndex()
+        if not indice.isValid():
+            return None
+        return indice.data(RelazioniModel.RelazioneIdRole)
+
+    def _id_relazioni_selezionate(self):
+        """Return the ids of the selected relationships, in table order."""
+        righe = sorted(self.listaRelazioni.selectionModel().selectedRows(), key=lambda indice: indice.row())
+        return [indice.data(RelazioniModel.RelazioneIdRole) for indice in righe]
 
     def esporta_relazioni(self):
-        """Export relationships to a JSON file."""
-        file_path, _ = QFileDialog.getSaveFileName(self, "Export relationships", "", "JSON Files (*.json)")
-        if file_path:
-            relazioni = self.ottieni_relazioni()
-            with open(file_path, 'w') as file:
-                json.dump(relazioni, file, indent=4)
-            QMessageBox.information(self, "Export", "Relationships exported successfully!")
+        """Export relationships to a JSON or JSON Lines file in the background."""
+        file_path, filtro = QFileDialog.getSaveFileName(self, "Export relationships", "", FILTRO_FILE_RELAZIONI)
+        if not file_path:
+            return
+
+        # Le relazioni vengono lette sul thread principale, la scrittura avviene nel task
+        task = EsportaRelazioniTask(file_path, self._is_jsonl(file_path, filtro), list(self.itera_relazioni()))
+        self._avvia_task(task, lambda: QMessageBox.information(self, "Export", "Relationships exported successfully!"))
 
     def carica_relazioni(self):
-        """Load relationships from a JSON file."""
-        file_path, _ = QFileDialog.getOpenFileName(self, "Load relationships", "", "JSON Files (*.json)")
+        """Load relationships from a JSON or JSON Lines file in the background."""
+        file_path, filtro = QFileDialog.getOpenFileName(self, "Load relationships", "", FILTRO_FILE_RELAZIONI)
         if not file_path:
             return  # Esci se l'utente annulla il file dialog
 
-        with open(file_path, 'r') as file:
-            try:
-                relazioni = json.load(file)
-                if not relazioni:
-                    QMessageBox.warning(self, "Load Error", "The file is empty or invalid.")
-                    return
-            except json.JSONDecodeError:
-                QMessageBox.warning(self, "Load Error", "The file format is invalid. Please check the JSON file.")
-                return
+        # Tabelle di lookup costruite una sola volta sul thread principale
+        layer_per_nome, campi_per_layer = indice_layer(QgsProject.instance())
+        task = ImportaRelazioniTask(file_path, self._is_jsonl(file_path, filtro), layer_per_nome, campi_per_layer)
+        self._avvia_task(task, lambda: self._mostra_esito_importazione(
+            self.aggiungi_relazioni(task.valide, task.fallite)))
+
+    def aggiungi_relazioni(self, definizioni, fallite=None):
+        """Add validated relationship definitions to the project in one batch.
+
+        :returns: dict with the names of the loaded relationships (``caricate``)
+            and the ``(name, reason)`` pairs of the rejected ones (``fallite``).
+        """
+        modifiche, esito = self.catalogo.prepara(definizioni)
+        esito['fallite'] = list(fallite or []) + esito['fallite']
+
+        # Tutte le relazioni valide in un solo comando annullabile, con un solo segnale di modifica
+        if len(modifiche):
+            self._esegui_modifica(IMPORTA, f"Imported {len(modifiche)} relationships", modifiche.relazioni)
+        return esito
+
+    @staticmethod
+    def _is_jsonl(file_path, filtro):
+        """Tell whether a file should be handled as JSON Lines."""
+        return e_jsonl(file_path) or filtro.startswith('JSON Lines')
+
+    def _avvia_task(self, task, al_completamento):
+        """Run a background task, tracking it in the progress bar.
+
+        :param al_completamento: callable run on the main thread when the task succeeds.
+        """
+        self._task = task
+        for pulsante in self._pulsanti_task:
+            pulsante.setEnabled(False)
+        self.barraProgresso.setValue(0)
+        self.barraProgresso.show()
+        self.btnAnnulla.show()
+
+        task.progressChanged.connect(lambda valore: self.barraProgresso.setValue(int(valore)))
+        task.taskCompleted.connect(lambda: self._termina_task(task, al_completamento))
+        task.taskTerminated.connect(lambda: self._termina_task(task, None))
+        QgsApplication.taskManager().addTask(task)
+
+    def _termina_task(self, task, al_completamento):
+        """Restore the dialog when a background task ends."""
+        self._task = None
+        for pulsante in self._pulsanti_task:
+            pulsante.setEnabled(True)
+        self.barraProgresso.hide()
+        self.btnAnnulla.hide()
+
+        if al_completamento:
+            al_completamento()
+        elif task.errore:
+            QMessageBox.warning(self, task.description(), task.errore)
+
+    def annulla_task(self):
+        """Cancel the running background task."""
+        if self._task:
+            self._task.cancel()
+
+    def verifica_integrita(self):
+        """Count, and optionally select, the orphan child features of every relationship."""
+        seleziona = self.chkSelezionaOrfani.isChecked()
+        verifiche = []
+        non_verificabili = []
+        for relation in QgsProject.instance().relationManager().relations().values():
+            verifica, errore = prepara_verifica(relation, seleziona)
+            if errore:
+                non_verificabili.append((relation.name(), errore))
+            else:
+                verifiche.append(verifica)
+
+        if not verifiche:
+            QMessageBox.warning(self, "Check Integrity", "There are no relationships to check.")
+            return
 
+        task = VerificaIntegritaTask(verifiche)
+        self._avvia_task(task, lambda: self._mostra_integrita(task.risultati, non_verificabili))
+
+    def _mostra_integrita(self, risultati, non_verificabili):
+        """Show the orphan counts and select the orphan features if requested."""
+        # Un'unica selezione per layer figlio, anche se usato da più relazioni
+        ids_per_layer = {}
+        for risultato in risultati:
+            if risultato['ids_orfani']:
+                ids_per_layer.setdefault(risultato['layer_figlio_id'], set()).update(risultato['ids_orfani'])
         project = QgsProject.instance()
-        relation_manager = project.relationManager()
+        for layer_id, ids in ids_per_layer.items():
+            layer = project.mapLayer(layer_id)
+            if layer:
+                layer.selectByIds(list(ids))
+
+        righe = [(r['nome'], str(r['controllati']), str(r['orfani'])) for r in risultati]
+        righe += [(nome, "-", motivo) for nome, motivo in non_verificabili]
+        self._mostra_tabella("Referential Integrity", ("Relationship", "Child Features", "Orphans"), righe)
+
+    def verifica_integrita_sql(self):
+        """Count the orphan child features with one anti-join query per relationship.
+
+        Only relationships whose layers share a PostgreSQL database or a
+        GeoPackage/SQLite file are checked; the others are listed as such.
+        """
+        piani = []
+        non_verificabili = []
+        for relation in QgsProject.instance().relationManager().relations().values():
+            piano, errore = prepara_verifica_sql(relation)
+            if errore:
+                non_verificabili.append((relation.name(), errore))
+            else:
+                piani.append(piano)
 
-        # Variabili per tracciare lo stato
-        relazioni_fallite = []
-        relazioni_caricate = []
+        if not piani:
+            QMessageBox.warning(self, "Check Integrity in Database",
+                                "No relationship has both layers in the same database. Use \"Check Integrity\" instead.")
+            return
 
-        for relazione_id, relazione in relazioni.items():
-            if not relazione_id:
-                relazioni_fallite.append(f"Invalid ID for relationship '{relazione['nome']}'")
-                continue
+        task = VerificaIntegritaSqlTask(piani)
+        self._avvia_task(task, lambda: self._mostra_integrita_sql(task.risultati, non_verificabili))
 
-            # Verifica se i layer esistono nel progetto
-            layers_figlio = project.mapLayersByName(relazione['referencing_layer'])
-            layers_padre = project.mapLayersByName(relazione['referenced_layer'])
+    def _mostra_integrita_sql(self, risultati, non_verificabili):
+        """Show the orphan counts computed by the database."""
+        righe = [(r['nome'], r['errore'] or str(r['orfani'])) for r in risultati]
+        righe += [(nome, motivo) for nome, motivo in non_verificabili]
+        self._mostra_tabella("Referential Integrity", ("Relationship", "Orphans"), righe)
 
-            if not layers_figlio or not layers_padre:
-                relazioni_fallite.append(f"Layer not found for relationship '{relazione['nome']}' (Parent: {relazione['referenced_layer']}, Child: {relazione['referencing_layer']})")
-                continue
+    def mostra_statistiche_relazione(self):
+        """Show the child-count histogram and cardinality statistics of the selected relationship.
 
-            layer_figlio = layers_figlio[0]
-            layer_padre = layers_padre[0]
-
-            # Crea una nuova relazione
-            relation = QgsRelation()
-            relation.setName(relazione['nome'])
-            relation.setId(relazione_id)  # Usa l'ID dalla struttura JSON
-            relation.setReferencingLayer(layer_figlio.id())
-            relation.setReferencedLayer(layer_padre.id())
-
-            # Aggiungi le coppie di chiavi
-            valid_keys = True
-            for chiave_padre, chiave_figlio in relazione['chiavi'].items():
-                if chiave_padre in layer_padre.fields().names() and chiave_figlio in layer_figlio.fields().names():
-                    relation.addFieldPair(chiave_padre, chiave_figlio)
-                else:
-                    relazioni_fallite.append(f"Invalid key pair: {chiave_padre} -> {chiave_figlio} in relationship '{relazione['nome']}'")
-                    valid_keys = False
-                    break
-
-            # Aggiungi la relazione al manager se le chiavi sono valide
-            if valid_keys:
-                if relation_manager.addRelation(relation) or relation_manager.relation(relazione_id):
-                    # La relazione è stata aggiunta o esiste già, considerala come caricata
-                    relazioni_caricate.append(relazione['nome'])
-                else:
-                    relazioni_fallite.append(f"Failed to add relationship '{relazione['nome']}' to the project")
+        The histogram is cached per relationship and reused as long as the
+        relationship keys and the data of both layers are unchanged.
+        """
+        relazione_id = self._id_relazione_selezionata()
+        if not relazione_id:
+            QMessageBox.warning(self, "Relationship Statistics", "Select a relationship.")
+            return
+        relation = QgsProject.instance().relationManager().relation(relazione_id)
+
+        chiave = chiave_cache_statistiche(relation)
+        in_cache = self._cache_statistiche.get(relazione_id)
+        if chiave is not None and in_cache and in_cache[0] == chiave:
+            self._mostra_statistiche(relation.name(), *in_cache[1:])
+            return
+
+        piano, errore = prepara_statistiche(relation)
+        if errore:
+            QMessageBox.warning(self, "Relationship Statistics", errore)
+            return
 
-        # Mostra i risultati all'utente
-        if relazioni_fallite:
-            QMessageBox.warning(self, "Load Errors", f"Some relationships failed to load:\n" + "\n".join(relazioni_fallite))
-        if relazioni_caricate:
-            QMessageBox.information(self, "Load Success", f"Relationships loaded successfully:\n" + "\n".join(relazioni_caricate))
+        task = StatisticheRelazioneTask(piano)
+
+        def al_completamento():
+            self._cache_statistiche[relazione_id] = (chiave, task.istogramma, task.statistiche, task.metodo)
+            self._mostra_statistiche(relation.name(), task.istogramma, task.statistiche, task.metodo)
+
+        self._avvia_task(task, al_completamento)
+
+    def _mostra_statistiche(self, nome, istogramma, statistiche, metodo):
+        """Show a cardinality summary above the child-count histogram."""
+        if statistiche['padri']:
+            riepilogo = (
+                f"{statistiche['padri']} parents, {statistiche['figli']} linked children ({metodo}).\n"
+                f"Children per parent: min {statistiche['minimo']}, max {statistiche['massimo']}, "
+                f"mean {statistiche['media']:.2f}, p99 {statistiche['percentile']}.\n"
+                f"Parents without children: {statistiche['senza_figli']}."
+            )
+        else:
+            riepilogo = "The parent layer has no features with a key."
+        righe = [(str(numero), str(istogramma[numero])) for numero in sorted(istogramma)]
+        self._mostra_tabella(f"Relationship Statistics: {nome}", ("Children", "Parents"), righe, riepilogo)
+
+    def analizza_indici(self):
+        """Check which child key fields of the relationships are indexed."""
+        voci = prepara_indici(QgsProject.instance().relationManager().relations().values())
+        if not voci:
+            QMessageBox.warning(self, "Index Advisor", "There are no relationships to analyze.")
+            return
 
-        # Aggiorna la lista delle relazioni se alcune sono state caricate
-        if relazioni_caricate:
-            self.carica_lista_relazioni()
+        task = AnalisiIndiciTask(voci)
+        self._avvia_task(task, lambda: self._mostra_indici(voci))
+
+    def _mostra_indici(self, voci):
+        """Show the index status of every child key, offering to create the missing indexes."""
+        righe = [(v['layer'], ", ".join(v['campi']), ", ".join(v['relazioni']),
+                  v['stato'] + (f" ({v['errore']})" if v['errore'] else "")) for v in voci]
+        mancanti = [voce for voce in voci if da_creare(voce)]
+        azione = None
+        if mancanti:
+            azione = (f"Create {len(mancanti)} Missing Indexes", lambda: self.crea_indici(mancanti))
+        self._mostra_tabella("Index Advisor", ("Child Layer", "Key Fields", "Relationships", "Index"), righe,
+                             azione=azione)
+
+    def crea_indici(self, voci):
+        """Create the given indexes: database ones in the background, then provider ones.
+
+        Only the provider ``createAttributeIndex`` calls run on the main
+        thread; the lookups timed around them run in background tasks.
+        """
+        voci = [dict(voce, errore=None) for voce in voci]
+        task = CreaIndiciTask(voci)
+
+        def al_completamento():
+            project = QgsProject.instance()
+            da_misurare = []
+            for voce in voci:
+                layer = project.mapLayer(voce['layer_id'])
+                if not voce['origine'] and layer:
+                    crea_indice_provider(voce, layer)
+                    if not voce['errore']:
+                        da_misurare.append(voce)
+            if da_misurare:
+                misura = MisuraIndiciTask(da_misurare)
+                self._avvia_task(misura, lambda: self._mostra_indici_creati(voci))
+            else:
+                self._mostra_indici_creati(voci)
 
+        self._avvia_task(task, al_completamento)
+
+    def _mostra_indici_creati(self, voci):
+        """Show the created indexes with the mean key lookup time before and after."""
+        def millisecondi(valore):
+            return "-" if valore is None else f"{valore:.1f}"
+
+        righe = []
+        for voce in voci:
+            if voce['errore']:
+                esito = voce['errore']
+            elif voce['prima'] and voce['dopo']:
+                esito = f"{voce['stato']}, {voce['prima'] / voce['dopo']:.1f}x faster"
+            else:
+                esito = voce['stato']
+            righe.append((voce['layer'], ", ".join(voce['campi']), esito,
+                          millisecondi(voce['prima']), millisecondi(voce['dopo'])))
+        self._mostra_tabella("Index Advisor", ("Child Layer", "Key Fields", "Result", "Lookup Before (ms)",
+                                               "Lookup After (ms)"), righe)
+
+    def _mostra_tabella(self, titolo, intestazioni, righe, testo=None, azione=None):
+        """Show read-only tabular results in a dialog, optionally preceded by a text.
+
+        :param azione: optional ``(label, callable)`` pair adding a button
+            that closes the dialog and runs the callable.
+        """
+        dlg = QDialog(self)
+        dlg.setWindowTitle(titolo)
+        layout = QVBoxLayout(dlg)
+        if testo:
+            layout.addWidget(QLabel(testo))
+
+        tabella = QTableWidget(len(righe), len(intestazioni))
+        tabella.setHorizontalHeaderLabels(intestazioni)
+        tabella.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        tabella.verticalHeader().hide()
+        tabella.horizontalHeader().setStretchLastSection(True)
+        for numero, riga in enumerate(righe):
+            for colonna, valore in enumerate(riga):
+                tabella.setItem(numero, colonna, QTableWidgetItem(valore))
+        tabella.resizeColumnsToContents()
+        layout.addWidget(tabella)
+
+        buttonBox = QDialogButtonBox(QDialogButtonBox.Close)
+        buttonBox.rejected.connect(dlg.reject)
+        if azione:
+            btnAzione = buttonBox.addButton(azione[0], QDialogButtonBox.AcceptRole)
+            btnAzione.clicked.connect(dlg.accept)
+        layout.addWidget(buttonBox)
+        dlg.resize(600, 400)
+        if dlg.exec_() == QDialog.Accepted and azione:
+            azione[1]()
+
+    def _mostra_esito_importazione(self, esito):
+        """Show a summary of an import, with the details of the rejected relationships."""
+        caricate = esito['caricate']
+        fallite = esito['fallite']
+
+        box = QMessageBox(self)
+        box.setWindowTitle("Load Relationships")
+        box.setIcon(QMessageBox.Warning if fallite else QMessageBox.Information)
+        box.setText(f"{len(caricate)} relationships loaded, {len(fallite)} failed.")
+        if fallite:
+            # Raggruppa gli errori per motivo per un riepilogo compatto
+            motivi = Counter(motivo.split(':')[0] for _, motivo in fallite)
+            box.setInformativeText("\n".join(f"{conteggio} x {motivo}" for motivo, conteggio in motivi.most_common()))
+            box.setDetailedText("\n".join(f"{nome}: {motivo}" for nome, motivo in fallite))
+        box.exec_()
 
     def apri_modifica_relazione(self):
         """Open the dialog to edit the selected relationship."""
-        selected = self.listaRelazioni.currentItem()
-        if not selected:
+        relazione_id = self._id_relazione_selezionata()
+        if not relazione_id:
             QMessageBox.warning(self, "Error", "Select a relationship to edit.")
             return
 
-        relazione_id = selected.text().split(":")[0]
-
-        # Get the selected relation data
-        relation = QgsProject.instance().relationManager().relation(relazione_id)
-        if not relation:
+        # Retrieve the cached relation details
+        relazione_details = self.modelloRelazioni.dettagli(relazione_id)
+        if not relazione_details:
             QMessageBox.warning(self, "Error", "Relationship not found.")
             return
 
-        # Retrieve relation details
-        relazione_details = self.ottieni_dettagli_relazione(relation)
-
         # Open the dialog to modify the relationship
         dialog = QDialog(self)
         dialog.setWindowTitle(f"Edit Relationship: {relazione_details['id']}")  # Mostra l'ID nella finestra
@@ -188,47 +877,51 @@ class RelazioniPluginDialog(QDialog):
         layer_padre = self._crea_layer_combo(relazione_details['layer_padre'])
         layer_figlio = self._crea_layer_combo(relazione_details['layer_figlio'])  # Verifica layer figlio
 
-        chiavi_padre = self._crea_field_combo(layer_padre.currentText(), list(relazione_details['chiavi'].keys())[0])
-        chiavi_figlio = self._crea_field_combo(layer_figlio.currentText(), list(relazione_details['chiavi'].values())[0])
+        # Tutte le coppie di chiavi della relazione, anche composite
+        editor_chiavi = EditorChiavi(self.catalogoLayer, layer_padre, layer_figlio, relazione_details['chiavi'])
 
         layout.addRow("Relationship Name:", nome_relazione)
         layout.addRow("Parent Layer:", layer_padre)
         layout.addRow("Child Layer:", layer_figlio)
-        layout.addRow("Parent Key:", chiavi_padre)
-        layout.addRow("Child Key:", chiavi_figlio)
+        layout.addRow("Keys:", editor_chiavi)
 
         buttonBox = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
         layout.addWidget(buttonBox)
         dialog.setLayout(layout)
 
+        def conferma():
+            chiavi = self._chiavi_editor(editor_chiavi)
+            if chiavi is not None and self.modifica_relazione_esistente(relazione_details['id'], {
+                'nome': nome_relazione.text(),
+                'layer_padre': layer_padre.currentText(),
+                'layer_figlio': layer_figlio.currentText(),
+                'chiavi': chiavi
+            }):
+                dialog.accept()
+
         # Connect the confirm button
-        buttonBox.accepted.connect(lambda: self.modifica_relazione_esistente(relazione_details['id'], {
-            'nome': nome_relazione.text(),
-            'layer_padre': layer_padre.currentText(),
-            'layer_figlio': layer_figlio.currentText(),
-            'chiavi': {chiavi_padre.currentText(): chiavi_figlio.currentText()}
-        }))
+        buttonBox.accepted.connect(conferma)
         buttonBox.rejected.connect(dialog.reject)
 
         dialog.exec()
 
 
     def duplica_relazione(self):
-        """Duplicate the selected relationship."""
-        selected = self.listaRelazioni.currentItem()
-        if not selected:
+        """Duplicate the selected relationship, or all the selected ones at once."""
+        selezionate = self._id_relazioni_selezionate()
+        if len(selezionate) > 1:
+            self.duplica_relazioni(selezionate)
+            return
+
+        relazione_id = self._id_relazione_selezionata()
+        if not relazione_id:
             QMessageBox.warning(self, "Error", "Select a relationship to duplicate.")
             return
 
-        relazione_id = selected.text().split(":")[0]
-        project = QgsProject.instance()
-        relation = project.relationManager().relation(relazione_id)
+        relazione_details = self.modelloRelazioni.dettagli(relazione_id)
 
         # Verifica se il layer padre e figlio esistono
-        layer_figlio = project.mapLayersByName(relation.referencingLayer().name())
-        layer_padre = project.mapLayersByName(relation.referencedLayer().name())
-
-        if not layer_figlio or not layer_padre:
+        if not relazione_details or not relazione_details['layer_figlio'] or not relazione_details['layer_padre']:
             QMessageBox.warning(self, "Error", "Parent or child layer not found.")
             return
 
@@ -243,52 +936,92 @@ class RelazioniPluginDialog(QDialog):
         nuova_relazione = {
             'id': nuovo_id,
             'nome': nuovo_nome,
-            'layer_figlio': layer_figlio[0].name(),
-            'layer_padre': layer_padre[0].name(),
-            'chiavi': relation.fieldPairs()
+            'layer_figlio': relazione_details['layer_figlio'],
+            'layer_padre': relazione_details['layer_padre'],
+            'chiavi': relazione_details['chiavi']
         }
 
-        # Aggiungere la nuova relazione al progetto
-        self.crea_relazione_esistente(nuova_relazione)  # Rimuove il controllo condizionale
-        
-        # Aggiungere l'azione alla cronologia
-        self.add_to_history(f"Duplicated relationship: {nuovo_nome}", nuova_relazione)
-        
-        QMessageBox.information(self, "Duplicate", "Relationship duplicated successfully!")
+        # Aggiungere la nuova relazione al progetto, registrandola come duplicato
+        self.crea_relazione_esistente(nuova_relazione, DUPLICA)
 
-        # Aggiornare la lista delle relazioni
-        self.carica_lista_relazioni()
+    def duplica_relazioni(self, ids):
+        """Duplicate several relationships in one batch, naming the copies with a common suffix."""
+        suffisso, ok = QInputDialog.getText(
+            self, "Duplicate Relationships", f"Suffix for the names of the {len(ids)} copies:", text=" (copy)")
+        if not ok or not suffisso:
+            return
+
+        # Le copie collegano gli stessi layer degli originali, con la stessa forza
+        saltate = []
+        with self._modifiche_in_blocco(DUPLICA, "Duplicated {n} relationships") as modifiche:
+            for relazione_id in ids:
+                dettagli = self.modelloRelazioni.dettagli(relazione_id)
+                if not dettagli or not dettagli['valida']:
+                    saltate.append(dettagli['nome'] if dettagli else relazione_id)
+                    continue
+                modifiche.aggiungi(crea_relazione(dict(
+                    dettagli, id=f'duplicated_{relazione_id}_{uuid.uuid4()}', nome=dettagli['nome'] + suffisso)))
+
+        messaggio = f"{len(ids) - len(saltate)} relationships duplicated."
+        if saltate:
+            messaggio += "\nSkipped, parent or child layer or key fields not found: " + ", ".join(saltate)
+        QMessageBox.information(self, "Duplicate", messaggio)
 
     def elimina_relazione(self):
-        """Delete the selected relationship."""
-        selected = self.listaRelazioni.currentItem()
-        if not selected:
-            QMessageBox.warning(self, "Error", "Select a relationship to delete.")
+        """Delete the selected relationship, or all the selected ones at once."""
+        selezionate = self._id_relazioni_selezionate()
+        if len(selezionate) > 1:
+            self.elimina_relazioni(selezionate)
             return
 
-        relazione_id = selected.text().split(":")[0]
-        project = QgsProject.instance()
-        relation_manager = project.relationManager()
+        relazione_id = self._id_relazione_selezionata()
+        if not relazione_id:
+            QMessageBox.warning(self, "Error", "Select a relationship to delete.")
+            return
 
-        relation = relation_manager.relation(relazione_id)
-        if not relation:
+        relazione_details = self.modelloRelazioni.dettagli(relazione_id)
+        if not relazione_details:
             QMessageBox.warning(self, "Error", "Relationship not found.")
             return
 
-        # Save current state to history before deletion
-        relazione_details = self.ottieni_dettagli_relazione(relation)
-        self.add_to_history("delete", relazione_details)
-
-        confirm = QMessageBox.question(
-            self, "Delete Relationship",
-            "Are you sure you want to delete this relationship?", 
-            QMessageBox.Yes | QMessageBox.No
-        )
-        if confirm == QMessageBox.Yes:
-            relation_manager.removeRelation(relazione_id)
-            self.carica_lista_relazioni()
+        def elimina():
+            self._esegui_modifica(ELIMINA, f"Deleted relationship {relazione_details['nome']}", {relazione_id: None})
             QMessageBox.information(self, "Delete", "Relationship deleted successfully!")
 
+        # Anteprima dell'impatto: la relazione e le catene che partono dal suo layer figlio
+        a_valle = self.modelloRelazioni.grafo.a_valle(relazione_details['layer_figlio_id'])
+        self._mostra_impatto(
+            "Delete Relationship",
+            f"Are you sure you want to delete relationship {relazione_details['nome']}?\n"
+            f"{len(a_valle)} relationships hang from its child layer {relazione_details['layer_figlio']}.",
+            [(relazione_id, 0)] + [voce for voce in a_valle if voce[0] != relazione_id],
+            ("Delete", elimina))
+
+    def elimina_relazioni(self, ids):
+        """Delete several relationships in one batch, after previewing the impact."""
+        def elimina():
+            with self._modifiche_in_blocco(ELIMINA, "Deleted {n} relationships") as modifiche:
+                for relazione_id in ids:
+                    modifiche.rimuovi(relazione_id)
+            QMessageBox.information(self, "Delete", f"{len(ids)} relationships deleted successfully!")
+
+        # Anteprima: le relazioni da eliminare, poi le catene che partono dai loro layer figlio
+        impatto = [(relazione_id, 0) for relazione_id in ids]
+        visti = set(ids)
+        layer_figli = dict.fromkeys(self.modelloRelazioni.dettagli(relazione_id)['layer_figlio_id']
+                                    for relazione_id in ids)
+        for layer_id in layer_figli:
+            for relazione_id, profondita in self.modelloRelazioni.grafo.a_valle(layer_id):
+                if relazione_id not in visti:
+                    visti.add(relazione_id)
+                    impatto.append((relazione_id, profondita))
+        self._mostra_impatto(
+            "Delete Relationships",
+            f"Are you sure you want to delete {len(ids)} relationships?\n"
+            f"{len(impatto) - len(ids)} other relationships hang from their child layers.",
+            impatto,
+            ("Delete", elimina))
+
     def crea_nuova_relazione(self):
         """Create a new relationship."""
         dialog = QDialog(self)
@@ -299,330 +1032,304 @@ class RelazioniPluginDialog(QDialog):
         layer_padre = self._crea_layer_combo(None)
         layer_figlio = self._crea_layer_combo(None)
 
-        chiavi_padre = self._crea_field_combo(layer_padre.currentText(), None)
-        chiavi_figlio = self._crea_field_combo(layer_figlio.currentText(), None)
+        # Le chiavi seguono il layer scelto; la chiave figlio è filtrata per tipo compatibile
+        editor_chiavi = EditorChiavi(self.catalogoLayer, layer_padre, layer_figlio)
 
         layout.addRow("Relationship Name:", nome_relazione)
         layout.addRow("Parent Layer:", layer_padre)
         layout.addRow("Child Layer:", layer_figlio)
-        layout.addRow("Parent Key:", chiavi_padre)
-        layout.addRow("Child Key:", chiavi_figlio)
+        layout.addRow("Keys:", editor_chiavi)
 
         buttonBox = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
         layout.addWidget(buttonBox)
         dialog.setLayout(layout)
 
+        def conferma():
+            chiavi = self._chiavi_editor(editor_chiavi)
+            if chiavi is not None and self.crea_relazione_esistente({
+                'nome': nome_relazione.text(),
+                'layer_padre': layer_padre.currentText(),
+                'layer_figlio': layer_figlio.currentText(),
+                'chiavi': chiavi
+            }):
+                dialog.accept()
+
         # Connect the confirm button
-        buttonBox.accepted.connect(lambda: self.crea_relazione_esistente({
-            'nome': nome_relazione.text(),
-            'layer_padre': layer_padre.currentText(),
-            'layer_figlio': layer_figlio.currentText(),
-            'chiavi': {chiavi_padre.currentText(): chiavi_figlio.currentText()}
-        }))
+        buttonBox.accepted.connect(conferma)
         buttonBox.rejected.connect(dialog.reject)
 
         dialog.exec()
 
-    def crea_relazione_esistente(self, nuova_relazione):
-        """Create a new relationship in the project."""
-        project = QgsProject.instance()
-
-        # Verifica l'esistenza dei layer
-        layer_figlio = project.mapLayersByName(nuova_relazione['layer_figlio'])
-        layer_padre = project.mapLayersByName(nuova_relazione['layer_padre'])
-
-        if not layer_figlio or not layer_padre:
-            QMessageBox.warning(self, "Error", "Parent or child layer not found.")
-            return False
-
-        layer_figlio = layer_figlio[0]
-        layer_padre = layer_padre[0]
-
-        # Genera un ID univoco basato sul nome del layer e il nome della relazione
-        relation_id = nuova_relazione['id']
-
-        # Crea la relazione
-        relation = QgsRelation()
-        relation.setName(nuova_relazione['nome'])
-        relation.setId(relation_id)
-        relation.setReferencingLayer(layer_figlio.id())
-        relation.setReferencedLayer(layer_padre.id())
-
-        # Aggiungi le coppie di chiavi
-        for chiave_padre, chiave_figlio in nuova_relazione['chiavi'].items():
-            if chiave_padre in [field.name() for field in layer_padre.fields()] and chiave_figlio in [field.name() for field in layer_figlio.fields()]:
-                relation.addFieldPair(chiave_padre, chiave_figlio)
-            else:
-                QMessageBox.warning(self, "Error", f"Key fields not found: {chiave_padre}, {chiave_figlio}")
-                return False
-
-        # Aggiungi la relazione al manager delle relazioni
-        relation_manager = project.relationManager()
-        relation_manager.addRelation(relation)
-
-        # Aggiorna la visualizzazione delle relazioni e salva il progetto
-        self.carica_lista_relazioni()
-        self.add_to_history(f"Created new relationship: {nuova_relazione['nome']}")
-        project.setDirty(True)
-        project.write()
-
-        QMessageBox.information(self, "Create", "Relationship created successfully!")
-        return True
-
-
-
     def visualizza_storico(self):
-        """Show the history of relationship modifications."""
+        """Show the history versions of the relationship set."""
         dlg = QDialog(self)
         dlg.setWindowTitle("Modification History")
         layout = QVBoxLayout(dlg)
 
         history_list = QListWidget()
-        for timestamp, action, details in self.history:
-            history_list.addItem(f'{timestamp}: {action} - {details["nome"]}')
+        for seq, timestamp, action, descrizione, modifiche in self.storico.versioni():
+            item = QListWidgetItem(f'{timestamp}: {descrizione} ({modifiche} relationships)')
+            item.setData(Qt.UserRole, seq)
+            history_list.addItem(item)
         layout.addWidget(history_list)
 
-        rollback_button = QPushButton("Rollback to Selected")
-        layout.addWidget(rollback_button)
+        # Numero massimo di versioni conservate nel registro
+        layoutLimite = QFormLayout()
+        limite = QSpinBox()
+        limite.setRange(10, 1000000)
+        limite.setValue(self.storico.limite)
+        layoutLimite.addRow("Versions kept:", limite)
+        layout.addLayout(layoutLimite)
+
+        layoutPulsanti = QHBoxLayout()
+        changes_button = QPushButton("Show Changes")
+        layoutPulsanti.addWidget(changes_button)
+        compare_button = QPushButton("Compare with Current")
+        layoutPulsanti.addWidget(compare_button)
+        restore_button = QPushButton("Restore This Version")
+        layoutPulsanti.addWidget(restore_button)
+        layout.addLayout(layoutPulsanti)
         dlg.setLayout(layout)
 
-        rollback_button.clicked.connect(lambda: self.rollback_modifica(history_list.currentRow(), history_list))
+        def versione_selezionata():
+            item = history_list.currentItem()
+            if item is None:
+                QMessageBox.warning(self, "Error", "Please select a valid history item.")
+                return None
+            return item.data(Qt.UserRole)
+
+        def mostra_modifiche():
+            seq = versione_selezionata()
+            if seq is not None:
+                self._mostra_differenze("Version Changes", self.storico.istantanea_precedente(seq),
+                                        self.storico.istantanea(seq))
+
+        def confronta():
+            seq = versione_selezionata()
+            if seq is not None:
+                self._mostra_differenze("Changes to Restore the Version", self._stato_relazioni(),
+                                        self.storico.istantanea(seq))
+
+        def ripristina():
+            seq = versione_selezionata()
+            if seq is not None:
+                self.ripristina_versione(seq)
+                dlg.accept()
+
+        def imposta_limite():
+            QSettings().setValue(CHIAVE_LIMITE_STORICO, limite.value())
+            self.storico.imposta_limite(limite.value())
+
+        changes_button.clicked.connect(mostra_modifiche)
+        compare_button.clicked.connect(confronta)
+        restore_button.clicked.connect(ripristina)
+        limite.editingFinished.connect(imposta_limite)
         dlg.exec_()
 
-    def rollback_modifica(self, history_index, history_list_widget):
-        """Rollback to a previous relationship modification."""
-        if history_index < 0 or history_index >= len(self.history):
+    def _mostra_differenze(self, titolo, prima, dopo):
+        """Show the relationships added, changed and removed going from one snapshot to another."""
+        aggiunte, modificate, rimosse = differenze(prima, dopo)
+
+        def descrivi(record):
+            chiavi = ', '.join(f'{figlio} → {padre}' for figlio, padre in record['chiavi'].items())
+            return f"{record['layer_padre']} → {record['layer_figlio']} ({chiavi})"
+
+        righe = [("Added", record['nome'], descrivi(record)) for record in aggiunte.values()]
+        righe += [("Changed", dopo_record['nome'], f"{descrivi(prima_record)}  ⇒  {descrivi(dopo_record)}")
+                  for prima_record, dopo_record in modificate.values()]
+        righe += [("Removed", record['nome'], descrivi(record)) for record in rimosse.values()]
+        testo = None if righe else "No differences."
+        self._mostra_tabella(titolo, ("Change", "Relationship", "Definition"), righe, testo)
+
+    def ripristina_versione(self, seq):
+        """Bring the relationship set back to a history version.
+
+        Only the relationships that differ are touched: missing or changed
+        ones are added (a relationship with the same id replaces the current
+        one) and extra ones are removed, as a single undoable command.
+        """
+        istantanea = self.storico.istantanea(seq)
+        if istantanea is None:
             QMessageBox.warning(self, "Error", "Please select a valid history item.")
             return
 
-        timestamp, action, details = self.history[history_index]
+        aggiunte, modificate, rimosse = differenze(self._stato_relazioni(), istantanea)
+        da_aggiungere = list(aggiunte.values()) + [record for _, record in modificate.values()]
+        non_ripristinabili = []
+        with self._modifiche_in_blocco(RIPRISTINA, f"Restored version {seq}") as modifiche:
+            for relazione_id in rimosse:
+                modifiche.rimuovi(relazione_id)
+            for record in da_aggiungere:
+                relation = self._relazione_da_dettagli(record)
+                if relation is None:
+                    non_ripristinabili.append(record['nome'])
+                else:
+                    modifiche.aggiungi(relation)
 
-        if action == "create":
-            # Undo create by deleting the relationship
-            project = QgsProject.instance()
-            relation_manager = project.relationManager()
-            relazione_id = None
-            for rel_id, rel in relation_manager.relations().items():
-                if rel.name() == details['nome']:
-                    relazione_id = rel_id
-                    break
-            if relazione_id:
-                relation_manager.removeRelation(relazione_id)
-                self.carica_lista_relazioni()
-                QMessageBox.information(self, "Rollback", f"Created relationship '{details['nome']}' has been deleted.")
-        elif action == "delete":
-            # Undo delete by recreating the relationship
-            project = QgsProject.instance()
-            relation_manager = project.relationManager()
-
-            # Check if the relationship already exists to avoid duplicates
-            if not relation_manager.relation(details['id']):
-                relation = QgsRelation()
-                relation.setName(details['nome'])
-                relation.setId(details['id'])
-                relation.setReferencingLayer(project.mapLayersByName(details['layer_figlio'])[0].id())
-                relation.setReferencedLayer(project.mapLayersByName(details['layer_padre'])[0].id())
-
-                for chiave_padre, chiave_figlio in details['chiavi'].items():
-                    relation.addFieldPair(chiave_padre, chiave_figlio)
-
-                relation_manager.addRelation(relation)
-                self.carica_lista_relazioni()
-                QMessageBox.information(self, "Rollback", f"Deleted relationship '{details['nome']}' has been restored.")
-        elif action == "edit":
-            # Undo edit by reverting to previous details
-            project = QgsProject.instance()
-            relation_manager = project.relationManager()
-            relazione_id = details['id']
-
-            # Remove the current version
-            relation_manager.removeRelation(relazione_id)
-
-            # Recreate the old version
-            relation = QgsRelation()
-            relation.setName(details['nome'])
-            relation.setId(relazione_id)
-            relation.setReferencingLayer(project.mapLayersByName(details['layer_figlio'])[0].id())
-            relation.setReferencedLayer(project.mapLayersByName(details['layer_padre'])[0].id())
-
-            for chiave_padre, chiave_figlio in details['chiavi'].items():
-                relation.addFieldPair(chiave_padre, chiave_figlio)
-
-            relation_manager.addRelation(relation)
-            self.carica_lista_relazioni()
-            QMessageBox.information(self, "Rollback", f"Edit to relationship '{details['nome']}' has been reverted.")
-        elif action == "duplicate":
-            # Undo duplicate by deleting the duplicated relationship
-            project = QgsProject.instance()
-            relation_manager = project.relationManager()
-            relazione_id = None
-            for rel_id, rel in relation_manager.relations().items():
-                if rel.name() == details['nome']:
-                    relazione_id = rel_id
-                    break
-            if relazione_id:
-                relation_manager.removeRelation(relazione_id)
-                self.carica_lista_relazioni()
-                QMessageBox.information(self, "Rollback", f"Duplicated relationship '{details['nome']}' has been deleted.")
+        messaggio = (f"Version restored: {len(aggiunte)} relationships added, {len(modificate)} changed, "
+                     f"{len(rimosse)} removed.")
+        if non_ripristinabili:
+            messaggio += "\nLayers not found for: " + ", ".join(non_ripristinabili)
+        QMessageBox.information(self, "Rollback", messaggio)
 
-    def ottieni_relazioni(self):
-        """Get all relationships in the project."""
-        relazioni = {}
+    def _relazione_da_dettagli(self, dettagli):
+        """Rebuild a relationship from a history record, or return None if its layers are gone.
+
+        Layers are resolved by id, falling back to the name for layers
+        loaded again with a new id.
+        """
         project = QgsProject.instance()
-        relation_manager = project.relationManager()
-
-        for relation_id, relation in relation_manager.relations().items():
-            # Verifica che `relation` sia effettivamente un oggetto QgsRelation
-            if isinstance(relation, QgsRelation):
-                relazioni[relation.id()] = {
-                    'nome': relation.name(),
-                    'referencing_layer': relation.referencingLayer().name(),
-                    'referenced_layer': relation.referencedLayer().name(),
-                    'chiavi': relation.fieldPairs()
-                }
-            else:
-                print(f"Warning: Relation with ID {relation_id} is not a valid QgsRelation object.")
-        
-        return relazioni
+        layer_ids = []
+        for chiave_id, chiave_nome in (('layer_padre_id', 'layer_padre'), ('layer_figlio_id', 'layer_figlio')):
+            layer = project.mapLayer(dettagli.get(chiave_id) or '') or self.catalogoLayer.layer(dettagli[chiave_nome])
+            if layer is None:
+                return None
+            layer_ids.append(layer.id())
+        return crea_relazione(dict(dettagli, layer_padre_id=layer_ids[0], layer_figlio_id=layer_ids[1]))
 
-    def ottieni_dettagli_relazione(self, relation):
-        """Retrieve details of a specific relation."""
-        if not relation:
-            return {}
+    def ottieni_relazioni(self):
+        """Get all relationships in the project."""
+        return dict(self.itera_relazioni())
 
-        project = QgsProject.instance()
-        
-        # Trova i layer padre e figlio dalla relazione
-        layer_padre = project.mapLayer(relation.referencedLayerId())
-        layer_figlio = project.mapLayer(relation.referencingLayerId())
-        
-        # Assicurati che i layer siano validi
-        if not layer_padre or not layer_figlio:
-            QMessageBox.warning(self, "Error", "Parent or child layer not found.")
-            return {}
-
-        # Ottieni le coppie di chiavi
-        field_pairs = relation.fieldPairs()
-        chiavi = {key: value for key, value in field_pairs.items()}
-
-        return {
-            'id': relation.id(),  # Aggiungi l'ID della relazione
-            'nome': relation.name(),
-            'layer_padre': layer_padre.name(),
-            'layer_figlio': layer_figlio.name(),
-            'chiavi': chiavi
-        }
+    def itera_relazioni(self):
+        """Lazily yield ``(relazione_id, relazione)`` pairs in the export format."""
+        # I dettagli in cache seguono già le modifiche e i nomi correnti dei layer
+        for dettagli in self.modelloRelazioni.relazioni():
+            yield formato_esportazione(dettagli)
 
     def modifica_relazione_esistente(self, relazione_id, nuova_relazione):
         """Edit an existing relationship."""
-        project = QgsProject.instance()
-        relation_manager = project.relationManager()
-
-        # Get the existing relationship details before modification
-        relazione_corrente = relation_manager.relation(relazione_id)
-        dettagli_correnti = self.ottieni_dettagli_relazione(relazione_corrente)
-        self.add_to_history("edit", dettagli_correnti)
-
-        # Remove the existing relationship
-        relation_manager.removeRelation(relazione_id)
-
-        # Create a new relationship with updated parameters
-        layer_figlio = project.mapLayersByName(nuova_relazione['layer_figlio'])[0]
-        layer_padre = project.mapLayersByName(nuova_relazione['layer_padre'])[0]
-
-        relation = QgsRelation()
-        relation.setName(nuova_relazione['nome'])
-        relation.setId(relazione_id)
-        relation.setReferencingLayer(layer_figlio.id())
-        relation.setReferencedLayer(layer_padre.id())
+        # Valida la nuova definizione prima di toccare la relazione esistente
+        relation = self._costruisci_relazione(relazione_id, nuova_relazione)
+        if relation is None or not self._conferma_ciclo(relation, escludi=relazione_id):
+            return False
 
-        for chiave_padre, chiave_figlio in nuova_relazione['chiavi'].items():
-            relation.addFieldPair(chiave_padre, chiave_figlio)
+        # La modifica non cambia la forza della relazione
+        relation.setStrength(QgsProject.instance().relationManager().relation(relazione_id).strength())
 
-        relation_manager.addRelation(relation)
-        self.carica_lista_relazioni()
+        # Una relazione con lo stesso ID sostituisce quella esistente
+        self._esegui_modifica(MODIFICA, f"Edited relationship {nuova_relazione['nome']}", {relazione_id: relation})
         QMessageBox.information(self, "Edit", "Relationship modified successfully!")
+        return True
 
-    def crea_relazione_esistente(self, nuova_relazione):
-        """Create a new relationship in the project."""
-        project = QgsProject.instance()
-
-        # Verifica l'esistenza dei layer
-        layer_figlio = project.mapLayersByName(nuova_relazione['layer_figlio'])
-        layer_padre = project.mapLayersByName(nuova_relazione['layer_padre'])
+    def crea_relazione_esistente(self, nuova_relazione, azione=CREA):
+        """Create a new relationship in the project.
 
+        :param nuova_relazione: dict as for :meth:`_costruisci_relazione`, with
+            an optional ``id``; by default it is derived from the layers and the name.
+        :param azione: history action recorded, :data:`CREA` or :data:`DUPLICA`.
+        """
+        layer_figlio = self.catalogoLayer.layer(nuova_relazione['layer_figlio'])
+        layer_padre = self.catalogoLayer.layer(nuova_relazione['layer_padre'])
         if not layer_figlio or not layer_padre:
             QMessageBox.warning(self, "Error", "Parent or child layer not found.")
-            return
-
-        layer_figlio = layer_figlio[0]  # Seleziona il primo layer corrispondente
-        layer_padre = layer_padre[0]
+            return False
 
         # Genera un ID univoco basato sul nome del layer e il nome della relazione
-        relation_id = f"{layer_padre.id()}_{layer_figlio.id()}_{nuova_relazione['nome']}".replace(' ', '_').lower()
-
-        # Crea la relazione
-        relation = QgsRelation()
-        relation.setName(nuova_relazione['nome'])
-        relation.setId(relation_id)  # Imposta l'ID univoco
-        relation.setReferencingLayer(layer_figlio.id())
-        relation.setReferencedLayer(layer_padre.id())
-
-        # Aggiungi le coppie di chiavi
-        for chiave_padre, chiave_figlio in nuova_relazione['chiavi'].items():
-            if chiave_padre in [field.name() for field in layer_padre.fields()] and chiave_figlio in [field.name() for field in layer_figlio.fields()]:
-                relation.addFieldPair(chiave_padre, chiave_figlio)
-            else:
-                QMessageBox.warning(self, "Error", f"Key fields not found: {chiave_padre}, {chiave_figlio}")
-                return
-
-        # Aggiungi la relazione al manager delle relazioni
-        relation_manager = project.relationManager()
-        relation_manager.addRelation(relation)
-
-        # Aggiorna la lista delle relazioni e salva il progetto
-        self.carica_lista_relazioni()
-        self.add_to_history(f"Created new relationship: {nuova_relazione['nome']}", nuova_relazione)
-
-        # Salvataggio esplicito del progetto
-        project.setDirty(True)
-        project.write()
+        relation_id = nuova_relazione.get('id') or (
+            f"{layer_padre.id()}_{layer_figlio.id()}_{nuova_relazione['nome']}".replace(' ', '_').lower())
 
-        QMessageBox.information(self, "Create", "Relationship created successfully!")
+        relation = self._costruisci_relazione(relation_id, nuova_relazione)
+        if relation is None or not self._conferma_ciclo(relation, escludi=relation_id):
+            return False
 
+        # Aggiungi la relazione al manager delle relazioni come comando annullabile
+        verbo = "Duplicated" if azione == DUPLICA else "Created"
+        self._esegui_modifica(azione, f"{verbo} relationship {nuova_relazione['nome']}", {relation_id: relation})
 
+        if azione == DUPLICA:
+            QMessageBox.information(self, "Duplicate", "Relationship duplicated successfully!")
+        else:
+            QMessageBox.information(self, "Create", "Relationship created successfully!")
+        return True
 
-    def add_to_history(self, action, dettagli):
-        """Add an action to the modification history."""
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        self.history.append((timestamp, action, dettagli))
+    def _costruisci_relazione(self, relazione_id, nuova_relazione):
+        """Build a relationship, validating all its key pairs at once.
+
+        :param nuova_relazione: dict with ``nome``, ``layer_padre``, ``layer_figlio``
+            (layer names) and ``chiavi`` (child field -> parent field).
+        :returns: the relation, or None after warning the user.
+        """
+        relation, errore = self.catalogo.costruisci(relazione_id, nuova_relazione)
+        if errore:
+            QMessageBox.warning(self, "Error", errore)
+        return relation
+
+    def _chiavi_editor(self, editor_chiavi):
+        """Return the key pairs of a key editor, or None if a child field is repeated."""
+        coppie = editor_chiavi.coppie()
+        chiavi = dict(coppie)
+        if len(chiavi) != len(coppie):
+            QMessageBox.warning(self, "Error", "Each child key field can be used only once.")
+            return None
+        return chiavi
+
+    def _stato_relazioni(self):
+        """Return the current relationship set as a snapshot (relationship id -> record)."""
+        return {dettagli['id']: record_relazione(dettagli) for dettagli in self.modelloRelazioni.relazioni()}
+
+    def _esegui_modifica(self, azione, descrizione, relazioni):
+        """Apply a change of relationships as one undoable command, recorded in the history.
+
+        :param relazioni: dict relationship id -> new :class:`QgsRelation`, or
+            None to remove the relationship.
+        """
+        with self._modifica_registrata(azione, descrizione):
+            self.catalogo.applica_modifiche(relazioni, descrizione)
+        self._segna_modificato()
+
+    @contextmanager
+    def _modifiche_in_blocco(self, azione, descrizione):
+        """Collect the changes of a bulk operation and apply them once, as a single undoable command.
+
+        Yields a :class:`ModificheRelazioni`; nothing is applied if the block
+        raises or collects no change.
+
+        :param descrizione: description of the operation, where ``{n}`` is
+            replaced by the number of relationships touched.
+        """
+        modifiche = ModificheRelazioni()
+        yield modifiche
+        if len(modifiche):
+            self._esegui_modifica(azione, descrizione.format(n=len(modifiche)), modifiche.relazioni)
+
+    def annulla_modifica(self):
+        """Undo the last change on the project undo stack, recording it in the history."""
+        if self.undoStack.canUndo():
+            with self._modifica_registrata(ANNULLA, f"Undo: {self.undoStack.undoText()}"):
+                self.undoStack.undo()
+            self._segna_modificato()
+
+    def ripeti_modifica(self):
+        """Redo the last undone change, recording it in the history."""
+        if self.undoStack.canRedo():
+            with self._modifica_registrata(RIPETI, f"Redo: {self.undoStack.redoText()}"):
+                self.undoStack.redo()
+            self._segna_modificato()
+
+    @contextmanager
+    def _modifica_registrata(self, azione, descrizione):
+        """Record the relationship set changed inside the block as a new history version.
+
+        Changes made outside the plugin since the previous version are
+        recorded first, as a version of their own.
+        """
+        self.storico.allinea(self._stato_relazioni())
+        try:
+            yield
+        finally:
+            self.storico.registra(azione, descrizione, self._stato_relazioni())
 
     def _crea_layer_combo(self, layer_name_preselezionato):
-        """Create a combobox to select layers in the project."""
-        combo = QComboBox()
-        project = QgsProject.instance()
-        found = False
-
-        for layer in project.mapLayers().values():
-            combo.addItem(layer.name())
-            if layer.name() == layer_name_preselezionato:
-                combo.setCurrentText(layer.name())
-                found = True
-
-        # Se il layer pre-selezionato non è stato trovato, segnala un avviso
-        if not found:
-            QMessageBox.warning(self, "Layer Not Found", f"Layer '{layer_name_preselezionato}' not found in the project.")
-        
-        return combo
+        """Create a combobox to select layers, backed by the shared layer catalog."""
+        combo = crea_combo_filtrabile(self.catalogoLayer.modello_layer)
+
+        if layer_name_preselezionato:
+            indice = combo.findText(layer_name_preselezionato, Qt.MatchExactly)
+            if indice >= 0:
+                combo.setCurrentIndex(indice)
+            else:
+                # Se il layer pre-selezionato non è stato trovato, segnala un avviso
+                QMessageBox.warning(self, "Layer Not Found", f"Layer '{layer_name_preselezionato}' not found in the project.")
 
-    def _crea_field_combo(self, layer_name, chiave_preselezionata):
-        """Create a combobox to select key fields."""
-        combo = QComboBox()
-        project = QgsProject.instance()
-        if layer_name:
-            layer = project.mapLayersByName(layer_name)[0]
-            for field in layer.fields():
-                combo.addItem(field.name())
-                if chiave_preselezionata and field.name() == chiave_preselezionata:
-                    combo.setCurrentText(field.name())
         return combo
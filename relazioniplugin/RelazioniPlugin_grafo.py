@@ -0,0 +1,228 @@
+"""Graph of the project layers linked by relationships.
+
+Layers are the nodes and every relationship is an arc from its parent
+layer to its child layer, kept in adjacency lists so that arcs can be
+added and removed one at a time as the relation manager changes. The
+analysis (strongly connected components, topological order, depth and
+fan-out) runs in time linear in the number of layers and relationships.
+"""
+
+from collections import deque
+
+
+class GrafoRelazioni:
+    """Adjacency-list multigraph parent layer -> child layer, one arc per relationship."""
+
+    def __init__(self):
+        """Constructor."""
+        # id relazione -> (layer padre, layer figlio)
+        self._archi = {}
+        # layer -> {layer collegato: numero di relazioni}
+        self._figli = {}
+        self._padri = {}
+        # layer -> id delle relazioni di cui è padre
+        self._uscenti = {}
+        self._analisi = None
+
+    def __len__(self):
+        """Number of relationships in the graph."""
+        return len(self._archi)
+
+    def svuota(self):
+        """Remove every layer and relationship."""
+        self._archi.clear()
+        self._figli.clear()
+        self._padri.clear()
+        self._uscenti.clear()
+        self._analisi = None
+
+    def aggiungi_arco(self, relazione_id, layer_padre, layer_figlio):
+        """Add a relationship, replacing the one with the same id if any."""
+        self.rimuovi_arco(relazione_id)
+        self._archi[relazione_id] = (layer_padre, layer_figlio)
+        figli = self._figli.setdefault(layer_padre, {})
+        figli[layer_figlio] = figli.get(layer_figlio, 0) + 1
+        padri = self._padri.setdefault(layer_figlio, {})
+        padri[layer_padre] = padri.get(layer_padre, 0) + 1
+        self._figli.setdefault(layer_figlio, {})
+        self._padri.setdefault(layer_padre, {})
+        self._uscenti.setdefault(layer_padre, set()).add(relazione_id)
+        self._analisi = None
+
+    def rimuovi_arco(self, relazione_id):
+        """Remove a relationship; layers left without relationships are dropped."""
+        arco = self._archi.pop(relazione_id, None)
+        if arco is None:
+            return
+        layer_padre, layer_figlio = arco
+        self._decrementa(self._figli[layer_padre], layer_figlio)
+        self._decrementa(self._padri[layer_figlio], layer_padre)
+        self._uscenti[layer_padre].discard(relazione_id)
+        if not self._uscenti[layer_padre]:
+            del self._uscenti[layer_padre]
+        for layer in (layer_padre, layer_figlio):
+            if layer in self._figli and not self._figli[layer] and not self._padri[layer]:
+                del self._figli[layer]
+                del self._padri[layer]
+        self._analisi = None
+
+    @staticmethod
+    def _decrementa(adiacenti, layer):
+        """Decrement the number of arcs towards a layer, dropping it at zero."""
+        adiacenti[layer] -= 1
+        if not adiacenti[layer]:
+            del adiacenti[layer]
+
+    def layer(self):
+        """Return the layers having at least one relationship."""
+        return list(self._figli)
+
+    def fan_out(self, layer):
+        """Number of relationships having the layer as parent."""
+        return sum(self._figli.get(layer, {}).values())
+
+    def fan_in(self, layer):
+        """Number of relationships having the layer as child."""
+        return sum(self._padri.get(layer, {}).values())
+
+    def arco(self, relazione_id):
+        """Return the ``(parent layer, child layer)`` pair of a relationship, or None."""
+        return self._archi.get(relazione_id)
+
+    def a_valle(self, layer):
+        """Walk the parent -> child chains starting from a layer, breadth first.
+
+        :returns: list of ``(relazione_id, profondita)`` pairs, every
+            relationship listed once even across cycles, with depth 1 for the
+            relationships having the layer as parent.
+        """
+        risultato = []
+        visitati = {layer}
+        livello = [layer]
+        profondita = 0
+        while livello:
+            profondita += 1
+            prossimo = []
+            for padre in livello:
+                for relazione_id in sorted(self._uscenti.get(padre, ()), key=str):
+                    risultato.append((relazione_id, profondita))
+                    figlio = self._archi[relazione_id][1]
+                    if figlio not in visitati:
+                        visitati.add(figlio)
+                        prossimo.append(figlio)
+            livello = prossimo
+        return risultato
+
+    def raggiungibile(self, origine, destinazione, escludi=None):
+        """Tell whether a parent -> child chain leads from one layer to another.
+
+        :param escludi: optional id of a relationship to ignore, e.g. the one being edited.
+        """
+        if origine == destinazione:
+            return True
+        arco_escluso = self._archi.get(escludi)
+        visitati = {origine}
+        coda = deque([origine])
+        while coda:
+            layer = coda.popleft()
+            for figlio, numero in self._figli.get(layer, {}).items():
+                if arco_escluso == (layer, figlio) and numero == 1:
+                    continue
+                if figlio == destinazione:
+                    return True
+                if figlio not in visitati:
+                    visitati.add(figlio)
+                    coda.append(figlio)
+        return False
+
+    def chiuderebbe_ciclo(self, layer_padre, layer_figlio, escludi=None):
+        """Tell whether a new relationship parent -> child would close a cycle."""
+        return self.raggiungibile(layer_figlio, layer_padre, escludi)
+
+    def analizza(self):
+        """Analyze the graph; the result is cached until the next change.
+
+        :returns: dict with the ``ordine`` of the layers (topological, the
+            layers of a cycle are adjacent), the ``cicli`` as lists of layers
+            (self-referencing layers included), the ``profondita`` of every
+            layer (longest parent -> child chain leading to it, a cycle counting
+            as a single step), the ``profondita_massima`` and the ``fan_out``
+            of every layer.
+        """
+        if self._analisi is None:
+            componenti = self._componenti_fortemente_connesse()
+            # Tarjan restituisce le componenti in ordine topologico inverso
+            componenti.reverse()
+            componente_di = {}
+            for numero, componente in enumerate(componenti):
+                for layer in componente:
+                    componente_di[layer] = numero
+
+            profondita_componenti = [0] * len(componenti)
+            cicli = []
+            for numero, componente in enumerate(componenti):
+                if len(componente) > 1 or componente[0] in self._figli[componente[0]]:
+                    cicli.append(componente)
+                for layer in componente:
+                    for figlio in self._figli[layer]:
+                        altra = componente_di[figlio]
+                        if altra != numero:
+                            profondita_componenti[altra] = max(
+                                profondita_componenti[altra], profondita_componenti[numero] + 1)
+
+            profondita = {layer: profondita_componenti[componente_di[layer]] for layer in self._figli}
+            self._analisi = {
+                'ordine': [layer for componente in componenti for layer in componente],
+                'cicli': cicli,
+                'profondita': profondita,
+                'profondita_massima': max(profondita.values(), default=0),
+                'fan_out': {layer: self.fan_out(layer) for layer in self._figli}
+            }
+        return self._analisi
+
+    def _componenti_fortemente_connesse(self):
+        """Tarjan's algorithm, iterative to support arbitrarily long chains."""
+        indice = {}
+        minimo = {}
+        pila = []
+        in_pila = set()
+        componenti = []
+        contatore = 0
+
+        for radice in self._figli:
+            if radice in indice:
+                continue
+            lavoro = [(radice, iter(self._figli[radice]))]
+            indice[radice] = minimo[radice] = contatore
+            contatore += 1
+            pila.append(radice)
+            in_pila.add(radice)
+
+            while lavoro:
+                layer, figli = lavoro[-1]
+                figlio = next(figli, None)
+                if figlio is not None:
+                    if figlio not in indice:
+                        indice[figlio] = minimo[figlio] = contatore
+                        contatore += 1
+                        pila.append(figlio)
+                        in_pila.add(figlio)
+                        lavoro.append((figlio, iter(self._figli[figlio])))
+                    elif figlio in in_pila:
+                        minimo[layer] = min(minimo[layer], indice[figlio])
+                    continue
+
+                lavoro.pop()
+                if lavoro:
+                    padre = lavoro[-1][0]
+                    minimo[padre] = min(minimo[padre], minimo[layer])
+                if minimo[layer] == indice[layer]:
+                    componente = []
+                    while True:
+                        membro = pila.pop()
+                        in_pila.discard(membro)
+                        componente.append(membro)
+                        if membro == layer:
+                            break
+                    componenti.append(componente)
+        return componenti
@@ -0,0 +1,258 @@
+"""Index advisor for the key fields of the project relationships.
+
+Looking up the children of a parent feature (relation forms,
+:meth:`QgsRelation.getRelatedFeatures`) filters the child layer on its key
+fields, which is a full scan when they are not indexed. The advisor groups
+the relationships by child layer and key fields, asks the database which
+of those fields already lead an index, and creates the missing indexes:
+with ``CREATE INDEX`` in a background task for PostgreSQL and
+GeoPackage/SQLite layers, with the provider ``createAttributeIndex`` on the
+main thread for the other providers supporting it.
+
+Every creation is timed with the same sample of key lookups before and
+after, to report the speedup actually obtained. The lookups always run in
+a background task, since before the index they scan the whole layer.
+"""
+
+import sqlite3
+import time
+
+from qgis.core import (
+    QgsExpression, QgsProviderConnectionException, QgsTask, QgsVectorDataProvider, QgsVectorLayerFeatureSource
+)
+
+from .RelazioniPlugin_integrita import esegui_sql, origine_sql, richiesta_chiavi, valori_chiave
+from .RelazioniPlugin_sql import (
+    sql_colonne_indicizzate_postgres, sql_colonne_indicizzate_sqlite, sql_crea_indice
+)
+
+INDICIZZATO = "Indexed"
+MANCANTE = "Missing"
+SCONOSCIUTO = "Unknown, the provider can create one"
+NON_SUPPORTATO = "Not supported by the provider"
+CREATO = "Created"
+
+# Numero di chiavi campione cercate per misurare i tempi prima e dopo l'indice
+NUMERO_CAMPIONI = 20
+
+
+def prepara_indici(relations):
+    """Group the relationships by child layer and key fields (main thread only).
+
+    :returns: list of dicts, one per child layer and key fields, with the
+        ``layer_id``, the ``layer`` name, the key ``campi`` and their
+        ``indici``, the names of the ``relazioni`` using them, the SQL
+        ``origine`` of the layer (or None), whether the ``provider`` can
+        create attribute indexes, a feature ``sorgente`` for the lookups and
+        the sample keys (``campioni``) they look up.
+    """
+    voci = {}
+    for relation in relations:
+        layer = relation.referencingLayer()
+        campi = tuple(relation.fieldPairs().keys())
+        if not layer or not campi:
+            continue
+
+        voce = voci.get((layer.id(), campi))
+        if voce is None:
+            indici = [layer.fields().indexOf(campo) for campo in campi]
+            if min(indici) < 0:
+                continue
+            capacita = layer.dataProvider().capabilities()
+            voce = {
+                'layer_id': layer.id(),
+                'layer': layer.name(),
+                'campi': campi,
+                'indici': indici,
+                'relazioni': [],
+                'origine': origine_sql(layer),
+                'provider': bool(capacita & QgsVectorDataProvider.CreateAttributeIndex),
+                'sorgente': QgsVectorLayerFeatureSource(layer),
+                'campioni': None,
+                'stato': None,
+                'errore': None,
+                'prima': None,
+                'dopo': None
+            }
+            voci[(layer.id(), campi)] = voce
+        voce['relazioni'].append(relation.name())
+    return list(voci.values())
+
+
+def piano_sql(origine, sql):
+    """Return a plan running a statement on the database of an SQL origin."""
+    return {'provider': origine['provider'], 'uri': origine['uri'], 'sql': sql}
+
+
+def colonne_indicizzate(origine):
+    """Ask the database for the set of columns leading an index of a table."""
+    if origine['provider'] == 'postgres':
+        sql = sql_colonne_indicizzate_postgres(origine['nome_tabella'], origine['schema'])
+    else:
+        sql = sql_colonne_indicizzate_sqlite(origine['nome_tabella'])
+    return {riga[0] for riga in esegui_sql(piano_sql(origine, sql))}
+
+
+def da_creare(voce):
+    """Tell whether the advisor offers to create the index of an entry."""
+    return voce['stato'] == MANCANTE or (voce['stato'] == SCONOSCIUTO and voce['provider'])
+
+
+def campioni_chiave(sorgente, indici, numero=NUMERO_CAMPIONI):
+    """Collect up to ``numero`` distinct non-NULL keys from the first features of a source."""
+    richiesta = richiesta_chiavi(indici)
+    richiesta.setLimit(numero * 50)
+    campioni = []
+    visti = set()
+    for feature in sorgente.getFeatures(richiesta):
+        chiave = valori_chiave(feature, indici)
+        if chiave is not None and chiave not in visti:
+            visti.add(chiave)
+            campioni.append(chiave)
+            if len(campioni) >= numero:
+                break
+    return campioni
+
+
+def tempo_ricerca(sorgente, campi, indici, campioni):
+    """Return the mean time in milliseconds of looking up the features with each sample key."""
+    if not campioni:
+        return None
+
+    inizio = time.perf_counter()
+    for chiave in campioni:
+        espressione = ' AND '.join(
+            QgsExpression.createFieldEqualityExpression(campo, valore) for campo, valore in zip(campi, chiave))
+        richiesta = richiesta_chiavi(indici)
+        richiesta.setFilterExpression(espressione)
+        for _ in sorgente.getFeatures(richiesta):
+            pass
+    return (time.perf_counter() - inizio) * 1000 / len(campioni)
+
+
+def misura_e_crea(voce, crea):
+    """Time the key lookups of an entry around the creation of its index.
+
+    :param crea: callable creating the index.
+    """
+    misura_prima(voce)
+    crea()
+    misura_dopo(voce)
+    voce['stato'] = CREATO
+
+
+def misura_prima(voce):
+    """Sample the keys of an entry and time their lookups before the index exists."""
+    voce['campioni'] = campioni_chiave(voce['sorgente'], voce['indici'])
+    voce['prima'] = tempo_ricerca(voce['sorgente'], voce['campi'], voce['indici'], voce['campioni'])
+
+
+def misura_dopo(voce):
+    """Time the lookups of the sample keys of an entry once its index exists."""
+    voce['dopo'] = tempo_ricerca(voce['sorgente'], voce['campi'], voce['indici'], voce['campioni'])
+
+
+def crea_indice_provider(voce, layer):
+    """Create the index of an entry with the provider API (main thread only).
+
+    The lookups are not timed here: a new feature ``sorgente`` is left in
+    the entry for :class:`MisuraIndiciTask`.
+    """
+    provider = layer.dataProvider()
+    for indice in voce['indici']:
+        if not provider.createAttributeIndex(indice):
+            voce['errore'] = f"The provider could not index field {layer.fields().at(indice).name()}"
+            return
+    voce['stato'] = CREATO
+    voce['sorgente'] = QgsVectorLayerFeatureSource(layer)
+
+
+class AnalisiIndiciTask(QgsTask):
+    """Find out in the background which relationship key fields are indexed.
+
+    Sets the ``stato`` of every entry of :func:`prepara_indici`, and its
+    ``errore`` if the database could not be asked.
+    """
+
+    def __init__(self, voci):
+        """Constructor."""
+        super().__init__("Analyze key indexes", QgsTask.CanCancel)
+        self.voci = voci
+        self.errore = None
+
+    def run(self):
+        """Query the index catalog of every table."""
+        # Le voci sulla stessa tabella condividono una sola interrogazione del catalogo
+        colonne_per_tabella = {}
+        for numero, voce in enumerate(self.voci, start=1):
+            if self.isCanceled():
+                return False
+
+            origine = voce['origine']
+            if origine:
+                tabella = (origine['connessione'], origine['tabella'])
+                try:
+                    if tabella not in colonne_per_tabella:
+                        colonne_per_tabella[tabella] = colonne_indicizzate(origine)
+                    indicizzato = not colonne_per_tabella[tabella].isdisjoint(voce['campi'])
+                    voce['stato'] = INDICIZZATO if indicizzato else MANCANTE
+                except (QgsProviderConnectionException, sqlite3.Error) as errore:
+                    voce['errore'] = str(errore)
+                    voce['origine'] = None
+            if voce['stato'] is None:
+                voce['stato'] = SCONOSCIUTO if voce['provider'] else NON_SUPPORTATO
+            self.setProgress(numero * 100 / len(self.voci))
+        return True
+
+
+class CreaIndiciTask(QgsTask):
+    """Create the missing database indexes in the background.
+
+    Only the entries with an SQL ``origine`` get their index here; for the
+    others the lookups are timed before the index, which must then be
+    created by :func:`crea_indice_provider` on the main thread and timed
+    again by :class:`MisuraIndiciTask`.
+    """
+
+    def __init__(self, voci):
+        """Constructor."""
+        super().__init__("Create key indexes", QgsTask.CanCancel)
+        self.voci = voci
+        self.errore = None
+
+    def run(self):
+        """Time the lookups and create every index."""
+        for numero, voce in enumerate(self.voci, start=1):
+            if self.isCanceled():
+                return False
+
+            origine = voce['origine']
+            if origine:
+                sql = sql_crea_indice(origine['nome_tabella'], voce['campi'], origine['schema'])
+                try:
+                    misura_e_crea(voce, lambda: esegui_sql(piano_sql(origine, sql), sola_lettura=False))
+                except (QgsProviderConnectionException, sqlite3.Error) as errore:
+                    voce['errore'] = str(errore)
+            else:
+                misura_prima(voce)
+            self.setProgress(numero * 100 / len(self.voci))
+        return True
+
+
+class MisuraIndiciTask(QgsTask):
+    """Time in the background the key lookups of the entries indexed by their provider."""
+
+    def __init__(self, voci):
+        """Constructor."""
+        super().__init__("Time key lookups", QgsTask.CanCancel)
+        self.voci = voci
+        self.errore = None
+
+    def run(self):
+        """Time the lookups of every entry with its new index."""
+        for numero, voce in enumerate(self.voci, start=1):
+            if self.isCanceled():
+                return False
+            misura_dopo(voce)
+            self.setProgress(numero * 100 / len(self.voci))
+        return True
@@ -0,0 +1,424 @@
+"""Referential integrity checks of the project relationships.
+
+Orphan detection is a hash join: the parent key columns are streamed once
+into a set, then the child layer is streamed once and every key missing
+from the set is counted as an orphan. Only the key attributes are
+requested and geometries are never fetched.
+
+When both layers live in the same PostgreSQL database or GeoPackage/SQLite
+file, the same check is pushed down to the database as a single anti-join
+query and no row is moved into Python.
+
+The cardinality statistics of a relationship reuse both paths: the
+child-count histogram is built with a ``GROUP BY`` in the database when
+possible, with one streaming pass over the key columns otherwise.
+"""
+
+import os
+import sqlite3
+
+from PyQt5.QtCore import Qt
+from qgis.core import (
+    NULL, QgsDataSourceUri, QgsFeatureRequest, QgsProviderConnectionException, QgsProviderRegistry,
+    QgsTask, QgsVectorLayerFeatureSource
+)
+
+from .RelazioniPlugin_sql import esegui_query_sqlite, sql_conta_orfani, sql_istogramma_figli, tabella_qualificata
+from .RelazioniPlugin_statistiche import istogramma_figli, statistiche_cardinalita
+
+# Estensioni dei file SQLite interrogabili direttamente tramite il provider ogr
+ESTENSIONI_SQLITE = ('.gpkg', '.sqlite', '.db')
+
+
+def prepara_verifica(relation, seleziona=False):
+    """Collect on the main thread what a background scan of a relationship needs.
+
+    :returns: a ``(verifica, None)`` pair, or ``(None, reason)`` if the
+        relationship cannot be checked.
+    """
+    layer_padre = relation.referencedLayer()
+    layer_figlio = relation.referencingLayer()
+    if not layer_padre or not layer_figlio:
+        return None, "Parent or child layer not found"
+
+    indici_padre = []
+    indici_figlio = []
+    for chiave_figlio, chiave_padre in relation.fieldPairs().items():
+        indici_padre.append(layer_padre.fields().indexOf(chiave_padre))
+        indici_figlio.append(layer_figlio.fields().indexOf(chiave_figlio))
+    if not indici_padre or min(indici_padre + indici_figlio) < 0:
+        return None, "Key fields not found"
+
+    return {
+        'id': relation.id(),
+        'nome': relation.name(),
+        'layer_figlio_id': layer_figlio.id(),
+        # Le feature source possono essere lette da un altro thread
+        'sorgente_padre': QgsVectorLayerFeatureSource(layer_padre),
+        'sorgente_figlio': QgsVectorLayerFeatureSource(layer_figlio),
+        'indici_padre': indici_padre,
+        'indici_figlio': indici_figlio,
+        'totale_padre': layer_padre.featureCount(),
+        'totale_figlio': layer_figlio.featureCount(),
+        'seleziona': seleziona
+    }, None
+
+
+def richiesta_chiavi(indici):
+    """Feature request fetching only the given attributes, without geometry."""
+    richiesta = QgsFeatureRequest()
+    richiesta.setFlags(QgsFeatureRequest.NoGeometry)
+    richiesta.setSubsetOfAttributes(indici)
+    return richiesta
+
+
+def valori_chiave(feature, indici):
+    """Return the key of a feature as a tuple, or None if any key attribute is NULL."""
+    attributi = feature.attributes()
+    chiave = tuple(attributi[indice] for indice in indici)
+    if any(valore is None or valore == NULL for valore in chiave):
+        return None
+    return chiave
+
+
+def chiavi_padre(sorgente, indici, annullato=None):
+    """Stream the parent key columns into a set of key tuples."""
+    chiavi = set()
+    for feature in sorgente.getFeatures(richiesta_chiavi(indici)):
+        if annullato and annullato():
+            break
+        chiave = valori_chiave(feature, indici)
+        if chiave is not None:
+            chiavi.add(chiave)
+    return chiavi
+
+
+def scansiona_orfani(verifica, annullato=None, progresso=None):
+    """Count the child features referencing a nonexistent parent.
+
+    Child features with a NULL key do not reference any parent and are not
+    counted as orphans.
+
+    :param verifica: dict returned by :func:`prepara_verifica`.
+    :param annullato: optional callable telling whether to stop.
+    :param progresso: optional callable receiving the completed fraction (0-1).
+    :returns: dict with the number of ``controllati`` child features, of
+        ``orfani`` and, if the check asked for a selection, their ``ids_orfani``.
+    """
+    totale = verifica['totale_padre'] + verifica['totale_figlio']
+    chiavi = chiavi_padre(verifica['sorgente_padre'], verifica['indici_padre'], annullato)
+    if progresso and totale > 0:
+        progresso(verifica['totale_padre'] / totale)
+
+    controllati = 0
+    orfani = 0
+    ids_orfani = []
+    indici = verifica['indici_figlio']
+    for feature in verifica['sorgente_figlio'].getFeatures(richiesta_chiavi(indici)):
+        if annullato and annullato():
+            break
+        controllati += 1
+        chiave = valori_chiave(feature, indici)
+        if chiave is not None and chiave not in chiavi:
+            orfani += 1
+            if verifica['seleziona']:
+                ids_orfani.append(feature.id())
+        if progresso and totale > 0 and controllati % 10000 == 0:
+            progresso(min(1, (verifica['totale_padre'] + controllati) / totale))
+
+    return {'controllati': controllati, 'orfani': orfani, 'ids_orfani': ids_orfani}
+
+
+class VerificaIntegritaTask(QgsTask):
+    """Scan a list of relationships for orphan child features in the background.
+
+    ``risultati`` holds one dict per checked relationship, with its ``id``,
+    ``nome``, ``layer_figlio_id`` and the counters of :func:`scansiona_orfani`.
+    """
+
+    def __init__(self, verifiche):
+        """Constructor.
+
+        :param verifiche: list of dicts returned by :func:`prepara_verifica`.
+        """
+        super().__init__("Check referential integrity", QgsTask.CanCancel)
+        self.verifiche = verifiche
+        self.risultati = []
+        self.errore = None
+
+    def run(self):
+        """Scan every relationship."""
+        numero = len(self.verifiche)
+        for posizione, verifica in enumerate(self.verifiche):
+            if self.isCanceled():
+                return False
+
+            def progresso(frazione, posizione=posizione):
+                self.setProgress((posizione + frazione) * 100 / numero)
+
+            esito = scansiona_orfani(verifica, self.isCanceled, progresso)
+            esito.update(id=verifica['id'], nome=verifica['nome'], layer_figlio_id=verifica['layer_figlio_id'])
+            self.risultati.append(esito)
+
+        return not self.isCanceled()
+
+
+def origine_sql(layer):
+    """Describe how to reach the table of a layer with SQL.
+
+    :returns: dict with the ``provider``, a ``connessione`` key identifying
+        the database, the ``uri`` to connect to it, the quoted ``tabella`` and
+        its unquoted ``schema`` and ``nome_tabella``, or None if the layer cannot be queried directly (other providers,
+        query layers, layers with a subset filter).
+    """
+    if layer.subsetString():
+        return None
+
+    provider = layer.providerType()
+    if provider == 'postgres':
+        uri = QgsDataSourceUri(layer.source())
+        if not uri.table() or uri.table().startswith('('):
+            return None
+        schema = uri.schema() or None
+        nome_tabella = uri.table()
+        uri.setDataSource('', '', '')
+        return {
+            'provider': provider,
+            'connessione': uri.connectionInfo(False),
+            'uri': uri.uri(False),
+            'tabella': tabella_qualificata(nome_tabella, schema),
+            'schema': schema,
+            'nome_tabella': nome_tabella
+        }
+
+    if provider == 'ogr':
+        parti = QgsProviderRegistry.instance().decodeUri(provider, layer.source())
+        percorso = parti.get('path') or ''
+        nome = parti.get('layerName')
+        if not nome or os.path.splitext(percorso)[1].lower() not in ESTENSIONI_SQLITE:
+            return None
+        return {
+            'provider': provider,
+            'connessione': os.path.normcase(os.path.abspath(percorso)),
+            'uri': percorso,
+            'tabella': tabella_qualificata(nome),
+            'schema': None,
+            'nome_tabella': nome
+        }
+
+    return None
+
+
+def origine_relazione_sql(relation):
+    """Describe how to query both tables of a relationship in a single database.
+
+    :returns: a ``(origine, None)`` pair with the ``provider``, the ``uri``,
+        the quoted ``tabella_padre`` and ``tabella_figlio`` and the
+        ``(child field, parent field)`` key ``coppie``, or ``(None, reason)``
+        if the relationship cannot be queried with SQL.
+    """
+    layer_padre = relation.referencedLayer()
+    layer_figlio = relation.referencingLayer()
+    if not layer_padre or not layer_figlio:
+        return None, "Parent or child layer not found"
+
+    origine_padre = origine_sql(layer_padre)
+    origine_figlio = origine_sql(layer_figlio)
+    if not origine_padre or not origine_figlio or origine_padre['connessione'] != origine_figlio['connessione']:
+        return None, "Layers are not in the same PostgreSQL or GeoPackage/SQLite database"
+
+    coppie = list(relation.fieldPairs().items())
+    if not coppie:
+        return None, "Key fields not found"
+
+    return {
+        'provider': origine_figlio['provider'],
+        'uri': origine_figlio['uri'],
+        'tabella_padre': origine_padre['tabella'],
+        'tabella_figlio': origine_figlio['tabella'],
+        'coppie': coppie
+    }, None
+
+
+def prepara_verifica_sql(relation):
+    """Build the anti-join query checking a relationship inside its database.
+
+    :returns: a ``(piano, None)`` pair with the ``provider``, ``uri`` and
+        ``sql`` to run, or ``(None, reason)`` if the check cannot be pushed down.
+    """
+    origine, errore = origine_relazione_sql(relation)
+    if errore:
+        return None, errore
+
+    return {
+        'id': relation.id(),
+        'nome': relation.name(),
+        'provider': origine['provider'],
+        'uri': origine['uri'],
+        'sql': sql_conta_orfani(origine['tabella_figlio'], origine['tabella_padre'], origine['coppie'])
+    }, None
+
+
+def esegui_sql(piano, sola_lettura=True):
+    """Run the ``sql`` statement of a plan on its ``provider`` and ``uri`` and return all its rows.
+
+    SQLite files without a provider connection are opened read-only unless
+    ``sola_lettura`` is False.
+    """
+    metadata = QgsProviderRegistry.instance().providerMetadata(piano['provider'])
+    try:
+        connessione = metadata.createConnection(piano['uri'], {})
+        return connessione.executeSql(piano['sql'])
+    except QgsProviderConnectionException:
+        if piano['provider'] != 'ogr':
+            raise
+
+    # I file SQLite senza connessione del provider vengono letti direttamente
+    return esegui_query_sqlite(piano['uri'], piano['sql'], sola_lettura)
+
+
+def esegui_verifica_sql(piano):
+    """Run the anti-join of :func:`prepara_verifica_sql` and return the number of orphans."""
+    return int(esegui_sql(piano)[0][0])
+
+
+class VerificaIntegritaSqlTask(QgsTask):
+    """Run the anti-join integrity queries in the background.
+
+    ``risultati`` holds one dict per relationship with its ``id``, ``nome``
+    and either the number of ``orfani`` or the database ``errore``.
+    """
+
+    def __init__(self, piani):
+        """Constructor.
+
+        :param piani: list of dicts returned by :func:`prepara_verifica_sql`.
+        """
+        super().__init__("Check referential integrity (SQL)", QgsTask.CanCancel)
+        self.piani = piani
+        self.risultati = []
+        self.errore = None
+
+    def run(self):
+        """Run every query."""
+        for numero, piano in enumerate(self.piani, start=1):
+            if self.isCanceled():
+                return False
+            risultato = {'id': piano['id'], 'nome': piano['nome'], 'orfani': None, 'errore': None}
+            try:
+                risultato['orfani'] = esegui_verifica_sql(piano)
+            except (QgsProviderConnectionException, sqlite3.Error) as errore:
+                risultato['errore'] = str(errore)
+            self.risultati.append(risultato)
+            self.setProgress(numero * 100 / len(self.piani))
+        return True
+
+
+def chiave_cache_statistiche(relation):
+    """Return a key identifying the data the statistics of a relationship were computed on.
+
+    The key changes when the relationship keys change or when either layer
+    reports new data (provider data timestamp, feature count including the
+    edit buffer), so cached statistics are reused only while still valid.
+    """
+    parti = [relation.id(), tuple(sorted(relation.fieldPairs().items()))]
+    for layer in (relation.referencedLayer(), relation.referencingLayer()):
+        if not layer:
+            return None
+        parti.append((layer.id(), layer.dataProvider().dataTimestamp().toString(Qt.ISODateWithMs),
+                      layer.featureCount(), layer.isModified()))
+    return tuple(parti)
+
+
+def prepara_statistiche(relation):
+    """Collect on the main thread what the cardinality statistics of a relationship need.
+
+    The histogram is computed by the database when both tables can be
+    queried there and neither layer has unsaved edits, by a streaming scan
+    otherwise.
+
+    :returns: a ``(piano, None)`` pair, or ``(None, reason)`` if the
+        relationship cannot be analyzed.
+    """
+    verifica, errore = prepara_verifica(relation)
+    if errore:
+        return None, errore
+
+    verifica['sql'] = None
+    layer_modificati = relation.referencedLayer().isModified() or relation.referencingLayer().isModified()
+    origine, _ = origine_relazione_sql(relation)
+    if origine and not layer_modificati:
+        verifica.update(
+            provider=origine['provider'],
+            uri=origine['uri'],
+            sql=sql_istogramma_figli(origine['tabella_figlio'], origine['tabella_padre'], origine['coppie'])
+        )
+    return verifica, None
+
+
+def istogramma_relazione(piano, annullato=None, progresso=None):
+    """Compute the child-count histogram of a relationship in one streaming pass.
+
+    :param piano: dict returned by :func:`prepara_statistiche`.
+    """
+    totale = piano['totale_padre'] + piano['totale_figlio']
+    padri = chiavi_padre(piano['sorgente_padre'], piano['indici_padre'], annullato)
+    if progresso and totale > 0:
+        progresso(piano['totale_padre'] / totale)
+
+    def chiavi_figlio():
+        indici = piano['indici_figlio']
+        for numero, feature in enumerate(piano['sorgente_figlio'].getFeatures(richiesta_chiavi(indici)), start=1):
+            if annullato and annullato():
+                return
+            chiave = valori_chiave(feature, indici)
+            if chiave is not None:
+                yield chiave
+            if progresso and totale > 0 and numero % 10000 == 0:
+                progresso(min(1, (piano['totale_padre'] + numero) / totale))
+
+    return istogramma_figli(padri, chiavi_figlio())
+
+
+class StatisticheRelazioneTask(QgsTask):
+    """Compute the cardinality statistics of a relationship in the background.
+
+    On success ``istogramma`` holds the child-count histogram, ``statistiche``
+    its summary (see :func:`statistiche_cardinalita`) and ``metodo`` tells
+    whether it was computed by the database or by a scan. On failure
+    ``errore`` describes the problem, unless the task was canceled.
+    """
+
+    def __init__(self, piano):
+        """Constructor.
+
+        :param piano: dict returned by :func:`prepara_statistiche`.
+        """
+        super().__init__("Relationship statistics", QgsTask.CanCancel)
+        self.piano = piano
+        self.istogramma = None
+        self.statistiche = None
+        self.metodo = None
+        self.errore = None
+
+    def run(self):
+        """Build the histogram and summarize it."""
+        istogramma = None
+        if self.piano['sql']:
+            try:
+                istogramma = {int(numero): int(conteggio) for numero, conteggio in esegui_sql(self.piano)}
+                self.metodo = "SQL"
+            except (QgsProviderConnectionException, sqlite3.Error):
+                # Si ripiega sulla scansione dei layer
+                istogramma = None
+
+        if istogramma is None:
+            istogramma = istogramma_relazione(
+                self.piano, self.isCanceled, lambda frazione: self.setProgress(frazione * 100))
+            self.metodo = "Scan"
+
+        if self.isCanceled():
+            return False
+        self.istogramma = dict(istogramma)
+        self.statistiche = statistiche_cardinalita(self.istogramma)
+        return True
@@ -0,0 +1,225 @@
+"""Inventory of the relationships defined across many project files.
+
+The project files of a directory tree are read with the fast XML reader
+of :mod:`RelazioniPlugin_qgs`, without loading them, and their
+relationships are stored in a SQLite index in the export format of the
+plugin (``nome``, ``referencing_layer``, ``referenced_layer``, ``chiavi``),
+together with the ids and data sources of the two layers. The index
+answers questions like "which projects define a relationship on layer X
+or on data source Y" without opening any project.
+
+Every indexed file is recorded with its modification time, size and
+content hash: re-indexing reads only the files whose time or size
+changed, and re-parses only those whose content actually changed.
+"""
+
+import json
+import os
+import sqlite3
+
+from .RelazioniPlugin_qgs import hash_file, leggi_progetto
+
+ESTENSIONI_PROGETTO = ('.qgs', '.qgz')
+
+# File indicizzati tra un commit e l'altro
+DIMENSIONE_TRANSAZIONE = 100
+
+
+def cerca_progetti(cartella):
+    """Yield the paths of the project files of a directory tree, in a stable order."""
+    for radice, cartelle, file in os.walk(cartella):
+        cartelle.sort()
+        for nome in sorted(file):
+            if nome.lower().endswith(ESTENSIONI_PROGETTO):
+                yield os.path.join(radice, nome)
+
+
+def sorgente_assoluta(sorgente, cartella_progetto):
+    """Resolve the file path of a relative data source against the project folder.
+
+    Data sources like ``./data.gpkg|layername=x`` are saved relative to the
+    project; other data sources are returned unchanged.
+    """
+    percorso, separatore, resto = sorgente.partition('|')
+    if not percorso.startswith(('./', '../', '.\\', '..\\')):
+        return sorgente
+    return os.path.normpath(os.path.join(cartella_progetto, percorso)) + separatore + resto
+
+
+def motivo_like(testo):
+    """Build a case-insensitive ``LIKE ... ESCAPE '\\'`` pattern matching a substring."""
+    testo = testo.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{testo}%'
+
+
+class InventarioRelazioni:
+    """SQLite index of the relationships of many project files."""
+
+    def __init__(self, percorso):
+        """Constructor.
+
+        :param percorso: SQLite file of the index, created if missing.
+        """
+        self.percorso = percorso
+        self._connessione = sqlite3.connect(percorso)
+        self._connessione.executescript('''
+            CREATE TABLE IF NOT EXISTS progetti (
+                percorso TEXT PRIMARY KEY,
+                mtime REAL NOT NULL,
+                dimensione INTEGER NOT NULL,
+                hash TEXT NOT NULL,
+                errore TEXT
+            );
+            CREATE TABLE IF NOT EXISTS relazioni (
+                progetto TEXT NOT NULL,
+                id TEXT NOT NULL,
+                nome TEXT NOT NULL,
+                referencing_layer TEXT NOT NULL,
+                referenced_layer TEXT NOT NULL,
+                chiavi TEXT NOT NULL,
+                referencing_layer_id TEXT NOT NULL,
+                referenced_layer_id TEXT NOT NULL,
+                referencing_source TEXT NOT NULL,
+                referenced_source TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS relazioni_progetto ON relazioni (progetto);
+        ''')
+        self._connessione.commit()
+
+    def __len__(self):
+        """Number of indexed project files."""
+        return self._connessione.execute('SELECT COUNT(*) FROM progetti').fetchone()[0]
+
+    def numero_relazioni(self):
+        """Number of indexed relationships."""
+        return self._connessione.execute('SELECT COUNT(*) FROM relazioni').fetchone()[0]
+
+    def indicizza(self, cartella, annullato=None, progresso=None):
+        """Bring the index of a directory tree up to date.
+
+        :param annullato: optional callable telling whether to stop.
+        :param progresso: optional callable receiving the fraction of files examined.
+        :returns: dict with the number of project files ``aggiunti``,
+            ``aggiornati``, ``invariati`` and ``rimossi``, and the
+            ``(path, reason)`` pairs of the ``errori``.
+        """
+        esito = {'aggiunti': 0, 'aggiornati': 0, 'invariati': 0, 'rimossi': 0, 'errori': []}
+        cartella = os.path.abspath(cartella)
+        noti = {percorso: (mtime, dimensione, hash_noto) for percorso, mtime, dimensione, hash_noto
+                in self._connessione.execute('SELECT percorso, mtime, dimensione, hash FROM progetti')}
+        progetti = list(cerca_progetti(cartella))
+        visti = set()
+
+        try:
+            for numero, percorso in enumerate(progetti, start=1):
+                if annullato and annullato():
+                    return esito
+                visti.add(percorso)
+                try:
+                    esito[self._indicizza_file(percorso, noti.get(percorso))] += 1
+                except (OSError, ValueError) as errore:
+                    esito['errori'].append((percorso, str(errore)))
+                    self._registra_errore(percorso, str(errore))
+                if numero % DIMENSIONE_TRANSAZIONE == 0:
+                    self._connessione.commit()
+                if progresso:
+                    progresso(numero / len(progetti))
+
+            # I progetti spariti dall'albero escono dall'indice
+            prefisso = os.path.join(cartella, '')
+            for percorso in noti:
+                if percorso.startswith(prefisso) and percorso not in visti:
+                    self._rimuovi(percorso)
+                    esito['rimossi'] += 1
+        finally:
+            self._connessione.commit()
+        return esito
+
+    def _indicizza_file(self, percorso, noto):
+        """Index a project file unless unchanged, returning the counter of :meth:`indicizza` to increment."""
+        stat = os.stat(percorso)
+        if noto and noto[0] == stat.st_mtime and noto[1] == stat.st_size:
+            return 'invariati'
+
+        hash_progetto = hash_file(percorso)
+        if noto and noto[2] == hash_progetto:
+            # Solo la data è cambiata: il contenuto indicizzato resta valido
+            self._connessione.execute('UPDATE progetti SET mtime = ?, dimensione = ? WHERE percorso = ?',
+                                      (stat.st_mtime, stat.st_size, percorso))
+            return 'invariati'
+
+        layer, relazioni = leggi_progetto(percorso)
+        cartella_progetto = os.path.dirname(percorso)
+
+        def descrivi(layer_id):
+            dati = layer.get(layer_id, {})
+            return dati.get('nome', ''), sorgente_assoluta(dati.get('sorgente', ''), cartella_progetto)
+
+        righe = []
+        for record in relazioni.values():
+            nome_figlio, sorgente_figlio = descrivi(record['layer_figlio_id'])
+            nome_padre, sorgente_padre = descrivi(record['layer_padre_id'])
+            righe.append((percorso, record['id'], record['nome'], nome_figlio, nome_padre,
+                          json.dumps(record['chiavi']), record['layer_figlio_id'], record['layer_padre_id'],
+                          sorgente_figlio, sorgente_padre))
+
+        self._connessione.execute('DELETE FROM relazioni WHERE progetto = ?', (percorso,))
+        self._connessione.executemany('INSERT INTO relazioni VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', righe)
+        self._connessione.execute('INSERT OR REPLACE INTO progetti VALUES (?, ?, ?, ?, NULL)',
+                                  (percorso, stat.st_mtime, stat.st_size, hash_progetto))
+        return 'aggiornati' if noto else 'aggiunti'
+
+    def _registra_errore(self, percorso, errore):
+        """Record a project file that could not be read, so that it is retried only once changed."""
+        try:
+            stat = os.stat(percorso)
+        except OSError:
+            self._rimuovi(percorso)
+            return
+        self._connessione.execute('DELETE FROM relazioni WHERE progetto = ?', (percorso,))
+        self._connessione.execute('INSERT OR REPLACE INTO progetti VALUES (?, ?, ?, ?, ?)',
+                                  (percorso, stat.st_mtime, stat.st_size, '', errore))
+
+    def _rimuovi(self, percorso):
+        """Drop a project file from the index."""
+        self._connessione.execute('DELETE FROM relazioni WHERE progetto = ?', (percorso,))
+        self._connessione.execute('DELETE FROM progetti WHERE percorso = ?', (percorso,))
+
+    def cerca(self, layer=None, sorgente=None, limite=None):
+        """Find the relationships having a layer whose name, or data source, contains a text.
+
+        Both the parent and the child layer are matched, case-insensitively;
+        with both criteria a relationship must match both.
+
+        :returns: list of ``(progetto, relazione_id, relazione)`` triples,
+            ``relazione`` being in the export format.
+        """
+        condizioni = []
+        parametri = []
+        for testo, colonne in ((layer, ('referencing_layer', 'referenced_layer')),
+                               (sorgente, ('referencing_source', 'referenced_source'))):
+            if testo:
+                condizioni.append('(' + ' OR '.join(f"{colonna} LIKE ? ESCAPE '\\'" for colonna in colonne) + ')')
+                parametri += [motivo_like(testo)] * len(colonne)
+
+        sql = 'SELECT progetto, id, nome, referencing_layer, referenced_layer, chiavi FROM relazioni'
+        if condizioni:
+            sql += ' WHERE ' + ' AND '.join(condizioni)
+        sql += ' ORDER BY progetto, nome'
+        if limite:
+            sql += f' LIMIT {int(limite)}'
+        return [(progetto, relazione_id, {
+            'nome': nome,
+            'referencing_layer': figlio,
+            'referenced_layer': padre,
+            'chiavi': json.loads(chiavi)
+        }) for progetto, relazione_id, nome, figlio, padre, chiavi in self._connessione.execute(sql, parametri)]
+
+    def errori(self):
+        """Return the ``(path, reason)`` pairs of the project files that could not be read."""
+        return self._connessione.execute(
+            'SELECT percorso, errore FROM progetti WHERE errore IS NOT NULL ORDER BY percorso').fetchall()
+
+    def chiudi(self):
+        """Close the index file."""
+        self._connessione.close()
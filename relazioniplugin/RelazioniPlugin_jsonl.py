@@ -0,0 +1,59 @@
+"""Streaming JSON Lines serialization of relationship catalogs.
+
+Each line holds one relationship in the export format used by the plugin,
+with its id stored in the ``id`` member::
+
+    {"id": "...", "nome": "...", "referencing_layer": "...", "referenced_layer": "...", "chiavi": {...}}
+
+Both directions work on iterables, so catalogs of any size are written and
+read with constant memory.
+"""
+
+import json
+import os
+
+
+def scrivi_jsonl(relazioni, file, progresso=None, totale=None):
+    """Write relationships to a JSON Lines file.
+
+    :param relazioni: iterable of ``(relazione_id, relazione)`` pairs.
+    :param file: text file object opened for writing.
+    :param progresso: optional callable receiving the completed fraction (0-1).
+    :param totale: expected number of relationships, used for the progress.
+    :returns: number of relationships written.
+    """
+    scritte = 0
+    for relazione_id, relazione in relazioni:
+        riga = dict(relazione)
+        riga['id'] = relazione_id
+        file.write(json.dumps(riga, ensure_ascii=False))
+        file.write('\n')
+        scritte += 1
+        if progresso and totale:
+            progresso(scritte / totale)
+    return scritte
+
+
+def leggi_jsonl(file, progresso=None):
+    """Read relationships from a JSON Lines file, one line at a time.
+
+    :param file: binary file object opened for reading.
+    :param progresso: optional callable receiving the fraction of bytes read (0-1).
+    :returns: generator of ``(relazione_id, relazione)`` pairs.
+    :raises ValueError: if a line is not a valid JSON object.
+    """
+    dimensione = os.fstat(file.fileno()).st_size if progresso else 0
+    letti = 0
+    for numero, riga in enumerate(file, start=1):
+        letti += len(riga)
+        riga = riga.strip()
+        if riga:
+            try:
+                relazione = json.loads(riga)
+            except json.JSONDecodeError as errore:
+                raise ValueError(f"Invalid JSON on line {numero}: {errore.msg}") from errore
+            if not isinstance(relazione, dict):
+                raise ValueError(f"Line {numero} is not a JSON object")
+            yield relazione.pop('id', None), relazione
+        if progresso and dimensione:
+            progresso(letti / dimensione)
@@ -0,0 +1,275 @@
+from PyQt5.QtCore import QObject, QSortFilterProxyModel, Qt, QVariant, pyqtSignal
+from PyQt5.QtGui import QStandardItem, QStandardItemModel
+from PyQt5.QtWidgets import QComboBox, QCompleter
+from qgis.core import QgsVectorLayer
+
+# Tipi di campo che possono essere confrontati tra loro in una relazione
+GRUPPI_TIPI = {
+    QVariant.Int: 'numero',
+    QVariant.UInt: 'numero',
+    QVariant.LongLong: 'numero',
+    QVariant.ULongLong: 'numero',
+    QVariant.Double: 'numero',
+    QVariant.String: 'testo',
+    QVariant.Date: 'data',
+    QVariant.DateTime: 'data',
+}
+
+
+def tipi_compatibili(tipo_a, tipo_b):
+    """Tell whether two field types (QVariant.Type) can be used as a key pair."""
+    return GRUPPI_TIPI.get(tipo_a, tipo_a) == GRUPPI_TIPI.get(tipo_b, tipo_b)
+
+
+class CatalogoLayer(QObject):
+    """Shared cache of the project vector layers and of their fields.
+
+    The layer list is exposed as a single item model that every layer combo
+    of the dialog uses, and the field models are built lazily, once per
+    layer. Both are kept up to date from the project and layer signals
+    (``layersAdded``, ``layersRemoved``, ``nameChanged``, ``updatedFields``)
+    instead of being rebuilt every time a dialog opens.
+
+    ``layerRinominato`` is emitted with the id of a renamed layer and
+    ``campiModificati`` with the id of a layer whose fields changed and the
+    names of the fields added or removed, or None if they are not known.
+    """
+
+    layerRinominato = pyqtSignal(str)
+    campiModificati = pyqtSignal(str, object)
+
+    LayerIdRole = Qt.UserRole + 1
+    TipoCampoRole = Qt.UserRole + 2
+
+    def __init__(self, project, parent=None):
+        """Constructor."""
+        super().__init__(parent)
+        self.project = project
+        self.modello_layer = QStandardItemModel(self)
+        self.modello_vuoto = QStandardItemModel(self)
+
+        # Indici: id -> layer, id -> nome, nome -> ids (in ordine di inserimento), id -> campi
+        self._layer = {}
+        self._nomi_layer = {}
+        self._ids_per_nome = {}
+        self._nomi_campi = {}
+        self._modelli_campi = {}
+
+        self.project.layersAdded.connect(self._aggiungi_layer)
+        self.project.layersRemoved.connect(self._rimuovi_layer)
+
+        self._aggiungi_layer(self.project.mapLayers().values())
+
+    def layer(self, nome):
+        """Return the first vector layer with the given name, or None."""
+        ids = self._ids_per_nome.get(nome)
+        return self._layer[ids[0]] if ids else None
+
+    def nomi_campi(self, layer_id):
+        """Return the set of field names of a layer (cached)."""
+        nomi = self._nomi_campi.get(layer_id)
+        if nomi is None:
+            layer = self._layer.get(layer_id)
+            nomi = frozenset(layer.fields().names()) if layer else frozenset()
+            self._nomi_campi[layer_id] = nomi
+        return nomi
+
+    def modello_campi(self, layer_id):
+        """Return the shared item model listing the fields of a layer.
+
+        The model is created on first use and refreshed in place when the
+        layer fields change, so the combos using it stay current.
+        """
+        modello = self._modelli_campi.get(layer_id)
+        if modello is None:
+            modello = QStandardItemModel(self)
+            self._riempi_campi(layer_id, modello)
+            self._modelli_campi[layer_id] = modello
+        return modello
+
+    def _aggiungi_layer(self, layers):
+        """Add newly loaded vector layers to the catalog."""
+        for layer in layers:
+            if not isinstance(layer, QgsVectorLayer) or layer.id() in self._layer:
+                continue
+            layer_id = layer.id()
+            self._layer[layer_id] = layer
+            self._indicizza_nome(layer_id, layer.name())
+
+            item = QStandardItem(layer.name())
+            item.setData(layer_id, self.LayerIdRole)
+            item.setEditable(False)
+            self.modello_layer.appendRow(item)
+
+            layer.nameChanged.connect(lambda layer_id=layer_id: self._rinomina_layer(layer_id))
+            layer.updatedFields.connect(lambda layer_id=layer_id: self._invalida_campi(layer_id))
+
+    def _rimuovi_layer(self, layer_ids):
+        """Drop removed layers from the catalog."""
+        for layer_id in layer_ids:
+            layer = self._layer.pop(layer_id, None)
+            if layer is None:
+                continue
+            self._rimuovi_nome(layer_id)
+            self._nomi_campi.pop(layer_id, None)
+            modello = self._modelli_campi.pop(layer_id, None)
+            if modello is not None:
+                modello.clear()
+            riga = self._riga(layer_id)
+            if riga >= 0:
+                self.modello_layer.removeRow(riga)
+
+    def _rinomina_layer(self, layer_id):
+        """Follow a layer rename."""
+        layer = self._layer.get(layer_id)
+        if layer is None:
+            return
+        self._rimuovi_nome(layer_id)
+        self._indicizza_nome(layer_id, layer.name())
+        riga = self._riga(layer_id)
+        if riga >= 0:
+            self.modello_layer.item(riga).setText(layer.name())
+        self.layerRinominato.emit(layer_id)
+
+    def _invalida_campi(self, layer_id):
+        """Forget the cached fields of a layer whose schema changed."""
+        nomi_precedenti = self._nomi_campi.pop(layer_id, None)
+        modello = self._modelli_campi.get(layer_id)
+        if modello is not None:
+            self._riempi_campi(layer_id, modello)
+        if nomi_precedenti is None:
+            self.campiModificati.emit(layer_id, None)
+        else:
+            self.campiModificati.emit(layer_id, sorted(nomi_precedenti ^ self.nomi_campi(layer_id)))
+
+    def _riempi_campi(self, layer_id, modello):
+        """Fill a field model from the layer schema."""
+        modello.clear()
+        layer = self._layer.get(layer_id)
+        if layer is None:
+            return
+        for field in layer.fields():
+            item = QStandardItem(field.name())
+            item.setData(field.type(), self.TipoCampoRole)
+            item.setEditable(False)
+            modello.appendRow(item)
+
+    def _indicizza_nome(self, layer_id, nome):
+        """Add a layer id to the name index."""
+        self._nomi_layer[layer_id] = nome
+        self._ids_per_nome.setdefault(nome, []).append(layer_id)
+
+    def _rimuovi_nome(self, layer_id):
+        """Remove a layer id from the name index."""
+        nome = self._nomi_layer.pop(layer_id, None)
+        ids = self._ids_per_nome.get(nome)
+        if ids and layer_id in ids:
+            ids.remove(layer_id)
+            if not ids:
+                del self._ids_per_nome[nome]
+
+    def _riga(self, layer_id):
+        """Return the row of a layer in the layer model, or -1."""
+        trovati = self.modello_layer.match(
+            self.modello_layer.index(0, 0), self.LayerIdRole, layer_id, 1, Qt.MatchExactly)
+        return trovati[0].row() if trovati else -1
+
+
+class CampiCompatibiliProxy(QSortFilterProxyModel):
+    """Field model filter keeping only the fields compatible with a reference type.
+
+    A field set with :meth:`imposta_campo_fisso`, such as the key of the
+    relationship being edited, is always kept.
+    """
+
+    def __init__(self, parent=None):
+        """Constructor."""
+        super().__init__(parent)
+        self._tipo = None
+        self._campo_fisso = None
+
+    def imposta_tipo(self, tipo):
+        """Set the reference field type (QVariant.Type), or None to list every field."""
+        if tipo != self._tipo:
+            self._tipo = tipo
+            self.invalidateFilter()
+
+    def imposta_campo_fisso(self, nome):
+        """Set the name of a field listed whatever its type, or None."""
+        if nome != self._campo_fisso:
+            self._campo_fisso = nome
+            self.invalidateFilter()
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        """Accept the fields whose type is compatible with the reference type."""
+        if self._tipo is None:
+            return True
+        indice = self.sourceModel().index(source_row, 0, source_parent)
+        if self._campo_fisso is not None and indice.data() == self._campo_fisso:
+            return True
+        return tipi_compatibili(self._tipo, indice.data(CatalogoLayer.TipoCampoRole))
+
+
+def crea_combo_filtrabile(modello):
+    """Create an editable combobox over a shared model, filtered as the user types."""
+    combo = QComboBox()
+    combo.setEditable(True)
+    combo.setInsertPolicy(QComboBox.NoInsert)
+    if modello is not None:
+        combo.setModel(modello)
+
+    completer = QCompleter(combo.model(), combo)
+    completer.setCaseSensitivity(Qt.CaseInsensitive)
+    completer.setFilterMode(Qt.MatchContains)
+    completer.setCompletionMode(QCompleter.PopupCompletion)
+    combo.setCompleter(completer)
+    return combo
+
+
+def crea_combo_campi(catalogo, combo_layer, chiave_preselezionata, combo_riferimento=None):
+    """Create a combobox to select a key field of the layer chosen in ``combo_layer``.
+
+    The fields are taken from the layer catalog only when a layer is
+    selected, and follow the layer combo when it changes. If
+    ``combo_riferimento`` is given, only the fields type-compatible with
+    the field selected there are listed, plus ``chiave_preselezionata``:
+    the key of an existing relationship is never replaced silently. A
+    preselected key of another type, or missing from the layer, is kept
+    and explained in the combo tooltip.
+    """
+    proxy = CampiCompatibiliProxy()
+    if chiave_preselezionata:
+        proxy.imposta_campo_fisso(chiave_preselezionata)
+    combo = crea_combo_filtrabile(proxy)
+    proxy.setParent(combo)
+
+    def aggiorna_layer():
+        layer_id = combo_layer.currentData(CatalogoLayer.LayerIdRole)
+        if layer_id:
+            proxy.setSourceModel(catalogo.modello_campi(layer_id))
+        else:
+            proxy.setSourceModel(catalogo.modello_vuoto)
+
+    def aggiorna_tipo():
+        proxy.imposta_tipo(combo_riferimento.currentData(CatalogoLayer.TipoCampoRole))
+
+    aggiorna_layer()
+    combo_layer.currentIndexChanged.connect(aggiorna_layer)
+    if combo_riferimento is not None:
+        aggiorna_tipo()
+        combo_riferimento.currentIndexChanged.connect(aggiorna_tipo)
+
+    if chiave_preselezionata:
+        indice = combo.findText(chiave_preselezionata, Qt.MatchExactly)
+        if indice >= 0:
+            combo.setCurrentIndex(indice)
+            if combo_riferimento is not None and not tipi_compatibili(
+                    combo_riferimento.currentData(CatalogoLayer.TipoCampoRole),
+                    combo.currentData(CatalogoLayer.TipoCampoRole)):
+                combo.setToolTip(f"The type of {chiave_preselezionata} differs from the type of the parent key")
+        else:
+            # Campo assente dal layer: resta com'è e la validazione lo segnala alla conferma
+            combo.setCurrentIndex(-1)
+            combo.setEditText(chiave_preselezionata)
+            combo.setToolTip(f"Field {chiave_preselezionata} not found in the layer")
+    return combo
@@ -0,0 +1,273 @@
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, QSortFilterProxyModel, Qt, QTimer
+from PyQt5.QtGui import QBrush
+from .RelazioniPlugin_catalogo import IndiceRelazioni
+from .RelazioniPlugin_core import dettagli_relazione
+from .RelazioniPlugin_grafo import GrafoRelazioni
+
+
+class RelazioniModel(QAbstractTableModel):
+    """Table model of the project relationships, kept in sync incrementally.
+
+    The model keeps a detail record of every relation keyed by id and,
+    whenever the relation manager reports a change, applies only the rows
+    that were actually inserted, removed or modified instead of rebuilding
+    the whole view. The cached records are also what the dialog actions use
+    to resolve the selected relationship. The same changes keep the layer
+    graph in ``grafo`` and the layer/field reverse indexes in ``indice`` up
+    to date, so the relationships affected by a layer or field change are
+    found without walking them all.
+
+    Only the relations whose definition (name, layers, key pairs, strength)
+    changed get a new detail record; a change of the layer fields is
+    applied through :meth:`impatto` and :meth:`aggiorna_relazioni`.
+    """
+
+    RelazioneIdRole = Qt.UserRole + 1
+
+    COLONNE = ("ID", "Name", "Parent Layer", "Child Layer", "Keys", "Strength")
+
+    def __init__(self, relation_manager, parent=None, nomi_campi=None):
+        """Constructor.
+
+        :param nomi_campi: optional callable returning the cached set of field
+            names of a layer id, such as :meth:`CatalogoLayer.nomi_campi`.
+        """
+        super().__init__(parent)
+        self.relation_manager = relation_manager
+        self.nomi_campi = nomi_campi
+
+        # Ordine delle righe, indici id -> riga, id -> dettagli e id -> definizione della relazione
+        self._ids = []
+        self._righe = {}
+        self._dettagli = {}
+        self._definizioni = {}
+        self.grafo = GrafoRelazioni()
+        self.indice = IndiceRelazioni()
+        # Nome corrente dei layer indicizzati, per la ricerca testuale
+        self._nomi_layer = {}
+
+        self.relation_manager.relationsLoaded.connect(self.ricarica)
+        self.relation_manager.changed.connect(self.sincronizza)
+
+        self.ricarica()
+
+    def rowCount(self, parent=QModelIndex()):
+        """Number of relationships in the model."""
+        if parent.isValid():
+            return 0
+        return len(self._ids)
+
+    def columnCount(self, parent=QModelIndex()):
+        """Number of detail columns."""
+        if parent.isValid():
+            return 0
+        return len(self.COLONNE)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        """Column titles."""
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole and section < len(self.COLONNE):
+            return self.COLONNE[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        """Return the data stored under the given role for the cell."""
+        if not index.isValid() or index.row() >= len(self._ids):
+            return None
+
+        relazione_id = self._ids[index.row()]
+        if role == self.RelazioneIdRole:
+            return relazione_id
+        if role in (Qt.DisplayRole, Qt.ToolTipRole):
+            return self._testo_colonna(self._dettagli[relazione_id], index.column())
+        if role == Qt.ForegroundRole and not self._dettagli[relazione_id]['valida']:
+            # Layer o campi chiave mancanti
+            return QBrush(Qt.red)
+        return None
+
+    def dettagli(self, relazione_id):
+        """Return a copy of the cached details of a relationship, or None."""
+        dettagli = self._dettagli.get(relazione_id)
+        if dettagli is None:
+            return None
+        return dict(dettagli, chiavi=dict(dettagli['chiavi']))
+
+    def riga(self, relazione_id):
+        """Return the row of a relationship, or -1 if it is not in the model."""
+        return self._righe.get(relazione_id, -1)
+
+    def relazioni(self):
+        """Iterate over the cached detail records, which must not be modified."""
+        return self._dettagli.values()
+
+    def cerca(self, testo):
+        """Return the ids of the relationships whose name, id, layers or key fields contain a text."""
+        testo = testo.casefold()
+        ids = {relazione_id for relazione_id, dettagli in self._dettagli.items()
+               if testo in dettagli['nome'].casefold() or testo in relazione_id.casefold()}
+        for layer_id in self.indice.layer():
+            if testo in self._nomi_layer.get(layer_id, '').casefold():
+                ids.update(self.indice.relazioni_layer(layer_id))
+        for layer_id, campo in self.indice.campi():
+            if testo in campo.casefold():
+                ids.update(self.indice.relazioni_campo(layer_id, campo))
+        return ids
+
+    def impatto(self, layer_id, campi=None):
+        """Return the ids of the relationships affected by a change to a layer or to some of its fields.
+
+        :param campi: optional names of the changed fields; the whole layer if None.
+        """
+        if campi is None:
+            return self.indice.relazioni_layer(layer_id)
+        ids = set()
+        for campo in campi:
+            ids.update(self.indice.relazioni_campo(layer_id, campo))
+        return ids
+
+    def aggiorna_relazioni(self, ids):
+        """Refresh the given relationships, e.g. after a layer rename or a field change."""
+        for relazione_id in ids:
+            if relazione_id not in self._dettagli:
+                continue
+            dettagli = self.dettagli_relazione(self.relation_manager.relation(relazione_id), self.nomi_campi)
+            if dettagli != self._dettagli[relazione_id]:
+                self._dettagli[relazione_id] = dettagli
+                self._indicizza(dettagli)
+                riga = self._righe[relazione_id]
+                self.dataChanged.emit(self.index(riga, 0), self.index(riga, len(self.COLONNE) - 1))
+
+    def ricarica(self):
+        """Reset the model from the relation manager (e.g. after a project load)."""
+        self.beginResetModel()
+        self._ids = []
+        self._righe = {}
+        self._dettagli = {}
+        self._definizioni = {}
+        self.grafo.svuota()
+        self.indice.svuota()
+        self._nomi_layer = {}
+        for relazione_id, relation in self.relation_manager.relations().items():
+            self._righe[relazione_id] = len(self._ids)
+            self._ids.append(relazione_id)
+            self._definizioni[relazione_id] = self.definizione(relation)
+            self._dettagli[relazione_id] = self.dettagli_relazione(relation, self.nomi_campi)
+            self._indicizza(self._dettagli[relazione_id])
+        self.endResetModel()
+
+    def sincronizza(self):
+        """Apply only the differences between the model and the relation manager."""
+        relazioni = self.relation_manager.relations()
+
+        # Rimuovi le relazioni che non esistono più, dal fondo per non spostare le righe
+        rimosse = [riga for riga, relazione_id in enumerate(self._ids) if relazione_id not in relazioni]
+        for riga in reversed(rimosse):
+            relazione_id = self._ids[riga]
+            self.beginRemoveRows(QModelIndex(), riga, riga)
+            del self._ids[riga]
+            del self._dettagli[relazione_id]
+            del self._definizioni[relazione_id]
+            self.grafo.rimuovi_arco(relazione_id)
+            self.indice.rimuovi(relazione_id)
+            self.endRemoveRows()
+        if rimosse:
+            self._righe = {relazione_id: riga for riga, relazione_id in enumerate(self._ids)}
+
+        for relazione_id, relation in relazioni.items():
+            # Il confronto della definizione evita di rileggere i campi dei layer
+            definizione = self.definizione(relation)
+            if self._definizioni.get(relazione_id) == definizione:
+                continue
+            self._definizioni[relazione_id] = definizione
+            dettagli = self.dettagli_relazione(relation, self.nomi_campi)
+            if relazione_id not in self._dettagli:
+                # Nuova relazione: accodala
+                riga = len(self._ids)
+                self.beginInsertRows(QModelIndex(), riga, riga)
+                self._righe[relazione_id] = riga
+                self._ids.append(relazione_id)
+                self._dettagli[relazione_id] = dettagli
+                self._indicizza(dettagli)
+                self.endInsertRows()
+            elif self._dettagli[relazione_id] != dettagli:
+                # Relazione modificata: aggiorna solo la sua riga
+                self._dettagli[relazione_id] = dettagli
+                self._indicizza(dettagli)
+                riga = self._righe[relazione_id]
+                self.dataChanged.emit(self.index(riga, 0), self.index(riga, len(self.COLONNE) - 1))
+
+    def _indicizza(self, dettagli):
+        """Add or replace a relationship in the layer graph and in the reverse indexes."""
+        self.grafo.aggiungi_arco(dettagli['id'], dettagli['layer_padre_id'], dettagli['layer_figlio_id'])
+        self.indice.aggiungi(dettagli['id'], dettagli['layer_padre_id'], dettagli['layer_figlio_id'], dettagli['chiavi'])
+        self._nomi_layer[dettagli['layer_padre_id']] = dettagli['layer_padre']
+        self._nomi_layer[dettagli['layer_figlio_id']] = dettagli['layer_figlio']
+
+    @staticmethod
+    def definizione(relation):
+        """Return the comparable definition of a relation, cheap to build."""
+        return (relation.name(), relation.referencedLayerId(), relation.referencingLayerId(),
+                tuple(relation.fieldPairs().items()), relation.strength())
+
+    # Record di dettaglio di una relazione, condiviso con il catalogo senza interfaccia
+    dettagli_relazione = staticmethod(dettagli_relazione)
+
+    @staticmethod
+    def _testo_colonna(dettagli, colonna):
+        """Text shown in a column for a relationship."""
+        if colonna == 0:
+            return dettagli['id']
+        if colonna == 1:
+            return dettagli['nome']
+        if colonna == 2:
+            return dettagli['layer_padre']
+        if colonna == 3:
+            return dettagli['layer_figlio']
+        if colonna == 4:
+            return ', '.join(f'{figlio} → {padre}' for figlio, padre in dettagli['chiavi'].items())
+        if colonna == 5:
+            return dettagli['forza']
+        return None
+
+
+class FiltroRelazioniProxy(QSortFilterProxyModel):
+    """Filter of the relationships table on a text, resolved through the model reverse indexes.
+
+    The matching ids are recomputed once per burst of model changes while
+    a filter is set.
+    """
+
+    def __init__(self, modello, parent=None):
+        """Constructor."""
+        super().__init__(parent)
+        self.setSourceModel(modello)
+        self._testo = ''
+        self._ids = None
+
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(0)
+        self._timer.timeout.connect(self._ricalcola)
+        for segnale in (modello.modelReset, modello.rowsInserted, modello.dataChanged):
+            segnale.connect(self._modello_cambiato)
+
+    def imposta_testo(self, testo):
+        """Show only the relationships matching a text, or all of them if it is empty."""
+        self._testo = testo.strip()
+        self._ricalcola()
+
+    def _modello_cambiato(self):
+        """Schedule a new match after a change of the source model."""
+        if self._testo:
+            self._timer.start()
+
+    def _ricalcola(self):
+        """Match the text and apply the filter."""
+        self._ids = self.sourceModel().cerca(self._testo) if self._testo else None
+        self.invalidateFilter()
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        """Accept the relationships matching the text."""
+        if self._ids is None:
+            return True
+        indice = self.sourceModel().index(source_row, 0, source_parent)
+        return indice.data(RelazioniModel.RelazioneIdRole) in self._ids
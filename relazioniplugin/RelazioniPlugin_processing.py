@@ -0,0 +1,328 @@
+"""Processing provider of the relationship algorithms.
+
+The algorithms wrap :class:`CatalogoRelazioni` and the integrity checks,
+so they run in Processing batch mode and from ``qgis_process`` on any
+number of project files, e.g.::
+
+    qgis_process run relationmanager:importrelations --PROJECT_PATH=project.qgz -- \\
+        INPUT=relations.jsonl SAVE_PROJECT=true
+
+As in the background tasks of the dialog, everything touching the project
+happens in ``prepareAlgorithm`` on the main thread, while reading files,
+scanning layers and querying databases happen in ``processAlgorithm``;
+only the import, which changes the relation manager, runs entirely on the
+main thread.
+"""
+
+import os
+import sqlite3
+
+from PyQt5.QtCore import QVariant
+from PyQt5.QtGui import QIcon
+from qgis.core import (
+    QgsFeature, QgsFeatureSink, QgsField, QgsFields, QgsProcessing, QgsProcessingAlgorithm,
+    QgsProcessingException, QgsProcessingOutputNumber, QgsProcessingParameterBoolean,
+    QgsProcessingParameterFeatureSink, QgsProcessingParameterFile, QgsProcessingParameterFileDestination,
+    QgsProcessingProvider, QgsProviderConnectionException, QgsWkbTypes
+)
+
+from .RelazioniPlugin_core import FILTRO_FILE_RELAZIONI, CatalogoRelazioni, e_jsonl
+from .RelazioniPlugin_integrita import esegui_verifica_sql, prepara_verifica, prepara_verifica_sql, scansiona_orfani
+from .RelazioniPlugin_task import indice_layer, leggi_relazioni, nome_relazione, scrivi_relazioni, valida_relazione
+
+
+def campi_report(*nomi):
+    """Build the string fields of a report table."""
+    campi = QgsFields()
+    for nome in nomi:
+        campi.append(QgsField(nome, QVariant.String))
+    return campi
+
+
+class AlgoritmoRelazioni(QgsProcessingAlgorithm):
+    """Common metadata of the relationship algorithms."""
+
+    def createInstance(self):
+        """Return a new copy of the algorithm."""
+        return type(self)()
+
+    def group(self):
+        """Group of the algorithm in the toolbox."""
+        return "Relationships"
+
+    def groupId(self):
+        """Id of the group of the algorithm."""
+        return 'relationships'
+
+    def icon(self):
+        """Icon of the plugin."""
+        return QIcon(os.path.join(os.path.dirname(__file__), 'icon.png'))
+
+    def _sink_report(self, parameters, context, campi):
+        """Create the optional report table, returning ``(sink, dest_id)``."""
+        return self.parameterAsSink(parameters, 'OUTPUT', context, campi, QgsWkbTypes.NoGeometry)
+
+    @staticmethod
+    def _aggiungi_riga(sink, campi, valori):
+        """Append a row to the report table, if any."""
+        if sink is not None:
+            feature = QgsFeature(campi)
+            feature.setAttributes([None if valore is None else str(valore) for valore in valori])
+            sink.addFeature(feature, QgsFeatureSink.FastInsert)
+
+
+class ImportaRelazioniAlgoritmo(AlgoritmoRelazioni):
+    """Add the relationships of a file to the project."""
+
+    def name(self):
+        """Id of the algorithm."""
+        return 'importrelations'
+
+    def displayName(self):
+        """Name of the algorithm."""
+        return "Import relations"
+
+    def shortHelpString(self):
+        """Help of the algorithm."""
+        return ("Adds the relationships of a JSON or JSON Lines export file to the project; a relationship with "
+                "the same id replaces the existing one. Relationships whose layers or key fields are missing "
+                "are reported and skipped. Enable 'Save project' when running from qgis_process, otherwise "
+                "the changes are lost when the project is closed.")
+
+    def flags(self):
+        """The relation manager can only be changed on the main thread."""
+        return super().flags() | QgsProcessingAlgorithm.FlagNoThreading
+
+    def initAlgorithm(self, config=None):
+        """Declare the parameters and outputs."""
+        self.addParameter(QgsProcessingParameterFile('INPUT', "Relationship file", fileFilter=FILTRO_FILE_RELAZIONI))
+        self.addParameter(QgsProcessingParameterBoolean(
+            'REPLACE', "Remove the relationships missing from the file", defaultValue=False))
+        self.addParameter(QgsProcessingParameterBoolean('SAVE_PROJECT', "Save project", defaultValue=False))
+        self.addOutput(QgsProcessingOutputNumber('LOADED', "Loaded relationships"))
+        self.addOutput(QgsProcessingOutputNumber('FAILED', "Rejected relationships"))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        """Import the file."""
+        file_path = self.parameterAsFile(parameters, 'INPUT', context)
+        project = context.project()
+        try:
+            esito = CatalogoRelazioni(project).importa(
+                file_path, sostituisci=self.parameterAsBoolean(parameters, 'REPLACE', context))
+        except (OSError, ValueError) as errore:
+            raise QgsProcessingException(f"The file format is invalid: {errore}")
+
+        for nome, motivo in esito['fallite']:
+            feedback.reportError(f"{nome}: {motivo}")
+        feedback.pushInfo(f"{len(esito['caricate'])} relationships loaded, {len(esito['fallite'])} failed.")
+
+        if self.parameterAsBoolean(parameters, 'SAVE_PROJECT', context):
+            if not project.write():
+                raise QgsProcessingException(f"Could not save the project: {project.error()}")
+        return {'LOADED': len(esito['caricate']), 'FAILED': len(esito['fallite'])}
+
+
+class EsportaRelazioniAlgoritmo(AlgoritmoRelazioni):
+    """Write the project relationships to a file."""
+
+    def name(self):
+        """Id of the algorithm."""
+        return 'exportrelations'
+
+    def displayName(self):
+        """Name of the algorithm."""
+        return "Export relations"
+
+    def shortHelpString(self):
+        """Help of the algorithm."""
+        return ("Writes the relationships of the project to a JSON or JSON Lines file (chosen by the extension), "
+                "in the format read by 'Import relations'.")
+
+    def initAlgorithm(self, config=None):
+        """Declare the parameters and outputs."""
+        self.addParameter(QgsProcessingParameterFileDestination(
+            'OUTPUT', "Relationship file", fileFilter=FILTRO_FILE_RELAZIONI))
+        self.addOutput(QgsProcessingOutputNumber('COUNT', "Exported relationships"))
+
+    def prepareAlgorithm(self, parameters, context, feedback):
+        """Read the relationships on the main thread."""
+        self._relazioni = CatalogoRelazioni(context.project()).elenca()
+        return True
+
+    def processAlgorithm(self, parameters, context, feedback):
+        """Write the file."""
+        file_path = self.parameterAsFileOutput(parameters, 'OUTPUT', context)
+        try:
+            with open(file_path, 'w', encoding='utf-8') as file:
+                scrivi_relazioni(self._relazioni, file, e_jsonl(file_path),
+                                 lambda frazione: feedback.setProgress(frazione * 100), len(self._relazioni))
+        except OSError as errore:
+            raise QgsProcessingException(str(errore))
+        return {'OUTPUT': file_path, 'COUNT': len(self._relazioni)}
+
+
+class ValidaRelazioniAlgoritmo(AlgoritmoRelazioni):
+    """Check a relationship file against the project layers without changing the project."""
+
+    def name(self):
+        """Id of the algorithm."""
+        return 'validaterelations'
+
+    def displayName(self):
+        """Name of the algorithm."""
+        return "Validate relations"
+
+    def shortHelpString(self):
+        """Help of the algorithm."""
+        return ("Checks that the parent and child layers and the key fields of every relationship of a JSON or "
+                "JSON Lines export file exist in the project, without changing it. The rejected relationships "
+                "are listed in the optional report table.")
+
+    def initAlgorithm(self, config=None):
+        """Declare the parameters and outputs."""
+        self.addParameter(QgsProcessingParameterFile('INPUT', "Relationship file", fileFilter=FILTRO_FILE_RELAZIONI))
+        self.addParameter(QgsProcessingParameterFeatureSink(
+            'OUTPUT', "Rejected relationships", QgsProcessing.TypeVector, optional=True, createByDefault=False))
+        self.addOutput(QgsProcessingOutputNumber('VALID', "Valid relationships"))
+        self.addOutput(QgsProcessingOutputNumber('INVALID', "Rejected relationships"))
+
+    def prepareAlgorithm(self, parameters, context, feedback):
+        """Build the layer lookup tables on the main thread."""
+        self._layer_per_nome, self._campi_per_layer = indice_layer(context.project())
+        return True
+
+    def processAlgorithm(self, parameters, context, feedback):
+        """Read and validate the file."""
+        file_path = self.parameterAsFile(parameters, 'INPUT', context)
+        campi = campi_report('id', 'name', 'reason')
+        sink, dest_id = self._sink_report(parameters, context, campi)
+
+        valide = 0
+        fallite = 0
+        try:
+            with open(file_path, 'rb') as file:
+                relazioni, totale = leggi_relazioni(
+                    file, e_jsonl(file_path), lambda frazione: feedback.setProgress(frazione * 100))
+                for numero, (relazione_id, relazione) in enumerate(relazioni, start=1):
+                    if feedback.isCanceled():
+                        break
+                    _, errore = valida_relazione(relazione_id, relazione, self._layer_per_nome, self._campi_per_layer)
+                    if errore:
+                        fallite += 1
+                        nome = nome_relazione(relazione_id, relazione)
+                        feedback.reportError(f"{nome}: {errore}")
+                        self._aggiungi_riga(sink, campi, (str(relazione_id), nome, errore))
+                    else:
+                        valide += 1
+                    if totale:
+                        feedback.setProgress(numero * 100 / totale)
+        except (OSError, ValueError) as errore:
+            raise QgsProcessingException(f"The file format is invalid: {errore}")
+
+        feedback.pushInfo(f"{valide} relationships valid, {fallite} rejected.")
+        return {'OUTPUT': dest_id, 'VALID': valide, 'INVALID': fallite}
+
+
+class VerificaIntegritaAlgoritmo(AlgoritmoRelazioni):
+    """Count the orphan child features of every project relationship."""
+
+    def name(self):
+        """Id of the algorithm."""
+        return 'checkintegrity'
+
+    def displayName(self):
+        """Name of the algorithm."""
+        return "Check referential integrity"
+
+    def shortHelpString(self):
+        """Help of the algorithm."""
+        return ("Counts, for every relationship of the project, the child features whose key references no "
+                "parent feature. When both layers live in the same PostgreSQL database or GeoPackage/SQLite "
+                "file the check runs in the database, otherwise the key columns are scanned.")
+
+    def initAlgorithm(self, config=None):
+        """Declare the parameters and outputs."""
+        self.addParameter(QgsProcessingParameterBoolean(
+            'USE_SQL', "Run the check in the database when possible", defaultValue=True))
+        self.addParameter(QgsProcessingParameterFeatureSink(
+            'OUTPUT', "Integrity report", QgsProcessing.TypeVector, optional=True, createByDefault=False))
+        self.addOutput(QgsProcessingOutputNumber('ORPHANS', "Orphan child features"))
+        self.addOutput(QgsProcessingOutputNumber('FAILED', "Relationships not checked"))
+
+    def prepareAlgorithm(self, parameters, context, feedback):
+        """Collect the queries and the feature sources on the main thread."""
+        usa_sql = self.parameterAsBoolean(parameters, 'USE_SQL', context)
+        self._verifiche = []
+        for relation in context.project().relationManager().relations().values():
+            piano = None
+            if usa_sql:
+                piano, _ = prepara_verifica_sql(relation)
+            if piano is not None:
+                self._verifiche.append(('SQL', piano, None))
+                continue
+            verifica, errore = prepara_verifica(relation)
+            self._verifiche.append(('Scan', verifica, errore) if verifica else (None, relation, errore))
+        return True
+
+    def processAlgorithm(self, parameters, context, feedback):
+        """Check every relationship."""
+        campi = campi_report('id', 'name', 'method', 'checked', 'orphans', 'error')
+        sink, dest_id = self._sink_report(parameters, context, campi)
+
+        orfani_totali = 0
+        non_verificate = 0
+        numero = len(self._verifiche)
+        for posizione, (metodo, verifica, errore) in enumerate(self._verifiche):
+            if feedback.isCanceled():
+                break
+
+            controllati = orfani = None
+            if metodo == 'SQL':
+                relazione_id, nome = verifica['id'], verifica['nome']
+                try:
+                    orfani = esegui_verifica_sql(verifica)
+                except (QgsProviderConnectionException, sqlite3.Error) as eccezione:
+                    errore = str(eccezione)
+            elif metodo == 'Scan':
+                relazione_id, nome = verifica['id'], verifica['nome']
+
+                def progresso(frazione, posizione=posizione):
+                    feedback.setProgress((posizione + frazione) * 100 / numero)
+
+                esito = scansiona_orfani(verifica, feedback.isCanceled, progresso)
+                controllati, orfani = esito['controllati'], esito['orfani']
+            else:
+                relazione_id, nome = verifica.id(), verifica.name()
+
+            if errore:
+                non_verificate += 1
+                feedback.reportError(f"{nome}: {errore}")
+            else:
+                orfani_totali += orfani
+                feedback.pushInfo(f"{nome}: {orfani} orphans")
+            self._aggiungi_riga(sink, campi, (relazione_id, nome, metodo, controllati, orfani, errore))
+            feedback.setProgress((posizione + 1) * 100 / numero)
+
+        return {'OUTPUT': dest_id, 'ORPHANS': orfani_totali, 'FAILED': non_verificate}
+
+
+class ProviderRelazioni(QgsProcessingProvider):
+    """Processing provider of the Relation Manager plugin."""
+
+    def id(self):
+        """Id of the provider, prefix of the algorithm ids."""
+        return 'relationmanager'
+
+    def name(self):
+        """Name of the provider."""
+        return "Relation Manager"
+
+    def icon(self):
+        """Icon of the plugin."""
+        return QIcon(os.path.join(os.path.dirname(__file__), 'icon.png'))
+
+    def loadAlgorithms(self):
+        """Register the algorithms."""
+        for algoritmo in (ImportaRelazioniAlgoritmo(), EsportaRelazioniAlgoritmo(), ValidaRelazioniAlgoritmo(),
+                          VerificaIntegritaAlgoritmo()):
+            self.addAlgorithm(algoritmo)
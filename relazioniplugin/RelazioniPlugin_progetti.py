@@ -0,0 +1,234 @@
+"""Apply one relationship catalog to many project files in parallel.
+
+Every project is opened in a worker process of a pool, each worker
+running its own headless :class:`QgsApplication` and one
+:class:`QgsProject` at a time; only the relationships that differ from
+the catalog are applied, and the project is written back only if
+something changed. A state file remembers the modification time, size
+and hash of every project and the hash of the catalog after a successful
+run, so projects not modified since are skipped without being opened,
+and hashed only if their time or size changed.
+
+Meant to run from a Python interpreter with the QGIS bindings, not from
+the QGIS GUI, whose executable cannot host the worker processes::
+
+    python -m relazioniplugin.RelazioniPlugin_progetti relations.json projects/*.qgz --jobs 8 --dry-run
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from qgis.core import QgsApplication, QgsProject
+
+from .RelazioniPlugin_core import CatalogoRelazioni, e_jsonl
+from .RelazioniPlugin_qgs import hash_file
+from .RelazioniPlugin_task import leggi_relazioni
+
+AGGIORNATO = "updated"
+INVARIATO = "unchanged"
+DA_AGGIORNARE = "would update"
+SALTATO = "skipped"
+ERRORE = "error"
+
+# Applicazione QGIS del processo worker, creata una sola volta
+_applicazione = None
+
+
+def leggi_catalogo(percorso):
+    """Read all the relationships of an export file as a list of ``(relazione_id, relazione)`` pairs."""
+    with open(percorso, 'rb') as file:
+        relazioni, _ = leggi_relazioni(file, e_jsonl(percorso))
+        return list(relazioni)
+
+
+def leggi_stato(percorso):
+    """Read the state file (project path -> hashes of the last run), empty if missing or invalid."""
+    try:
+        with open(percorso, encoding='utf-8') as file:
+            stato = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    return stato if isinstance(stato, dict) else {}
+
+
+def scrivi_stato(percorso, stato):
+    """Write the state file, replacing the previous one atomically."""
+    temporaneo = percorso + '.tmp'
+    with open(temporaneo, 'w', encoding='utf-8') as file:
+        json.dump(stato, file, indent=1, sort_keys=True)
+    os.replace(temporaneo, percorso)
+
+
+def risultato_progetto(percorso, stato=ERRORE, errore=None, hash_progetto=None):
+    """Build the result record of a project, with no relationship touched."""
+    return {'progetto': percorso, 'stato': stato, 'aggiunte': [], 'modificate': [], 'rimosse': [],
+            'fallite': [], 'errore': errore, 'hash': hash_progetto, 'mtime': None, 'dimensione': None}
+
+
+def invariato(percorso, precedente):
+    """Tell whether a project file is the one recorded in its state entry.
+
+    The file is hashed only if its modification time or size differ from
+    the recorded ones; the entry then takes the new time and size.
+    """
+    try:
+        stat = os.stat(percorso)
+    except OSError:
+        return False
+    if precedente.get('mtime') == stat.st_mtime and precedente.get('dimensione') == stat.st_size:
+        return True
+    if precedente.get('progetto') != hash_file(percorso):
+        return False
+    precedente['mtime'], precedente['dimensione'] = stat.st_mtime, stat.st_size
+    return True
+
+
+def _inizializza_worker():
+    """Start the headless QGIS application of a worker process."""
+    global _applicazione
+    _applicazione = QgsApplication([], False)
+    _applicazione.initQgis()
+
+
+def applica_a_progetto(percorso, relazioni, sostituisci=False, prova=False):
+    """Bring the relationships of a project file in line with a catalog.
+
+    :param relazioni: list of ``(relazione_id, relazione)`` pairs in the export format.
+    :param sostituisci: if True the relationships missing from the catalog are removed.
+    :param prova: dry run, the project is never written.
+    :returns: dict with the ``progetto`` path, its ``stato``, the ids of the
+        relationships ``aggiunte``, ``modificate`` and ``rimosse``, the
+        ``(name, reason)`` pairs of the ``fallite`` ones, the ``errore`` if
+        the project could not be processed and the ``hash``, ``mtime`` and
+        ``dimensione`` of the file.
+    """
+    risultato = risultato_progetto(percorso)
+    project = QgsProject()
+    try:
+        if not project.read(percorso):
+            risultato['errore'] = f"Could not read the project: {project.error()}"
+            return risultato
+
+        catalogo = CatalogoRelazioni(project)
+        valide, risultato['fallite'] = catalogo.valida(relazioni)
+        aggiunte, modificate, rimosse = catalogo.differenze(valide, sostituisci)
+        risultato['aggiunte'] = sorted(aggiunte)
+        risultato['modificate'] = sorted(modificate)
+        risultato['rimosse'] = sorted(rimosse)
+
+        if not aggiunte and not modificate and not rimosse:
+            risultato['stato'] = INVARIATO
+        elif prova:
+            risultato['stato'] = DA_AGGIORNARE
+        else:
+            # Solo le relazioni diverse dal catalogo vengono toccate
+            da_applicare = [definizione for definizione in valide
+                            if definizione['id'] in aggiunte or definizione['id'] in modificate]
+            catalogo.applica(da_applicare, list(rimosse))
+            if not project.write():
+                risultato['errore'] = f"Could not save the project: {project.error()}"
+                return risultato
+            risultato['stato'] = AGGIORNATO
+        stat = os.stat(percorso)
+        risultato['hash'] = hash_file(percorso)
+        risultato['mtime'], risultato['dimensione'] = stat.st_mtime, stat.st_size
+        return risultato
+    finally:
+        project.clear()
+
+
+def applica_a_progetti(progetti, file_catalogo, processi=None, sostituisci=False, prova=False,
+                       file_stato=None, progresso=None):
+    """Apply a relationship catalog to many project files with a pool of worker processes.
+
+    :param progetti: paths of the project files (.qgs or .qgz).
+    :param file_catalogo: JSON or JSON Lines export file of the relationships.
+    :param processi: number of worker processes, the number of CPUs by default.
+    :param sostituisci: if True the relationships missing from the catalog are removed.
+    :param prova: dry run, no project is written and the state file is not updated.
+    :param file_stato: optional state file; projects unchanged since the
+        last run with the same catalog and options are skipped.
+    :param progresso: optional callable receiving each result as it completes.
+    :returns: the results of :func:`applica_a_progetto`, in the order of ``progetti``.
+    :raises OSError: if the catalog cannot be read.
+    :raises ValueError: if the catalog format is invalid.
+    """
+    relazioni = leggi_catalogo(file_catalogo)
+    # Le opzioni fanno parte dell'impronta: lo stesso catalogo con REPLACE dà un altro risultato
+    impronta = f"{hash_file(file_catalogo)}:{int(sostituisci)}"
+    stato = leggi_stato(file_stato) if file_stato else {}
+
+    risultati = {}
+    da_elaborare = []
+    # Un progetto elencato due volte viene elaborato una volta sola
+    for percorso in dict.fromkeys(os.path.abspath(percorso) for percorso in progetti):
+        precedente = stato.get(percorso)
+        if precedente and precedente.get('catalogo') == impronta and invariato(percorso, precedente):
+            risultati[percorso] = risultato_progetto(percorso, SALTATO, hash_progetto=precedente['progetto'])
+            if progresso:
+                progresso(risultati[percorso])
+        else:
+            da_elaborare.append(percorso)
+
+    if da_elaborare:
+        # spawn: un processo QGIS non può essere duplicato con fork in sicurezza
+        contesto = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(processi, mp_context=contesto, initializer=_inizializza_worker) as pool:
+            futuri = {pool.submit(applica_a_progetto, percorso, relazioni, sostituisci, prova): percorso
+                      for percorso in da_elaborare}
+            for futuro in as_completed(futuri):
+                percorso = futuri[futuro]
+                try:
+                    risultato = futuro.result()
+                except Exception as errore:
+                    # Un worker terminato non deve fermare gli altri progetti
+                    risultato = risultato_progetto(percorso, errore=str(errore))
+                risultati[percorso] = risultato
+                if not prova and risultato['hash']:
+                    stato[percorso] = {'progetto': risultato['hash'], 'mtime': risultato['mtime'],
+                                       'dimensione': risultato['dimensione'], 'catalogo': impronta}
+                if progresso:
+                    progresso(risultato)
+
+    if file_stato and not prova:
+        scrivi_stato(file_stato, stato)
+    return [risultati[os.path.abspath(percorso)] for percorso in progetti]
+
+
+def main(argomenti=None):
+    """Command line entry point; returns the exit status."""
+    parser = argparse.ArgumentParser(description="Apply a relationship catalog to many QGIS project files.")
+    parser.add_argument('catalogo', help="JSON or JSON Lines relationship export file")
+    parser.add_argument('progetti', nargs='+', help=".qgs or .qgz project files")
+    parser.add_argument('--jobs', type=int, default=None, help="number of worker processes (default: CPUs)")
+    parser.add_argument('--replace', action='store_true', help="remove the relationships missing from the catalog")
+    parser.add_argument('--dry-run', action='store_true', help="report the changes without writing the projects")
+    parser.add_argument('--state', help="state file used to skip the projects unchanged since the last run")
+    parser.add_argument('--json', action='store_true', help="print the results as JSON Lines")
+    opzioni = parser.parse_args(argomenti)
+
+    def stampa(risultato):
+        if opzioni.json:
+            print(json.dumps(risultato), flush=True)
+            return
+        riga = (f"{risultato['stato']:>12}  {risultato['progetto']}  +{len(risultato['aggiunte'])} "
+                f"~{len(risultato['modificate'])} -{len(risultato['rimosse'])} !{len(risultato['fallite'])}")
+        if risultato['errore']:
+            riga += f"  {risultato['errore']}"
+        print(riga, flush=True)
+
+    try:
+        risultati = applica_a_progetti(opzioni.progetti, opzioni.catalogo, opzioni.jobs, opzioni.replace,
+                                       opzioni.dry_run, opzioni.state, stampa)
+    except (OSError, ValueError) as errore:
+        print(f"Invalid relationship file: {errore}", file=sys.stderr)
+        return 2
+    return 1 if any(risultato['stato'] == ERRORE for risultato in risultati) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,328 @@
+"""Read and rewrite the relationships of .qgs/.qgz files without loading the project.
+
+Loading a :class:`QgsProject` resolves every layer, which can take a long
+time for large projects. Here the project XML is streamed through an
+incremental expat parser that keeps only the ids, names, data sources and
+field names of ``<projectlayers>`` and the ``<relations>`` block, and stops as soon as
+both have been read. The ``.qgs`` of a ``.qgz`` archive is streamed
+straight from the zip.
+
+Rewriting replaces only the bytes of the ``<relations>`` block (or inserts
+one before the end of the document) and leaves the rest of the file as it
+was; the other members of a ``.qgz`` archive are copied unchanged.
+
+Relationships are described by the same records as the history (see
+:func:`RelazioniPlugin_storico.record_relazione`).
+"""
+
+import hashlib
+import os
+import tempfile
+import zipfile
+from contextlib import contextmanager
+from xml.parsers import expat
+from xml.sax.saxutils import escape
+
+DIMENSIONE_BLOCCO = 1 << 16
+
+# Profondità degli elementi sotto la radice <qgis> (che ha profondità 1)
+PROFONDITA_SEZIONE = 2
+PROFONDITA_VOCE = 3
+
+# Elementi di testo di <maplayer> conservati, con la chiave corrispondente
+ELEMENTI_LAYER = {'id': 'id', 'layername': 'nome', 'datasource': 'sorgente', 'provider': 'provider'}
+
+
+class FineLettura(Exception):
+    """Raised by the parser handlers once everything needed has been read."""
+
+
+def e_qgz(percorso):
+    """Tell from its extension whether a project file is a zipped .qgz."""
+    return percorso.lower().endswith('.qgz')
+
+
+def hash_file(percorso, blocco=1 << 20):
+    """Return the SHA-256 hex digest of a file, read in blocks."""
+    digest = hashlib.sha256()
+    with open(percorso, 'rb') as file:
+        for dati in iter(lambda: file.read(blocco), b''):
+            digest.update(dati)
+    return digest.hexdigest()
+
+
+def nome_qgs(archivio):
+    """Return the name of the .qgs member of an open .qgz archive."""
+    for nome in archivio.namelist():
+        if nome.lower().endswith('.qgs'):
+            return nome
+    raise ValueError("The archive contains no .qgs project")
+
+
+@contextmanager
+def apri_qgs(percorso):
+    """Open the project XML of a .qgs file, or of the .qgs inside a .qgz archive, as a binary stream."""
+    if e_qgz(percorso):
+        with zipfile.ZipFile(percorso) as archivio, archivio.open(nome_qgs(archivio)) as file:
+            yield file
+    else:
+        with open(percorso, 'rb') as file:
+            yield file
+
+
+class LettoreQgs:
+    """Expat handlers collecting the project layers and relationships.
+
+    After :meth:`leggi`, ``layer`` maps the layer ids to dicts with the
+    layer ``nome``, ``tipo``, ``provider``, data source (``sorgente``) and
+    ``campi`` (field names, vector layers only)
+    and ``relazioni`` maps the relationship ids to their records, whose
+    ``<relation>`` attributes are kept as read in ``attributi_relazioni``. While
+    parsing a whole document, ``posizioni`` collects the byte offsets of the
+    ``<relations>`` block (``inizio``, ``fine``) and of the root end tag
+    (``fine_radice``).
+    """
+
+    def __init__(self, completo=False):
+        """Constructor.
+
+        :param completo: parse the whole document instead of stopping once
+            the layers and the relationships have been read.
+        """
+        self.completo = completo
+        self.layer = {}
+        self.relazioni = {}
+        self.attributi_relazioni = {}
+        self.posizioni = {}
+
+        self._parser = expat.ParserCreate()
+        self._parser.buffer_text = True
+        self._parser.StartElementHandler = self._inizio
+        self._parser.EndElementHandler = self._fine
+        self._parser.CharacterDataHandler = self._testo
+
+        self._percorso = []
+        self._layer_corrente = None
+        self._relazione_corrente = None
+        self._testo_corrente = None
+        self._sezioni_lette = set()
+
+    def leggi(self, file):
+        """Parse a binary stream block by block."""
+        try:
+            while True:
+                dati = file.read(DIMENSIONE_BLOCCO)
+                self._parser.Parse(dati, not dati)
+                if not dati:
+                    break
+        except FineLettura:
+            pass
+        except expat.ExpatError as errore:
+            raise ValueError(f"Invalid project XML: {errore}") from errore
+        # I nomi dei layer sono noti solo ora: completano i record delle relazioni
+        for record in self.relazioni.values():
+            record['layer_padre'] = self.layer.get(record['layer_padre_id'], {}).get('nome', '')
+            record['layer_figlio'] = self.layer.get(record['layer_figlio_id'], {}).get('nome', '')
+        return self
+
+    def _inizio(self, tag, attributi):
+        """Start of an element."""
+        self._percorso.append(tag)
+        profondita = len(self._percorso)
+        if profondita == PROFONDITA_SEZIONE and tag == 'relations':
+            self.posizioni['inizio'] = self._parser.CurrentByteIndex
+        elif profondita == PROFONDITA_VOCE:
+            sezione = self._percorso[1]
+            if sezione == 'projectlayers' and tag == 'maplayer':
+                self._layer_corrente = {'id': None, 'nome': '', 'tipo': attributi.get('type', ''), 'provider': '',
+                                        'sorgente': '', 'campi': []}
+            elif sezione == 'relations' and tag == 'relation':
+                self.attributi_relazioni[attributi.get('id', '')] = dict(attributi)
+                self._relazione_corrente = {
+                    'id': attributi.get('id', ''),
+                    'nome': attributi.get('name', ''),
+                    'layer_padre_id': attributi.get('referencedLayer', ''),
+                    'layer_figlio_id': attributi.get('referencingLayer', ''),
+                    'chiavi': {},
+                    'forza': 'Composition' if attributi.get('strength') == 'Composition' else 'Association'
+                }
+        elif self._layer_corrente is not None:
+            if profondita == PROFONDITA_VOCE + 1 and tag in ELEMENTI_LAYER:
+                self._testo_corrente = []
+            elif profondita == PROFONDITA_VOCE + 2 and tag == 'field' and self._percorso[-2] == 'fieldConfiguration':
+                self._layer_corrente['campi'].append(attributi.get('name', ''))
+        elif self._relazione_corrente is not None and profondita == PROFONDITA_VOCE + 1 and tag == 'fieldRef':
+            self._relazione_corrente['chiavi'][attributi.get('referencingField', '')] = \
+                attributi.get('referencedField', '')
+
+    def _testo(self, dati):
+        """Text of an element."""
+        if self._testo_corrente is not None:
+            self._testo_corrente.append(dati)
+
+    def _fine(self, tag):
+        """End of an element."""
+        profondita = len(self._percorso)
+        self._percorso.pop()
+        if self._testo_corrente is not None:
+            testo = ''.join(self._testo_corrente).strip()
+            self._layer_corrente[ELEMENTI_LAYER[tag]] = testo
+            self._testo_corrente = None
+        elif profondita == PROFONDITA_VOCE and tag == 'maplayer' and self._layer_corrente is not None:
+            layer = self._layer_corrente
+            self._layer_corrente = None
+            if layer['id']:
+                self.layer[layer.pop('id')] = layer
+        elif profondita == PROFONDITA_VOCE and tag == 'relation' and self._relazione_corrente is not None:
+            record = self._relazione_corrente
+            self._relazione_corrente = None
+            self.relazioni[record['id']] = record
+        elif profondita == PROFONDITA_SEZIONE and tag in ('projectlayers', 'relations'):
+            if tag == 'relations':
+                self.posizioni['fine'] = self._parser.CurrentByteIndex
+            self._sezioni_lette.add(tag)
+            if not self.completo and len(self._sezioni_lette) == 2:
+                raise FineLettura()
+        elif profondita == 1:
+            self.posizioni['fine_radice'] = self._parser.CurrentByteIndex
+
+
+def leggi_progetto(percorso):
+    """Read the layers and relationships of a .qgs/.qgz file without loading the project.
+
+    :returns: ``(layer, relazioni)``: dict layer id -> dict with ``nome``,
+        ``tipo``, ``provider``, ``sorgente`` and ``campi``, and dict
+        relationship id -> record.
+    :raises OSError: if the file cannot be read.
+    :raises ValueError: if the file is not a valid project.
+    """
+    try:
+        with apri_qgs(percorso) as file:
+            lettore = LettoreQgs().leggi(file)
+    except zipfile.BadZipFile as errore:
+        raise ValueError(f"Invalid .qgz archive: {errore}") from errore
+    return lettore.layer, lettore.relazioni
+
+
+def quota_attributo(valore):
+    """Quote an XML attribute value with double quotes."""
+    return '"' + escape(str(valore), {'"': '&quot;', '\n': '&#xa;', '\t': '&#x9;'}) + '"'
+
+
+def xml_relazioni(relazioni, rientro='  ', livello=1, attributi_originali=None):
+    """Serialize relationship records as a ``<relations>`` element, indented as QGIS does.
+
+    :param relazioni: iterable of records with ``id``, ``nome``,
+        ``layer_padre_id``, ``layer_figlio_id``, ``chiavi`` and optionally ``forza``.
+    :param livello: indentation level of the element itself; its first line is not indented.
+    :param attributi_originali: optional dict relationship id -> attributes
+        of the ``<relation>`` element being replaced. The attributes not
+        derived from the record (such as the provider keys, data sources
+        and names QGIS uses to re-resolve the layers) are written back, in
+        their original order, as long as the relationship keeps its layers.
+    """
+    relazioni = list(relazioni)
+    if not relazioni:
+        return '<relations/>'
+    attributi_originali = attributi_originali or {}
+
+    righe = ['<relations>']
+    for record in relazioni:
+        valori = {
+            'strength': record.get('forza') or 'Association',
+            'referencingLayer': record['layer_figlio_id'],
+            'name': record['nome'],
+            'id': record['id'],
+            'referencedLayer': record['layer_padre_id']
+        }
+        originali = attributi_originali.get(record['id'])
+        if originali and originali.get('referencingLayer') == valori['referencingLayer'] \
+                and originali.get('referencedLayer') == valori['referencedLayer']:
+            # Stessi layer: gli attributi che li descrivono restano validi
+            valori = dict(originali, **valori)
+        attributi = ' '.join(f'{nome}={quota_attributo(valore)}' for nome, valore in valori.items())
+        righe.append(f'{rientro * (livello + 1)}<relation {attributi}>')
+        for figlio, padre in record['chiavi'].items():
+            righe.append(f'{rientro * (livello + 2)}<fieldRef referencingField={quota_attributo(figlio)} '
+                         f'referencedField={quota_attributo(padre)}/>')
+        righe.append(f'{rientro * (livello + 1)}</relation>')
+    righe.append(f'{rientro * livello}</relations>')
+    return '\n'.join(righe)
+
+
+def sostituisci_relazioni(documento, relazioni):
+    """Return a project XML document with its ``<relations>`` block replaced.
+
+    Only the bytes of the block change; a document without the block gets
+    one before the root end tag. The extra attributes of the relationships
+    already in the block are kept (see :func:`xml_relazioni`).
+
+    :param documento: the project XML, as bytes.
+    """
+    lettore = LettoreQgs(completo=True)
+    lettore.leggi(_Blocchi(documento))
+    blocco = xml_relazioni(relazioni, attributi_originali=lettore.attributi_relazioni).encode('utf-8')
+
+    if 'inizio' in lettore.posizioni:
+        inizio = lettore.posizioni['inizio']
+        fine = lettore.posizioni['fine']
+        # L'evento di fine punta al tag di chiusura; per <relations/> coincide con l'inizio
+        fine = documento.index(b'>', fine) + 1
+        return documento[:inizio] + blocco + documento[fine:]
+
+    fine_radice = lettore.posizioni.get('fine_radice')
+    if fine_radice is None:
+        raise ValueError("Invalid project XML: no root element")
+    return documento[:fine_radice] + b'  ' + blocco + b'\n' + documento[fine_radice:]
+
+
+class _Blocchi:
+    """Minimal binary stream over a bytes object, read block by block."""
+
+    def __init__(self, dati):
+        """Constructor."""
+        self._dati = memoryview(dati)
+        self._posizione = 0
+
+    def read(self, dimensione):
+        """Return the next block."""
+        blocco = bytes(self._dati[self._posizione:self._posizione + dimensione])
+        self._posizione += len(blocco)
+        return blocco
+
+
+def scrivi_relazioni_progetto(percorso, relazioni):
+    """Rewrite the relationships of a .qgs/.qgz file without loading the project.
+
+    The file is replaced atomically; the other members of a .qgz archive
+    are copied unchanged.
+
+    :param relazioni: iterable of relationship records (see :func:`xml_relazioni`).
+    :raises OSError: if the file cannot be read or written.
+    :raises ValueError: if the file is not a valid project.
+    """
+    cartella = os.path.dirname(os.path.abspath(percorso))
+    descrittore, temporaneo = tempfile.mkstemp(suffix='.tmp', dir=cartella)
+    try:
+        with os.fdopen(descrittore, 'wb') as uscita:
+            if e_qgz(percorso):
+                try:
+                    with zipfile.ZipFile(percorso) as origine, zipfile.ZipFile(uscita, 'w') as destinazione:
+                        nome = nome_qgs(origine)
+                        for info in origine.infolist():
+                            dati = origine.read(info)
+                            if info.filename == nome:
+                                dati = sostituisci_relazioni(dati, relazioni)
+                            destinazione.writestr(info, dati)
+                except zipfile.BadZipFile as errore:
+                    raise ValueError(f"Invalid .qgz archive: {errore}") from errore
+            else:
+                with open(percorso, 'rb') as file:
+                    uscita.write(sostituisci_relazioni(file.read(), relazioni))
+        # Il file temporaneo nasce con permessi ristretti: mantieni quelli del progetto
+        os.chmod(temporaneo, os.stat(percorso).st_mode & 0o777)
+        os.replace(temporaneo, percorso)
+    except BaseException:
+        if os.path.exists(temporaneo):
+            os.remove(temporaneo)
+        raise
@@ -0,0 +1,129 @@
+"""SQL statements pushed down to the database holding the related layers.
+
+The statements use only standard SQL with double-quoted identifiers, so
+they run unchanged on PostgreSQL/PostGIS and on SQLite/GeoPackage. Only
+the catalog queries listing the existing indexes depend on the database.
+"""
+
+import sqlite3
+from pathlib import Path
+
+
+def quota_identificatore(nome):
+    """Quote an SQL identifier."""
+    return '"' + nome.replace('"', '""') + '"'
+
+
+def quota_stringa(valore):
+    """Quote an SQL string literal."""
+    return "'" + valore.replace("'", "''") + "'"
+
+
+def tabella_qualificata(tabella, schema=None):
+    """Return the quoted, optionally schema-qualified, name of a table."""
+    if schema:
+        return f'{quota_identificatore(schema)}.{quota_identificatore(tabella)}'
+    return quota_identificatore(tabella)
+
+
+def sql_colonne_indicizzate_postgres(tabella, schema=None):
+    """Build the PostgreSQL catalog query listing the columns leading an index of a table."""
+    return (
+        'SELECT a.attname FROM pg_index AS i '
+        'JOIN pg_attribute AS a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0] '
+        f'WHERE i.indrelid = {quota_stringa(tabella_qualificata(tabella, schema))}::regclass'
+    )
+
+
+def sql_colonne_indicizzate_sqlite(tabella):
+    """Build the SQLite catalog query listing the columns leading an index of a table."""
+    return (
+        f'SELECT ii.name FROM pragma_index_list({quota_stringa(tabella)}) AS il, '
+        f'pragma_index_info(il.name) AS ii WHERE ii.seqno = 0'
+    )
+
+
+def sql_crea_indice(tabella, campi, schema=None):
+    """Build the statement creating, unless it exists, an index on the given columns of a table.
+
+    The index is named after the table and the columns, truncated to the
+    63 characters PostgreSQL allows.
+    """
+    if not campi:
+        raise ValueError("At least one field is required")
+
+    nome = '_'.join(('idx', tabella) + tuple(campi))[:63]
+    colonne = ', '.join(quota_identificatore(campo) for campo in campi)
+    return (
+        f'CREATE INDEX IF NOT EXISTS {quota_identificatore(nome)} '
+        f'ON {tabella_qualificata(tabella, schema)} ({colonne})'
+    )
+
+
+def sql_conta_orfani(tabella_figlio, tabella_padre, coppie):
+    """Build the anti-join counting the child rows that reference no parent row.
+
+    Child rows with a NULL key do not reference any parent and are not
+    counted.
+
+    :param tabella_figlio: quoted name of the child table.
+    :param tabella_padre: quoted name of the parent table.
+    :param coppie: list of ``(child field, parent field)`` key pairs.
+    """
+    if not coppie:
+        raise ValueError("At least one key pair is required")
+
+    join = ' AND '.join(
+        f'f.{quota_identificatore(figlio)} = p.{quota_identificatore(padre)}' for figlio, padre in coppie)
+    non_nulli = ' AND '.join(f'f.{quota_identificatore(figlio)} IS NOT NULL' for figlio, _ in coppie)
+    return (
+        f'SELECT COUNT(*) FROM {tabella_figlio} AS f '
+        f'LEFT JOIN {tabella_padre} AS p ON {join} '
+        f'WHERE p.{quota_identificatore(coppie[0][1])} IS NULL AND {non_nulli}'
+    )
+
+
+def sql_istogramma_figli(tabella_figlio, tabella_padre, coppie):
+    """Build the query returning the child-count histogram of a relationship.
+
+    Each returned row holds a number of children and the number of parents
+    having exactly that many; parents without children are included, rows
+    with a NULL key and duplicated parent keys are not.
+
+    :param tabella_figlio: quoted name of the child table.
+    :param tabella_padre: quoted name of the parent table.
+    :param coppie: list of ``(child field, parent field)`` key pairs.
+    """
+    if not coppie:
+        raise ValueError("At least one key pair is required")
+
+    campi_padre = ', '.join(quota_identificatore(padre) for _, padre in coppie)
+    chiavi_padre = ', '.join(f'p.{quota_identificatore(padre)}' for _, padre in coppie)
+    non_nulli = ' AND '.join(f'{quota_identificatore(padre)} IS NOT NULL' for _, padre in coppie)
+    join = ' AND '.join(
+        f'f.{quota_identificatore(figlio)} = p.{quota_identificatore(padre)}' for figlio, padre in coppie)
+    return (
+        f'SELECT c.n, COUNT(*) FROM ('
+        f'SELECT COUNT(f.{quota_identificatore(coppie[0][0])}) AS n '
+        f'FROM (SELECT DISTINCT {campi_padre} FROM {tabella_padre} WHERE {non_nulli}) AS p '
+        f'LEFT JOIN {tabella_figlio} AS f ON {join} '
+        f'GROUP BY {chiavi_padre}) AS c '
+        f'GROUP BY c.n'
+    )
+
+
+def esegui_query_sqlite(percorso, sql, sola_lettura=True):
+    """Run a statement on a SQLite/GeoPackage file and return all its rows.
+
+    The file is opened read-only unless ``sola_lettura`` is False, in which
+    case the statement is committed.
+    """
+    modo = '?mode=ro' if sola_lettura else '?mode=rw'
+    connessione = sqlite3.connect(Path(percorso).resolve().as_uri() + modo, uri=True)
+    try:
+        righe = connessione.execute(sql).fetchall()
+        if not sola_lettura:
+            connessione.commit()
+        return righe
+    finally:
+        connessione.close()
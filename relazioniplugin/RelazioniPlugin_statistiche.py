@@ -0,0 +1,64 @@
+"""Cardinality statistics of 1:N relationships.
+
+The statistics are derived from a child-count histogram, mapping a number
+of children to the number of parents having exactly that many children.
+The histogram is computed either in one streaming pass over the key
+columns (:func:`istogramma_figli`) or by the database with a ``GROUP BY``.
+"""
+
+import math
+from collections import Counter
+
+
+def istogramma_figli(chiavi_padre, chiavi_figlio):
+    """Build the child-count histogram from streams of key values.
+
+    Children whose key matches no parent (orphans) are ignored and
+    duplicated parent keys are counted once.
+
+    :param chiavi_padre: iterable of the parent keys.
+    :param chiavi_figlio: iterable of the child keys.
+    :returns: :class:`Counter` number of children -> number of parents.
+    """
+    conteggi = dict.fromkeys(chiavi_padre, 0)
+    for chiave in chiavi_figlio:
+        if chiave in conteggi:
+            conteggi[chiave] += 1
+    return Counter(conteggi.values())
+
+
+def statistiche_cardinalita(istogramma, percentile=99):
+    """Summarize a child-count histogram.
+
+    :param istogramma: mapping number of children -> number of parents.
+    :param percentile: percentile of the children per parent to report (nearest rank).
+    :returns: dict with the number of ``padri`` and ``figli``, the ``minimo``,
+        ``massimo`` and ``media`` children per parent, the ``percentile``
+        value, and the number of parents ``senza_figli``. The per-parent
+        values are None if there are no parents.
+    """
+    padri = sum(istogramma.values())
+    figli = sum(numero * conteggio for numero, conteggio in istogramma.items())
+    statistiche = {
+        'padri': padri,
+        'figli': figli,
+        'senza_figli': istogramma.get(0, 0),
+        'minimo': None,
+        'massimo': None,
+        'media': None,
+        'percentile': None
+    }
+    if not padri:
+        return statistiche
+
+    valori = sorted(numero for numero, conteggio in istogramma.items() if conteggio)
+    rango = max(1, math.ceil(percentile / 100 * padri))
+    cumulato = 0
+    for numero in valori:
+        cumulato += istogramma[numero]
+        if cumulato >= rango:
+            statistiche['percentile'] = numero
+            break
+
+    statistiche.update(minimo=valori[0], massimo=valori[-1], media=figli / padri)
+    return statistiche
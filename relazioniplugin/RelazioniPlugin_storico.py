@@ -0,0 +1,260 @@
+"""Persistent, versioned history of the project relationships.
+
+Every modification records a new version of the whole relationship set,
+stored as the difference from the previous version: only the records of
+the relationships added or changed, and the ids of the removed ones. A
+version is rebuilt by applying the differences to the nearest full
+snapshot stored every few versions, or to the base snapshot, and
+consecutive snapshots share the records of the unchanged relationships.
+
+The versions live in an append-only SQLite journal next to the project,
+so they survive QGIS restarts. Beyond a configurable number of versions
+the oldest ones are folded into the base snapshot.
+"""
+
+import json
+import os
+import sqlite3
+from datetime import datetime
+
+CREA = "create"
+ELIMINA = "delete"
+MODIFICA = "edit"
+DUPLICA = "duplicate"
+IMPORTA = "import"
+RIPRISTINA = "restore"
+ANNULLA = "undo"
+RIPETI = "redo"
+ESTERNA = "external"
+
+LIMITE_PREDEFINITO = 1000
+
+# Ogni quante versioni viene salvata l'istantanea completa da cui ricostruire le successive
+INTERVALLO_ISTANTANEE = 50
+
+# Il database in memoria non sopravvive alla chiusura: usato per i progetti mai salvati
+IN_MEMORIA = ':memory:'
+
+# Campi di una relazione conservati nelle istantanee; i nomi dei layer servono solo a mostrarle
+CAMPI_RECORD = ('id', 'nome', 'layer_padre_id', 'layer_figlio_id', 'layer_padre', 'layer_figlio', 'chiavi', 'forza')
+CAMPI_DEFINIZIONE = ('id', 'nome', 'layer_padre_id', 'layer_figlio_id', 'chiavi', 'forza')
+
+
+def percorso_storico(file_progetto):
+    """Return the history file of a project, or the in-memory database if the project was never saved."""
+    if not file_progetto:
+        return IN_MEMORIA
+    return os.path.splitext(file_progetto)[0] + '_relations_history.sqlite'
+
+
+def record_relazione(dettagli):
+    """Build the snapshot record of a relationship from its detail record."""
+    return {campo: dettagli.get(campo) for campo in CAMPI_RECORD}
+
+
+def stessa_definizione(record_a, record_b):
+    """Tell whether two records define the same relationship, ignoring the layer display names."""
+    return all(record_a.get(campo) == record_b.get(campo) for campo in CAMPI_DEFINIZIONE)
+
+
+def differenze(prima, dopo):
+    """Compare two snapshots (relationship id -> record).
+
+    :returns: ``(aggiunte, modificate, rimosse)``: dicts id -> record of the
+        added and removed relationships, and id -> ``(before, after)`` of the
+        changed ones.
+    """
+    aggiunte = {}
+    modificate = {}
+    for relazione_id, record in dopo.items():
+        precedente = prima.get(relazione_id)
+        if precedente is None:
+            aggiunte[relazione_id] = record
+        elif not stessa_definizione(precedente, record):
+            modificate[relazione_id] = (precedente, record)
+    rimosse = {relazione_id: record for relazione_id, record in prima.items() if relazione_id not in dopo}
+    return aggiunte, modificate, rimosse
+
+
+def applica_delta(istantanea, delta):
+    """Return the snapshot following ``istantanea`` once a stored difference is applied.
+
+    The records are shared with the previous snapshot, not copied.
+    """
+    nuova = dict(istantanea)
+    nuova.update(delta['dopo'])
+    for relazione_id in delta['rimosse']:
+        nuova.pop(relazione_id, None)
+    return nuova
+
+
+class StoricoRelazioni:
+    """Bounded, disk-backed journal of relationship set versions.
+
+    Versions are described by ``(seq, timestamp, azione, descrizione,
+    modifiche)`` tuples, ``seq`` growing with every new version and
+    ``modifiche`` being the number of relationships it touched.
+    """
+
+    def __init__(self, percorso=IN_MEMORIA, limite=LIMITE_PREDEFINITO):
+        """Constructor.
+
+        :param percorso: SQLite file of the journal, created if missing.
+        :param limite: maximum number of versions kept.
+        """
+        self.percorso = percorso
+        self.limite = limite
+        self._connessione = sqlite3.connect(percorso)
+        self._connessione.executescript('''
+            CREATE TABLE IF NOT EXISTS base (id INTEGER PRIMARY KEY CHECK (id = 1), istantanea TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS versioni (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp TEXT NOT NULL,
+                azione TEXT NOT NULL,
+                descrizione TEXT NOT NULL,
+                delta TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS istantanee (seq INTEGER PRIMARY KEY, istantanea TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS modifiche (relazione_id TEXT NOT NULL, seq INTEGER NOT NULL);
+            DROP INDEX IF EXISTS modifiche_relazione;
+            CREATE INDEX IF NOT EXISTS modifiche_versione ON modifiche (seq);
+        ''')
+        self._connessione.commit()
+
+        # L'ultima istantanea resta in memoria: ogni nuova versione è confrontata con essa
+        self._ultima = self._ricostruisci(None)
+
+    @property
+    def in_memoria(self):
+        """Tell whether the journal is lost when closed."""
+        return self.percorso == IN_MEMORIA
+
+    def __len__(self):
+        """Number of versions in the journal."""
+        return self._connessione.execute('SELECT COUNT(*) FROM versioni').fetchone()[0]
+
+    def ultima_istantanea(self):
+        """Return the latest recorded snapshot (relationship id -> record), which must not be modified."""
+        return self._ultima
+
+    def registra(self, azione, descrizione, stato, timestamp=None):
+        """Record the current relationship set as a new version, if it changed.
+
+        :param stato: dict relationship id -> record (see :func:`record_relazione`).
+        :returns: the sequence number of the new version, or None if nothing changed.
+        """
+        aggiunte, modificate, rimosse = differenze(self._ultima, stato)
+        if not aggiunte and not modificate and not rimosse:
+            return None
+
+        dopo = dict(aggiunte)
+        dopo.update((relazione_id, record) for relazione_id, (_, record) in modificate.items())
+        delta = {'dopo': dopo, 'rimosse': sorted(rimosse)}
+        timestamp = timestamp or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self._connessione:
+            cursore = self._connessione.execute(
+                'INSERT INTO versioni (timestamp, azione, descrizione, delta) VALUES (?, ?, ?, ?)',
+                (timestamp, azione, descrizione, json.dumps(delta)))
+            seq = cursore.lastrowid
+            self._connessione.executemany(
+                'INSERT INTO modifiche (relazione_id, seq) VALUES (?, ?)',
+                [(relazione_id, seq) for relazione_id in list(dopo) + delta['rimosse']])
+            ultima = applica_delta(self._ultima, delta)
+            if seq % INTERVALLO_ISTANTANEE == 0:
+                self._connessione.execute(
+                    'INSERT INTO istantanee (seq, istantanea) VALUES (?, ?)', (seq, json.dumps(ultima)))
+            self._elimina_eccedenti()
+        self._ultima = ultima
+        return seq
+
+    def allinea(self, stato):
+        """Record the changes made outside the plugin since the latest version, if any.
+
+        Called before a modification, so that the version of the modification
+        contains only its own changes; on an empty journal it records the
+        initial state.
+        """
+        descrizione = "Changes made outside the plugin" if len(self) else "Initial state"
+        return self.registra(ESTERNA, descrizione, stato)
+
+    def imposta_limite(self, limite):
+        """Change the maximum number of versions, folding the exceeding ones into the base."""
+        self.limite = limite
+        with self._connessione:
+            self._elimina_eccedenti()
+
+    def _elimina_eccedenti(self):
+        """Fold the oldest versions beyond the limit into the base snapshot (inside a transaction)."""
+        ultima = self._connessione.execute(
+            'SELECT MAX(seq) FROM versioni WHERE seq <= (SELECT MAX(seq) FROM versioni) - ?',
+            (self.limite,)).fetchone()[0]
+        if ultima is None:
+            return
+
+        base = self._ricostruisci(ultima)
+        self._connessione.execute('INSERT OR REPLACE INTO base (id, istantanea) VALUES (1, ?)', (json.dumps(base),))
+        self._connessione.execute('DELETE FROM versioni WHERE seq <= ?', (ultima,))
+        self._connessione.execute('DELETE FROM modifiche WHERE seq <= ?', (ultima,))
+        self._connessione.execute('DELETE FROM istantanee WHERE seq <= ?', (ultima,))
+
+    def _base(self):
+        """Return the snapshot preceding the oldest version kept."""
+        riga = self._connessione.execute('SELECT istantanea FROM base WHERE id = 1').fetchone()
+        return json.loads(riga[0]) if riga else {}
+
+    def _ricostruisci(self, seq):
+        """Rebuild the snapshot of a version, or of the latest one if ``seq`` is None.
+
+        Only the differences after the nearest stored snapshot are applied.
+        """
+        if seq is None:
+            seq = self._connessione.execute('SELECT MAX(seq) FROM versioni').fetchone()[0] or 0
+        riga = self._connessione.execute(
+            'SELECT seq, istantanea FROM istantanee WHERE seq <= ? ORDER BY seq DESC LIMIT 1', (seq,)).fetchone()
+        if riga:
+            partenza, istantanea = riga[0], json.loads(riga[1])
+        else:
+            partenza, istantanea = 0, self._base()
+        righe = self._connessione.execute(
+            'SELECT delta FROM versioni WHERE seq > ? AND seq <= ? ORDER BY seq', (partenza, seq))
+        for (delta,) in righe:
+            istantanea = applica_delta(istantanea, json.loads(delta))
+        return istantanea
+
+    def istantanea(self, seq):
+        """Return the relationship set as it was right after a version, or None if it is not in the journal."""
+        if not self._connessione.execute('SELECT 1 FROM versioni WHERE seq = ?', (seq,)).fetchone():
+            return None
+        return self._ricostruisci(seq)
+
+    def istantanea_precedente(self, seq):
+        """Return the relationship set as it was right before a version."""
+        return self._ricostruisci(seq - 1)
+
+    def versione(self, seq):
+        """Return the description of a version, or None."""
+        riga = self._connessione.execute(
+            'SELECT v.seq, v.timestamp, v.azione, v.descrizione, COUNT(m.seq) FROM versioni AS v '
+            'LEFT JOIN modifiche AS m ON m.seq = v.seq WHERE v.seq = ? GROUP BY v.seq', (seq,)).fetchone()
+        return tuple(riga) if riga else None
+
+    def versioni(self):
+        """Return the versions in chronological order."""
+        righe = self._connessione.execute(
+            'SELECT v.seq, v.timestamp, v.azione, v.descrizione, COUNT(m.seq) FROM versioni AS v '
+            'LEFT JOIN modifiche AS m ON m.seq = v.seq GROUP BY v.seq ORDER BY v.seq')
+        return [tuple(riga) for riga in righe]
+
+    def copia_in(self, altro):
+        """Append every version of this journal to another one, e.g. when an unsaved project gets a file."""
+        istantanea = self._base()
+        if istantanea:
+            altro.registra(ESTERNA, "Initial state", istantanea)
+        righe = self._connessione.execute('SELECT timestamp, azione, descrizione, delta FROM versioni ORDER BY seq')
+        for timestamp, azione, descrizione, delta in righe.fetchall():
+            istantanea = applica_delta(istantanea, json.loads(delta))
+            altro.registra(azione, descrizione, istantanea, timestamp)
+
+    def chiudi(self):
+        """Close the journal file."""
+        self._connessione.close()
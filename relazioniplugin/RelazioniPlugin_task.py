@@ -0,0 +1,277 @@
+"""Background tasks for importing, exporting and inventorying relationships.
+
+Parsing, validation and serialization run inside a :class:`QgsTask` on
+plain Python data. Everything that touches the project (building the
+layer lookup tables, creating :class:`QgsRelation` objects and adding them
+to the relation manager) stays on the main thread.
+"""
+
+import json
+import os
+import sqlite3
+
+from qgis.core import QgsRelation, QgsTask, QgsVectorLayer
+
+from .RelazioniPlugin_inventario import InventarioRelazioni
+from .RelazioniPlugin_jsonl import leggi_jsonl, scrivi_jsonl
+
+
+def indice_layer(project):
+    """Build the layer name -> layer id and layer id -> field names lookup tables.
+
+    Must be called on the main thread; the returned tables are plain
+    Python data and can be handed to a background task.
+    """
+    layer_per_nome = {}
+    campi_per_layer = {}
+    for layer in project.mapLayers().values():
+        if not isinstance(layer, QgsVectorLayer):
+            continue
+        # Come mapLayersByName()[0], a parità di nome vince il primo layer
+        layer_per_nome.setdefault(layer.name(), layer.id())
+        campi_per_layer[layer.id()] = frozenset(layer.fields().names())
+    return layer_per_nome, campi_per_layer
+
+
+def valida_chiavi(chiavi, campi_padre, campi_figlio):
+    """Check all the key pairs of a relationship in one pass.
+
+    :param chiavi: dict child field -> parent field, as returned by
+        :meth:`QgsRelation.fieldPairs`.
+    :param campi_padre: set of the field names of the parent layer.
+    :param campi_figlio: set of the field names of the child layer.
+    :returns: list of the invalid ``(child, parent)`` pairs, empty if every pair is valid.
+    """
+    figli_mancanti = chiavi.keys() - campi_figlio
+    padri_mancanti = set(chiavi.values()) - campi_padre
+    if not figli_mancanti and not padri_mancanti:
+        return []
+    return [(figlio, padre) for figlio, padre in chiavi.items()
+            if figlio in figli_mancanti or padre in padri_mancanti]
+
+
+def _record_valido(relazione):
+    """Tell whether a relationship read from a file has the types of the export format."""
+    if not isinstance(relazione, dict):
+        return False
+    chiavi = relazione.get('chiavi', {})
+    return isinstance(chiavi, dict) and all(isinstance(campo, str) for campo in chiavi.values()) and all(
+        isinstance(relazione.get(membro, ''), str) for membro in ('nome', 'referencing_layer', 'referenced_layer'))
+
+
+def nome_relazione(relazione_id, relazione):
+    """Return the name reported for a relationship read from a file, even if its record is invalid."""
+    if isinstance(relazione, dict) and isinstance(relazione.get('nome'), str):
+        return relazione['nome']
+    return str(relazione_id)
+
+
+def valida_relazione(relazione_id, relazione, layer_per_nome, campi_per_layer):
+    """Check an exported relationship against the layer lookup tables.
+
+    :returns: a ``(definizione, None)`` pair with the layer ids resolved if
+        the relationship is valid, ``(None, reason)`` otherwise.
+    """
+    if not relazione_id or not isinstance(relazione_id, str):
+        return None, "Invalid ID"
+    if not _record_valido(relazione):
+        return None, "Invalid relationship record"
+
+    # Verifica se i layer esistono nel progetto
+    layer_figlio = layer_per_nome.get(relazione.get('referencing_layer'))
+    layer_padre = layer_per_nome.get(relazione.get('referenced_layer'))
+    if not layer_figlio or not layer_padre:
+        return None, f"Layer not found: parent {relazione.get('referenced_layer')}, child {relazione.get('referencing_layer')}"
+
+    campi_padre = campi_per_layer[layer_padre]
+    campi_figlio = campi_per_layer[layer_figlio]
+
+    # Le chiavi esportate seguono QgsRelation.fieldPairs(): campo figlio -> campo padre
+    chiavi = relazione.get('chiavi', {})
+    non_valide = valida_chiavi(chiavi, campi_padre, campi_figlio)
+    if non_valide:
+        return None, "Invalid key pair: " + ", ".join(
+            f"{chiave_padre} -> {chiave_figlio}" for chiave_figlio, chiave_padre in non_valide)
+
+    return {
+        'id': relazione_id,
+        'nome': relazione.get('nome', ''),
+        'layer_padre_id': layer_padre,
+        'layer_figlio_id': layer_figlio,
+        'chiavi': dict(chiavi)
+    }, None
+
+
+def leggi_relazioni(file, jsonl, progresso=None):
+    """Read the relationships of an open export file.
+
+    :param file: binary file object opened for reading.
+    :param jsonl: True for a JSON Lines file, False for a JSON object.
+    :param progresso: optional callable receiving the fraction read (0-1),
+        only for JSON Lines files, which are read lazily.
+    :returns: ``(relazioni, totale)``: an iterable of ``(relazione_id,
+        relazione)`` pairs and their number, or None for JSON Lines files.
+    :raises ValueError: if the file is empty or invalid.
+    """
+    if jsonl:
+        return leggi_jsonl(file, progresso), None
+    relazioni = json.load(file)
+    if not relazioni or not isinstance(relazioni, dict):
+        raise ValueError("The file is empty or invalid.")
+    return relazioni.items(), len(relazioni)
+
+
+def scrivi_relazioni(relazioni, file, jsonl, progresso=None, totale=None):
+    """Write relationships to an open export file.
+
+    :param relazioni: iterable of ``(relazione_id, relazione)`` pairs in the export format.
+    :param file: text file object opened for writing.
+    :param progresso: optional callable receiving the completed fraction
+        (0-1), only for JSON Lines files.
+    :param totale: expected number of relationships, used for the progress.
+    """
+    if jsonl:
+        scrivi_jsonl(relazioni, file, progresso, totale)
+    else:
+        json.dump(dict(relazioni), file, indent=4)
+
+
+def crea_relazione(definizione):
+    """Create a :class:`QgsRelation` from a validated definition (main thread only).
+
+    The definition may carry the relationship strength (``forza``), as the
+    history records do; imported relationships are associations.
+    """
+    relation = QgsRelation()
+    relation.setName(definizione['nome'])
+    relation.setId(definizione['id'])
+    relation.setReferencingLayer(definizione['layer_figlio_id'])
+    relation.setReferencedLayer(definizione['layer_padre_id'])
+    for chiave_figlio, chiave_padre in definizione['chiavi'].items():
+        relation.addFieldPair(chiave_figlio, chiave_padre)
+    if definizione.get('forza') == 'Composition':
+        relation.setStrength(QgsRelation.Composition)
+    return relation
+
+
+class ImportaRelazioniTask(QgsTask):
+    """Parse and validate a relationship file in the background.
+
+    On success ``valide`` holds the validated definitions, ready for
+    :func:`crea_relazione`, and ``fallite`` the ``(name, reason)`` pairs of
+    the rejected relationships. On failure ``errore`` describes the problem,
+    unless the task was canceled.
+    """
+
+    def __init__(self, file_path, jsonl, layer_per_nome, campi_per_layer):
+        """Constructor."""
+        super().__init__("Load relationships", QgsTask.CanCancel)
+        self.file_path = file_path
+        self.jsonl = jsonl
+        self.layer_per_nome = layer_per_nome
+        self.campi_per_layer = campi_per_layer
+
+        self.valide = []
+        self.fallite = []
+        self.errore = None
+
+    def run(self):
+        """Read and validate the file."""
+        try:
+            with open(self.file_path, 'rb') as file:
+                relazioni, totale = leggi_relazioni(
+                    file, self.jsonl, lambda frazione: self.setProgress(frazione * 100))
+                for numero, (relazione_id, relazione) in enumerate(relazioni, start=1):
+                    if self.isCanceled():
+                        return False
+                    definizione, errore = valida_relazione(
+                        relazione_id, relazione, self.layer_per_nome, self.campi_per_layer)
+                    if errore:
+                        self.fallite.append((nome_relazione(relazione_id, relazione), errore))
+                    else:
+                        self.valide.append(definizione)
+                    if totale:
+                        self.setProgress(numero * 100 / totale)
+        except OSError as errore:
+            self.errore = f"The file could not be read: {errore}"
+            return False
+        except (ValueError, KeyError) as errore:
+            # json.JSONDecodeError e UnicodeDecodeError sono ValueError; gli altri errori arrivano a QgsTask
+            self.errore = f"The file format is invalid: {errore}"
+            return False
+
+        return True
+
+
+class EsportaRelazioniTask(QgsTask):
+    """Serialize a snapshot of the relationships to a file in the background.
+
+    A canceled or failed export removes the partially written file.
+    """
+
+    def __init__(self, file_path, jsonl, relazioni):
+        """Constructor.
+
+        :param relazioni: list of ``(relazione_id, relazione)`` pairs in the export format.
+        """
+        super().__init__("Export relationships", QgsTask.CanCancel)
+        self.file_path = file_path
+        self.jsonl = jsonl
+        self.relazioni = relazioni
+        self.errore = None
+
+    def run(self):
+        """Write the file."""
+        try:
+            with open(self.file_path, 'w', encoding='utf-8') as file:
+                scrivi_relazioni(self._fino_ad_annullamento(), file, self.jsonl,
+                                 lambda frazione: self.setProgress(frazione * 100), len(self.relazioni))
+        except OSError as errore:
+            self.errore = str(errore)
+
+        if self.errore or self.isCanceled():
+            if os.path.exists(self.file_path):
+                os.remove(self.file_path)
+            return False
+        return True
+
+    def _fino_ad_annullamento(self):
+        """Yield the relationships until the task is canceled."""
+        for relazione in self.relazioni:
+            if self.isCanceled():
+                return
+            yield relazione
+
+
+class IndicizzaInventarioTask(QgsTask):
+    """Bring the relationship inventory of a directory tree up to date in the background.
+
+    The index is opened inside :meth:`run`, since a SQLite connection can
+    only be used by the thread that created it.
+    """
+
+    def __init__(self, percorso_indice, cartella):
+        """Constructor.
+
+        :param percorso_indice: SQLite file of the inventory.
+        :param cartella: directory tree searched for project files.
+        """
+        super().__init__("Index project relationships", QgsTask.CanCancel)
+        self.percorso_indice = percorso_indice
+        self.cartella = cartella
+        self.esito = None
+        self.errore = None
+
+    def run(self):
+        """Index the changed project files."""
+        try:
+            inventario = InventarioRelazioni(self.percorso_indice)
+            try:
+                self.esito = inventario.indicizza(self.cartella, self.isCanceled,
+                                                  lambda frazione: self.setProgress(frazione * 100))
+            finally:
+                inventario.chiudi()
+        except (OSError, sqlite3.Error) as errore:
+            self.errore = str(errore)
+            return False
+        return not self.isCanceled()
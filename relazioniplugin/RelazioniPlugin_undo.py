@@ -0,0 +1,86 @@
+"""Undoable changes of the project relationships.
+
+Every plugin operation, however many relationships it touches, is pushed
+to the project undo stack as a single :class:`ComandoRelazioni`: undoing
+or redoing it applies all its relationships at once and emits a single
+``changed`` signal of the relation manager. Bulk operations collect their
+changes in a :class:`ModificheRelazioni` first, so that the relation
+manager, the QGIS forms and the plugin views are refreshed once per
+operation rather than once per relationship.
+"""
+
+from PyQt5.QtWidgets import QUndoCommand
+
+from .RelazioniPlugin_task import crea_relazione
+
+
+def applica_relazioni(relation_manager, relazioni):
+    """Set a group of relationships with a single change signal.
+
+    ``QgsRelationManager.setRelations`` would notify every relationship
+    added, so the signals are blocked and ``changed`` is emitted once at
+    the end.
+
+    :param relazioni: dict relationship id -> definition accepted by
+        :func:`crea_relazione`, or None to remove the relationship.
+    """
+    relation_manager.blockSignals(True)
+    try:
+        for relazione_id, definizione in relazioni.items():
+            if definizione is None:
+                relation_manager.removeRelation(relazione_id)
+            else:
+                # Una relazione con lo stesso ID sostituisce quella esistente
+                relation_manager.addRelation(crea_relazione(definizione))
+    finally:
+        relation_manager.blockSignals(False)
+    relation_manager.changed.emit()
+
+
+class ModificheRelazioni:
+    """Target state of a bulk change, collected before touching the relation manager.
+
+    Later changes of the same relationship replace the earlier ones.
+    """
+
+    def __init__(self):
+        """Constructor."""
+        # id relazione -> QgsRelation da impostare, o None per rimuoverla
+        self.relazioni = {}
+
+    def __len__(self):
+        """Number of relationships touched."""
+        return len(self.relazioni)
+
+    def aggiungi(self, relation):
+        """Add a relationship, or replace the one with the same id."""
+        self.relazioni[relation.id()] = relation
+
+    def rimuovi(self, relazione_id):
+        """Remove a relationship."""
+        self.relazioni[relazione_id] = None
+
+
+class ComandoRelazioni(QUndoCommand):
+    """Undo command replacing the definitions of a group of relationships."""
+
+    def __init__(self, relation_manager, testo, prima, dopo):
+        """Constructor.
+
+        :param testo: text shown for the command on the undo stack.
+        :param prima: dict relationship id -> definition (or None if absent)
+            of every touched relationship before the operation.
+        :param dopo: same, after the operation.
+        """
+        super().__init__(testo)
+        self.relation_manager = relation_manager
+        self.prima = prima
+        self.dopo = dopo
+
+    def redo(self):
+        """Apply the operation."""
+        applica_relazioni(self.relation_manager, self.dopo)
+
+    def undo(self):
+        """Revert the operation."""
+        applica_relazioni(self.relation_manager, self.prima)
@@ -0,0 +1,43 @@
+# coding=utf-8
+"""Sample project file shared by the project file tests."""
+
+PROGETTO = '''<!DOCTYPE qgis PUBLIC 'http://mrcc.com/qgis.dtd' 'SYSTEM'>
+<qgis projectname="" version="3.34.0-Prizren">
+  <title></title>
+  <layer-tree-group>
+    <layer-tree-layer id="parcels_1" name="Parcels"/>
+  </layer-tree-group>
+  <projectlayers>
+    <maplayer type="vector" geometry="Polygon">
+      <id>parcels_1</id>
+      <datasource>./data.gpkg|layername=parcels</datasource>
+      <layername>Parcels</layername>
+      <provider encoding="UTF-8">ogr</provider>
+      <fieldConfiguration>
+        <field name="id" configurationFlags="None"/>
+        <field name="code" configurationFlags="None"/>
+      </fieldConfiguration>
+    </maplayer>
+    <maplayer type="vector" geometry="Polygon">
+      <id>buildings_1</id>
+      <layername>Buildings &amp; Sheds</layername>
+      <fieldConfiguration>
+        <field name="fid" configurationFlags="None"/>
+        <field name="parcel_id" configurationFlags="None"/>
+      </fieldConfiguration>
+    </maplayer>
+    <maplayer type="raster">
+      <id>ortho_1</id>
+      <layername>Ortho</layername>
+    </maplayer>
+  </projectlayers>
+  <relations>
+    <relation strength="Composition" referencingLayer="buildings_1" name="Parcel buildings" id="rel_1" referencedLayer="parcels_1">
+      <fieldRef referencingField="parcel_id" referencedField="id"/>
+    </relation>
+  </relations>
+  <properties>
+    <Digitizing/>
+  </properties>
+</qgis>
+'''
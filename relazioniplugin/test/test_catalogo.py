@@ -0,0 +1,54 @@
+# coding=utf-8
+"""Relationship reverse indexes test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'gianoli.federico@gmail.com'
+__date__ = '2024-10-03'
+__copyright__ = 'Copyright 2024, Federico Gianoli'
+
+import unittest
+
+from RelazioniPlugin_catalogo import IndiceRelazioni
+
+
+class RelazioniPluginCatalogoTest(unittest.TestCase):
+    """Test the layer and field reverse indexes."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.indice = IndiceRelazioni()
+        self.indice.aggiungi('r1', 'parcels', 'buildings', {'parcel_id': 'id'})
+        self.indice.aggiungi('r2', 'regions', 'parcels', {'region': 'name', 'zone': 'zone'})
+
+    def test_lookup(self):
+        """Relationships are found by layer, on both sides, and by key field."""
+        self.assertEqual(self.indice.relazioni_layer('parcels'), {'r1', 'r2'})
+        self.assertEqual(self.indice.relazioni_layer('buildings'), {'r1'})
+        self.assertEqual(self.indice.relazioni_campo('parcels', 'id'), {'r1'})
+        self.assertEqual(self.indice.relazioni_campo('parcels', 'zone'), {'r2'})
+        self.assertEqual(self.indice.relazioni_campo('regions', 'zone'), {'r2'})
+        self.assertEqual(self.indice.relazioni_campo('buildings', 'id'), frozenset())
+
+    def test_replace_and_remove(self):
+        """Replacing or removing a relationship drops its stale entries."""
+        self.indice.aggiungi('r1', 'parcels', 'owners', {'parcel': 'id'})
+        self.assertEqual(self.indice.relazioni_layer('buildings'), frozenset())
+        self.assertNotIn(('buildings', 'parcel_id'), self.indice.campi())
+        self.assertEqual(self.indice.relazioni_campo('owners', 'parcel'), {'r1'})
+
+        self.indice.rimuovi('r2')
+        self.indice.rimuovi('missing')
+        self.assertEqual(len(self.indice), 1)
+        self.assertEqual(set(self.indice.layer()), {'parcels', 'owners'})
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(RelazioniPluginCatalogoTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,203 @@
+# coding=utf-8
+"""Headless relationship catalog test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'gianoli.federico@gmail.com'
+__date__ = '2024-10-03'
+__copyright__ = 'Copyright 2024, Federico Gianoli'
+
+import unittest
+
+from qgis.core import QgsRelation
+
+from RelazioniPlugin_core import CatalogoRelazioni
+
+from utilities import get_qgis_app
+QGIS_APP = get_qgis_app()
+
+
+class CampiFinti:
+    """Field list of a stub layer, counting the reads."""
+
+    def __init__(self, layer, nomi):
+        """Constructor."""
+        self.layer = layer
+        self.nomi = nomi
+
+    def names(self):
+        """Return the field names."""
+        self.layer.letture += 1
+        return list(self.nomi)
+
+
+class LayerFinto:
+    """Stub vector layer."""
+
+    def __init__(self, layer_id, nome, campi):
+        """Constructor."""
+        self._id = layer_id
+        self._nome = nome
+        self._campi = campi
+        self.letture = 0
+
+    def id(self):
+        return self._id
+
+    def name(self):
+        return self._nome
+
+    def fields(self):
+        return CampiFinti(self, self._campi)
+
+
+class RelazioneFinta:
+    """Stub relationship between two stub layers."""
+
+    def __init__(self, relazione_id, nome, padre, figlio, chiavi):
+        """Constructor."""
+        self._id = relazione_id
+        self._nome = nome
+        self._padre = padre
+        self._figlio = figlio
+        self._chiavi = chiavi
+
+    def id(self):
+        return self._id
+
+    def name(self):
+        return self._nome
+
+    def referencedLayer(self):
+        return self._padre
+
+    def referencingLayer(self):
+        return self._figlio
+
+    def referencedLayerId(self):
+        return self._padre.id() if self._padre else ''
+
+    def referencingLayerId(self):
+        return self._figlio.id() if self._figlio else ''
+
+    def fieldPairs(self):
+        return dict(self._chiavi)
+
+    def strength(self):
+        return QgsRelation.Association
+
+
+class RelationManagerFinto:
+    """Stub relation manager."""
+
+    def __init__(self, relazioni):
+        """Constructor."""
+        self._relazioni = {relation.id(): relation for relation in relazioni}
+
+    def relations(self):
+        return dict(self._relazioni)
+
+    def relation(self, relazione_id):
+        # Come QgsRelationManager, una relazione vuota per gli id sconosciuti
+        return self._relazioni.get(relazione_id, RelazioneFinta('', '', None, None, {}))
+
+
+class ProgettoFinto:
+    """Stub project holding stub layers and relationships."""
+
+    def __init__(self, layers, relazioni):
+        """Constructor."""
+        self._layers = {layer.id(): layer for layer in layers}
+        self._relation_manager = RelationManagerFinto(relazioni)
+
+    def mapLayer(self, layer_id):
+        return self._layers.get(layer_id)
+
+    def relationManager(self):
+        return self._relation_manager
+
+
+class RelazioniPluginCoreTest(unittest.TestCase):
+    """Test comparing, preparing and applying relationship batches on stub objects."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.parcels = LayerFinto('parcels_1', 'Parcels', ['id', 'code'])
+        self.buildings = LayerFinto('buildings_1', 'Buildings', ['fid', 'parcel_id', 'code'])
+        self.progetto = ProgettoFinto([self.parcels, self.buildings], [
+            RelazioneFinta('r1', 'Parcel buildings', self.parcels, self.buildings, {'parcel_id': 'id'}),
+            RelazioneFinta('r2', 'Parcel codes', self.parcels, self.buildings, {'code': 'code'})
+        ])
+        self.comandi = []
+        self.catalogo = CatalogoRelazioni(self.progetto, self)
+
+    def push(self, comando):
+        """Stand in for the undo stack, recording the commands without applying them."""
+        self.comandi.append(comando)
+
+    def definizione(self, relazione_id, nome, chiavi):
+        """Build a validated definition between the stub layers."""
+        return {
+            'id': relazione_id,
+            'nome': nome,
+            'layer_padre_id': 'parcels_1',
+            'layer_figlio_id': 'buildings_1',
+            'chiavi': chiavi
+        }
+
+    def test_differenze(self):
+        """Definitions are compared with the current relationships, removals only when replacing."""
+        definizioni = [
+            self.definizione('r1', 'Parcel buildings', {'parcel_id': 'code'}),
+            self.definizione('r3', 'New', {'fid': 'id'})
+        ]
+        aggiunte, modificate, rimosse = self.catalogo.differenze(definizioni)
+        self.assertEqual(list(aggiunte), ['r3'])
+        self.assertEqual(aggiunte['r3']['forza'], 'Association')
+        self.assertEqual(list(modificate), ['r1'])
+        self.assertEqual(modificate['r1'][0]['chiavi'], {'parcel_id': 'id'})
+        self.assertEqual(rimosse, {})
+
+        _, _, rimosse = self.catalogo.differenze(definizioni, sostituisci=True)
+        self.assertEqual(list(rimosse), ['r2'])
+
+        # Una definizione identica non è una modifica
+        _, modificate, _ = self.catalogo.differenze([self.definizione('r1', 'Parcel buildings', {'parcel_id': 'id'})])
+        self.assertEqual(modificate, {})
+
+    def test_prepara(self):
+        """Removals are collected and definitions that do not resolve to layers are rejected."""
+        modifiche, esito = self.catalogo.prepara(
+            [self.definizione('r3', 'Unresolved', {'fid': 'id'})], rimuovi=['r2'])
+        self.assertEqual(modifiche.relazioni, {'r2': None})
+        self.assertEqual(esito, {'caricate': [], 'fallite': [('Unresolved', "Invalid relationship definition")]})
+
+    def test_applica_modifiche(self):
+        """A batch becomes one undo command, reading the fields of each layer once."""
+        self.catalogo.applica_modifiche({
+            'r1': RelazioneFinta('r1', 'Renamed', self.parcels, self.buildings, {'parcel_id': 'id'}),
+            'r2': None,
+            'r3': RelazioneFinta('r3', 'New', self.parcels, self.buildings, {'fid': 'id'})
+        }, "Edit relationships")
+
+        self.assertEqual(len(self.comandi), 1)
+        comando = self.comandi[0]
+        self.assertEqual(comando.text(), "Edit relationships")
+        self.assertEqual(comando.prima['r1']['nome'], 'Parcel buildings')
+        self.assertEqual(comando.prima['r2']['chiavi'], {'code': 'code'})
+        self.assertIsNone(comando.prima['r3'])
+        self.assertEqual(comando.dopo['r1']['nome'], 'Renamed')
+        self.assertIsNone(comando.dopo['r2'])
+        self.assertEqual(comando.dopo['r3']['layer_figlio'], 'Buildings')
+        self.assertEqual((self.parcels.letture, self.buildings.letture), (1, 1))
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(RelazioniPluginCoreTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
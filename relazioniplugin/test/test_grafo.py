@@ -0,0 +1,94 @@
+# coding=utf-8
+"""Relationship graph test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'gianoli.federico@gmail.com'
+__date__ = '2024-10-03'
+__copyright__ = 'Copyright 2024, Federico Gianoli'
+
+import unittest
+
+from RelazioniPlugin_grafo import GrafoRelazioni
+
+
+class RelazioniPluginGrafoTest(unittest.TestCase):
+    """Test the layer graph analysis."""
+
+    def setUp(self):
+        """Runs before each test: regions -> parcels -> buildings -> rooms, parcels -> owners."""
+        self.grafo = GrafoRelazioni()
+        self.grafo.aggiungi_arco('r1', 'regions', 'parcels')
+        self.grafo.aggiungi_arco('r2', 'parcels', 'buildings')
+        self.grafo.aggiungi_arco('r3', 'buildings', 'rooms')
+        self.grafo.aggiungi_arco('r4', 'parcels', 'owners')
+
+    def test_acyclic(self):
+        """Topological order, depth and fan-out of a tree."""
+        analisi = self.grafo.analizza()
+        ordine = analisi['ordine']
+        for padre, figlio in (('regions', 'parcels'), ('parcels', 'buildings'),
+                              ('buildings', 'rooms'), ('parcels', 'owners')):
+            self.assertLess(ordine.index(padre), ordine.index(figlio))
+        self.assertEqual(analisi['cicli'], [])
+        self.assertEqual(analisi['profondita']['rooms'], 3)
+        self.assertEqual(analisi['profondita_massima'], 3)
+        self.assertEqual(analisi['fan_out']['parcels'], 2)
+        self.assertEqual(self.grafo.fan_in('rooms'), 1)
+
+    def test_cycle(self):
+        """A relationship back to an ancestor closes a cycle."""
+        self.assertTrue(self.grafo.chiuderebbe_ciclo('rooms', 'regions'))
+        self.assertFalse(self.grafo.chiuderebbe_ciclo('owners', 'rooms'))
+        self.assertTrue(self.grafo.chiuderebbe_ciclo('rooms', 'rooms'))
+
+        self.grafo.aggiungi_arco('r5', 'rooms', 'parcels')
+        analisi = self.grafo.analizza()
+        self.assertEqual(len(analisi['cicli']), 1)
+        self.assertEqual(set(analisi['cicli'][0]), {'parcels', 'buildings', 'rooms'})
+        self.assertEqual(analisi['profondita']['owners'], 2)
+
+    def test_exclude_edited_relationship(self):
+        """The relationship being edited does not count towards a cycle."""
+        self.assertTrue(self.grafo.chiuderebbe_ciclo('buildings', 'parcels'))
+        self.assertFalse(self.grafo.chiuderebbe_ciclo('buildings', 'parcels', escludi='r2'))
+        self.grafo.aggiungi_arco('r6', 'parcels', 'buildings')
+        self.assertTrue(self.grafo.chiuderebbe_ciclo('buildings', 'parcels', escludi='r2'))
+
+    def test_incremental_update(self):
+        """Removing and replacing arcs keeps the graph and the analysis current."""
+        self.assertEqual(self.grafo.analizza()['profondita_massima'], 3)
+        self.grafo.rimuovi_arco('r3')
+        self.assertNotIn('rooms', self.grafo.layer())
+        self.assertEqual(self.grafo.analizza()['profondita_massima'], 2)
+        self.grafo.aggiungi_arco('r1', 'owners', 'regions')
+        self.assertEqual(len(self.grafo), 3)
+        self.assertEqual(self.grafo.analizza()['cicli'], [])
+        self.assertEqual(self.grafo.analizza()['profondita']['regions'], 2)
+
+    def test_downstream(self):
+        """The downstream walk lists every relationship once, with its depth."""
+        self.assertEqual(self.grafo.a_valle('parcels'), [('r2', 1), ('r4', 1), ('r3', 2)])
+        self.assertEqual(self.grafo.a_valle('rooms'), [])
+        self.grafo.aggiungi_arco('r5', 'rooms', 'parcels')
+        self.assertEqual(self.grafo.a_valle('buildings'), [('r3', 1), ('r5', 2), ('r2', 3), ('r4', 3)])
+        self.grafo.rimuovi_arco('r3')
+        self.assertEqual(self.grafo.a_valle('buildings'), [])
+
+    def test_long_chain(self):
+        """Long chains do not hit the recursion limit."""
+        grafo = GrafoRelazioni()
+        for numero in range(5000):
+            grafo.aggiungi_arco(numero, numero, numero + 1)
+        self.assertEqual(grafo.analizza()['profondita_massima'], 5000)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(RelazioniPluginGrafoTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,103 @@
+# coding=utf-8
+"""Cross-project relationship inventory test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'gianoli.federico@gmail.com'
+__date__ = '2024-10-03'
+__copyright__ = 'Copyright 2024, Federico Gianoli'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from RelazioniPlugin_inventario import InventarioRelazioni, motivo_like, sorgente_assoluta
+
+from progetto_esempio import PROGETTO
+
+
+class RelazioniPluginInventarioTest(unittest.TestCase):
+    """Test the incremental SQLite index of the relationships of many projects."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.cartella = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.cartella, 'sub'))
+        self.primo = self._scrivi('a.qgs', PROGETTO)
+        self.secondo = self._scrivi(os.path.join('sub', 'b.qgs'), PROGETTO.replace('Parcel buildings', 'Other'))
+        self.inventario = InventarioRelazioni(os.path.join(self.cartella, 'index.sqlite'))
+
+    def tearDown(self):
+        """Runs after each test."""
+        self.inventario.chiudi()
+        shutil.rmtree(self.cartella)
+
+    def _scrivi(self, nome, testo):
+        """Write a project file of the tree."""
+        percorso = os.path.join(self.cartella, nome)
+        with open(percorso, 'w', encoding='utf-8') as file:
+            file.write(testo)
+        return percorso
+
+    def test_index_and_search(self):
+        """Relationships are found by layer name and by resolved data source."""
+        esito = self.inventario.indicizza(self.cartella)
+        self.assertEqual((esito['aggiunti'], esito['errori']), (2, []))
+        self.assertEqual((len(self.inventario), self.inventario.numero_relazioni()), (2, 2))
+
+        risultati = self.inventario.cerca(layer='sheds')
+        self.assertEqual([progetto for progetto, _, _ in risultati], [self.primo, self.secondo])
+        self.assertEqual(risultati[0][1:], ('rel_1', {
+            'nome': 'Parcel buildings',
+            'referencing_layer': 'Buildings & Sheds',
+            'referenced_layer': 'Parcels',
+            'chiavi': {'parcel_id': 'id'}
+        }))
+
+        # Le sorgenti relative vengono risolte rispetto alla cartella del progetto
+        sorgente = os.path.join(self.cartella, 'sub', 'data.gpkg')
+        self.assertEqual([progetto for progetto, _, _ in self.inventario.cerca(sorgente=sorgente)], [self.secondo])
+        self.assertEqual(self.inventario.cerca(layer='parcels', sorgente='nowhere.gpkg'), [])
+        self.assertEqual(len(self.inventario.cerca(limite=1)), 1)
+
+    def test_incremental(self):
+        """Re-indexing touches only the changed, new and removed files."""
+        self.inventario.indicizza(self.cartella)
+        self.assertEqual(self.inventario.indicizza(self.cartella)['invariati'], 2)
+
+        # Data cambiata, contenuto identico
+        os.utime(self.primo, (1, 1))
+        self.assertEqual(self.inventario.indicizza(self.cartella)['invariati'], 2)
+
+        self._scrivi('a.qgs', PROGETTO.replace('rel_1', 'rel_9'))
+        os.remove(self.secondo)
+        self._scrivi('c.qgs', PROGETTO)
+        esito = self.inventario.indicizza(self.cartella)
+        self.assertEqual((esito['aggiunti'], esito['aggiornati'], esito['rimossi']), (1, 1, 1))
+        self.assertEqual(sorted(relazione_id for _, relazione_id, _ in self.inventario.cerca()), ['rel_1', 'rel_9'])
+
+    def test_unreadable_project(self):
+        """A project that cannot be parsed is reported and kept out of the results."""
+        self._scrivi('broken.qgs', '<qgis><relations>')
+        esito = self.inventario.indicizza(self.cartella)
+        self.assertEqual([percorso for percorso, _ in esito['errori']], [os.path.join(self.cartella, 'broken.qgs')])
+        self.assertEqual(len(self.inventario.errori()), 1)
+        self.assertEqual(self.inventario.numero_relazioni(), 2)
+
+    def test_helpers(self):
+        """Relative data sources are resolved, LIKE wildcards are escaped."""
+        self.assertEqual(sorgente_assoluta('./d.gpkg|layername=x', '/p'), '/p/d.gpkg|layername=x')
+        self.assertEqual(sorgente_assoluta("dbname='gis' table=x", '/p'), "dbname='gis' table=x")
+        self.assertEqual(motivo_like('a_b%'), '%a\\_b\\%%')
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(RelazioniPluginInventarioTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,85 @@
+# coding=utf-8
+"""JSON Lines serialization test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'gianoli.federico@gmail.com'
+__date__ = '2024-10-03'
+__copyright__ = 'Copyright 2024, Federico Gianoli'
+
+import io
+import os
+import tempfile
+import unittest
+
+from RelazioniPlugin_jsonl import leggi_jsonl, scrivi_jsonl
+
+
+RELAZIONI = [
+    ('rel:1', {
+        'nome': 'Buildings',
+        'referencing_layer': 'buildings',
+        'referenced_layer': 'parcels',
+        'chiavi': {'parcel_id': 'id'}
+    }),
+    ('rel_2', {
+        'nome': 'Città',
+        'referencing_layer': 'streets',
+        'referenced_layer': 'towns',
+        'chiavi': {'town_id': 'id', 'region': 'region'}
+    }),
+]
+
+
+class RelazioniPluginJsonlTest(unittest.TestCase):
+    """Test JSON Lines export and import."""
+
+    def setUp(self):
+        """Runs before each test."""
+        handle, self.path = tempfile.mkstemp(suffix='.jsonl')
+        os.close(handle)
+
+    def tearDown(self):
+        """Runs after each test."""
+        os.remove(self.path)
+
+    def test_round_trip(self):
+        """Relationships read back are the ones written, in order."""
+        avanzamento = []
+        with open(self.path, 'w', encoding='utf-8') as file:
+            scritte = scrivi_jsonl(iter(RELAZIONI), file, avanzamento.append, len(RELAZIONI))
+        self.assertEqual(scritte, 2)
+        self.assertEqual(avanzamento[-1], 1)
+
+        avanzamento = []
+        with open(self.path, 'rb') as file:
+            lette = list(leggi_jsonl(file, avanzamento.append))
+        self.assertEqual(lette, RELAZIONI)
+        self.assertEqual(avanzamento[-1], 1)
+
+    def test_one_relation_per_line(self):
+        """Every relationship is written on its own line."""
+        file = io.StringIO()
+        scrivi_jsonl(RELAZIONI, file)
+        self.assertEqual(len(file.getvalue().splitlines()), len(RELAZIONI))
+
+    def test_invalid_line(self):
+        """An invalid line reports its line number."""
+        with open(self.path, 'w', encoding='utf-8') as file:
+            file.write('{"id": "a", "nome": "A"}\n\n{broken\n')
+        with open(self.path, 'rb') as file:
+            relazioni = leggi_jsonl(file)
+            self.assertEqual(next(relazioni), ('a', {'nome': 'A'}))
+            with self.assertRaisesRegex(ValueError, 'line 3'):
+                next(relazioni)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(RelazioniPluginJsonlTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
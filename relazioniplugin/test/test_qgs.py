@@ -0,0 +1,151 @@
+# coding=utf-8
+"""Project file relationship reader/writer test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'gianoli.federico@gmail.com'
+__date__ = '2024-10-03'
+__copyright__ = 'Copyright 2024, Federico Gianoli'
+
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+from RelazioniPlugin_qgs import leggi_progetto, scrivi_relazioni_progetto, sostituisci_relazioni
+
+from progetto_esempio import PROGETTO
+
+
+def record(relazione_id, nome, chiavi, forza='Association'):
+    """Build a relationship record between the sample layers."""
+    return {
+        'id': relazione_id,
+        'nome': nome,
+        'layer_padre_id': 'parcels_1',
+        'layer_figlio_id': 'buildings_1',
+        'chiavi': chiavi,
+        'forza': forza
+    }
+
+
+class RelazioniPluginQgsTest(unittest.TestCase):
+    """Test reading and rewriting the relationships of project files."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.cartella = tempfile.mkdtemp()
+        self.qgs = os.path.join(self.cartella, 'project.qgs')
+        with open(self.qgs, 'w', encoding='utf-8') as file:
+            file.write(PROGETTO)
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.cartella)
+
+    def _qgz(self):
+        """Zip the sample project with an auxiliary storage member."""
+        qgz = os.path.join(self.cartella, 'project.qgz')
+        with zipfile.ZipFile(qgz, 'w', zipfile.ZIP_DEFLATED) as archivio:
+            archivio.writestr('project.qgs', PROGETTO)
+            archivio.writestr('project.qgd', b'auxiliary')
+        return qgz
+
+    def test_read(self):
+        """Layers and relationships are read with their names and fields."""
+        layer, relazioni = leggi_progetto(self.qgs)
+        self.assertEqual(layer['buildings_1']['nome'], 'Buildings & Sheds')
+        self.assertEqual(layer['parcels_1']['campi'], ['id', 'code'])
+        self.assertEqual(layer['parcels_1']['sorgente'], './data.gpkg|layername=parcels')
+        self.assertEqual(layer['parcels_1']['provider'], 'ogr')
+        self.assertEqual(layer['ortho_1'], {'nome': 'Ortho', 'tipo': 'raster', 'provider': '', 'sorgente': '',
+                                            'campi': []})
+        self.assertEqual(relazioni['rel_1'], dict(
+            record('rel_1', 'Parcel buildings', {'parcel_id': 'id'}, 'Composition'),
+            layer_padre='Parcels', layer_figlio='Buildings & Sheds'))
+
+    def test_read_qgz(self):
+        """The .qgs inside a .qgz archive is read."""
+        layer, relazioni = leggi_progetto(self._qgz())
+        self.assertEqual(set(layer), {'parcels_1', 'buildings_1', 'ortho_1'})
+        self.assertEqual(list(relazioni), ['rel_1'])
+
+    def test_rewrite_only_the_relations_block(self):
+        """Everything outside the relations block is left byte for byte."""
+        nuove = [record('rel_2', 'Codes "A"', {'parcel_id': 'id', 'fid': 'code'})]
+        scrivi_relazioni_progetto(self.qgs, nuove)
+
+        with open(self.qgs, encoding='utf-8') as file:
+            testo = file.read()
+        prima, dopo = PROGETTO.split('  <relations>')[0], PROGETTO.split('</relations>')[1]
+        self.assertTrue(testo.startswith(prima))
+        self.assertTrue(testo.endswith(dopo))
+
+        _, relazioni = leggi_progetto(self.qgs)
+        self.assertEqual(list(relazioni), ['rel_2'])
+        self.assertEqual(relazioni['rel_2']['nome'], 'Codes "A"')
+        self.assertEqual(relazioni['rel_2']['chiavi'], {'parcel_id': 'id', 'fid': 'code'})
+
+    def test_keep_extra_attributes(self):
+        """The layer attributes QGIS writes are kept while a relationship keeps its layers."""
+        extra = 'referencedLayerProviderKey="ogr" referencedLayerDataSource="./data.gpkg|layername=parcels"'
+        documento = PROGETTO.replace('referencedLayer="parcels_1">', f'referencedLayer="parcels_1" {extra}>')
+
+        invariata = record('rel_1', 'Parcel buildings', {'parcel_id': 'id'}, 'Composition')
+        testo = sostituisci_relazioni(documento.encode('utf-8'), [invariata]).decode('utf-8')
+        self.assertEqual(testo, documento)
+
+        rinominata = sostituisci_relazioni(documento.encode('utf-8'), [dict(invariata, nome='Renamed')])
+        self.assertIn(extra.encode('utf-8'), rinominata)
+
+        altro_padre = sostituisci_relazioni(documento.encode('utf-8'), [dict(invariata, layer_padre_id='ortho_1')])
+        self.assertNotIn(b'referencedLayerProviderKey', altro_padre)
+
+    def test_empty_and_missing_block(self):
+        """An empty set writes an empty element, and a missing block is inserted."""
+        vuoto = sostituisci_relazioni(PROGETTO.encode('utf-8'), [])
+        self.assertIn(b'<relations/>', vuoto)
+
+        # Anche il blocco vuoto viene poi sostituito
+        pieno = sostituisci_relazioni(vuoto, [record('rel_3', 'Again', {'parcel_id': 'id'})])
+        self.assertNotIn(b'<relations/>', pieno)
+
+        senza = vuoto.replace(b'  <relations/>\n', b'')
+        inserito = sostituisci_relazioni(senza, [record('rel_3', 'Again', {'parcel_id': 'id'})])
+        self.assertTrue(inserito.rstrip().endswith(b'</relations>\n</qgis>'))
+
+        with open(self.qgs, 'wb') as file:
+            file.write(inserito)
+        _, relazioni = leggi_progetto(self.qgs)
+        self.assertEqual(list(relazioni), ['rel_3'])
+
+    def test_rewrite_qgz(self):
+        """The other members of a .qgz archive are kept."""
+        qgz = self._qgz()
+        scrivi_relazioni_progetto(qgz, [])
+        with zipfile.ZipFile(qgz) as archivio:
+            self.assertEqual(archivio.read('project.qgd'), b'auxiliary')
+            self.assertEqual(archivio.getinfo('project.qgs').compress_type, zipfile.ZIP_DEFLATED)
+        self.assertEqual(leggi_progetto(qgz)[1], {})
+        # Nessun file temporaneo rimasto
+        self.assertEqual(sorted(os.listdir(self.cartella)), ['project.qgs', 'project.qgz'])
+
+    def test_invalid(self):
+        """Invalid files raise ValueError and leave the project untouched."""
+        with open(self.qgs, 'w', encoding='utf-8') as file:
+            file.write('<qgis><relations>')
+        with self.assertRaises(ValueError):
+            scrivi_relazioni_progetto(self.qgs, [])
+        self.assertEqual(sorted(os.listdir(self.cartella)), ['project.qgs'])
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(RelazioniPluginQgsTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,93 @@
+# coding=utf-8
+"""SQL pushdown test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'gianoli.federico@gmail.com'
+__date__ = '2024-10-03'
+__copyright__ = 'Copyright 2024, Federico Gianoli'
+
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from RelazioniPlugin_sql import (
+    esegui_query_sqlite, quota_identificatore, sql_colonne_indicizzate_sqlite, sql_conta_orfani, sql_crea_indice,
+    tabella_qualificata
+)
+
+
+class RelazioniPluginSqlTest(unittest.TestCase):
+    """Test the orphan anti-join against a SQLite file."""
+
+    def setUp(self):
+        """Runs before each test."""
+        handle, self.path = tempfile.mkstemp(suffix='.gpkg')
+        os.close(handle)
+        connessione = sqlite3.connect(self.path)
+        connessione.executescript('''
+            CREATE TABLE "parcels" (id INTEGER PRIMARY KEY, region TEXT, code INTEGER);
+            CREATE TABLE "my ""buildings""" (fid INTEGER PRIMARY KEY, region TEXT, parcel_code INTEGER);
+            INSERT INTO "parcels" VALUES (1, 'north', 10), (2, 'north', 20), (3, 'south', 10);
+            INSERT INTO "my ""buildings""" VALUES
+                (1, 'north', 10),
+                (2, 'north', 20),
+                (3, 'south', 10),
+                (4, 'south', 20),
+                (5, 'east', 30),
+                (6, NULL, 10),
+                (7, 'north', NULL);
+        ''')
+        connessione.commit()
+        connessione.close()
+
+    def tearDown(self):
+        """Runs after each test."""
+        os.remove(self.path)
+
+    def test_quote(self):
+        """Identifiers are double-quoted with embedded quotes doubled."""
+        self.assertEqual(quota_identificatore('my "buildings"'), '"my ""buildings"""')
+        self.assertEqual(tabella_qualificata('parcels', 'public'), '"public"."parcels"')
+
+    def test_single_key(self):
+        """Child rows with a non-NULL key missing from the parent are orphans."""
+        sql = sql_conta_orfani(tabella_qualificata('my "buildings"'), tabella_qualificata('parcels'),
+                               [('parcel_code', 'code')])
+        self.assertEqual(esegui_query_sqlite(self.path, sql), [(1,)])
+
+    def test_composite_key(self):
+        """Every pair of a composite key takes part in the join."""
+        sql = sql_conta_orfani(tabella_qualificata('my "buildings"'), tabella_qualificata('parcels'),
+                               [('region', 'region'), ('parcel_code', 'code')])
+        self.assertEqual(esegui_query_sqlite(self.path, sql), [(2,)])
+
+    def test_create_index(self):
+        """A missing key index is detected, created once, then found."""
+        tabella = 'my "buildings"'
+        colonne = sql_colonne_indicizzate_sqlite(tabella)
+        self.assertEqual(esegui_query_sqlite(self.path, colonne), [])
+
+        sql = sql_crea_indice(tabella, ('parcel_code', 'region'))
+        with self.assertRaises(sqlite3.OperationalError):
+            esegui_query_sqlite(self.path, sql)
+        esegui_query_sqlite(self.path, sql, sola_lettura=False)
+        esegui_query_sqlite(self.path, sql, sola_lettura=False)
+        self.assertEqual(esegui_query_sqlite(self.path, colonne), [('parcel_code',)])
+
+    def test_no_keys(self):
+        """A relationship without key pairs cannot be checked."""
+        with self.assertRaises(ValueError):
+            sql_conta_orfani('"a"', '"b"', [])
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(RelazioniPluginSqlTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,76 @@
+# coding=utf-8
+"""Cardinality statistics test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'gianoli.federico@gmail.com'
+__date__ = '2024-10-03'
+__copyright__ = 'Copyright 2024, Federico Gianoli'
+
+import sqlite3
+import unittest
+
+from RelazioniPlugin_sql import sql_istogramma_figli, tabella_qualificata
+from RelazioniPlugin_statistiche import istogramma_figli, statistiche_cardinalita
+
+
+PADRI = [1, 2, 3, 4, None, 4]
+FIGLI = [1, 1, 1, 2, 9, None]
+
+
+class RelazioniPluginStatisticheTest(unittest.TestCase):
+    """Test the child-count histogram and its summary."""
+
+    def test_histogram(self):
+        """Orphans are ignored, parents without children are counted."""
+        istogramma = istogramma_figli((p for p in PADRI if p is not None), (f for f in FIGLI if f is not None))
+        self.assertEqual(istogramma, {3: 1, 1: 1, 0: 2})
+
+    def test_sql_histogram_matches_streaming(self):
+        """The GROUP BY query returns the same histogram as the streaming pass."""
+        connessione = sqlite3.connect(':memory:')
+        connessione.executescript('''
+            CREATE TABLE parent (code INTEGER);
+            CREATE TABLE child (parent_code INTEGER);
+        ''')
+        connessione.executemany('INSERT INTO parent VALUES (?)', [(p,) for p in PADRI])
+        connessione.executemany('INSERT INTO child VALUES (?)', [(f,) for f in FIGLI])
+        sql = sql_istogramma_figli(tabella_qualificata('child'), tabella_qualificata('parent'),
+                                   [('parent_code', 'code')])
+        istogramma = dict(connessione.execute(sql).fetchall())
+        connessione.close()
+        self.assertEqual(istogramma, {3: 1, 1: 1, 0: 2})
+
+    def test_statistics(self):
+        """Minimum, maximum, mean, percentile and childless parents."""
+        statistiche = statistiche_cardinalita({0: 2, 1: 1, 3: 1})
+        self.assertEqual(statistiche['padri'], 4)
+        self.assertEqual(statistiche['figli'], 4)
+        self.assertEqual(statistiche['senza_figli'], 2)
+        self.assertEqual(statistiche['minimo'], 0)
+        self.assertEqual(statistiche['massimo'], 3)
+        self.assertEqual(statistiche['media'], 1)
+        self.assertEqual(statistiche['percentile'], 3)
+
+    def test_percentile_nearest_rank(self):
+        """The percentile ignores a single extreme parent out of many."""
+        statistiche = statistiche_cardinalita({1: 999, 500: 1})
+        self.assertEqual(statistiche['percentile'], 1)
+        self.assertEqual(statistiche['massimo'], 500)
+
+    def test_no_parents(self):
+        """An empty histogram has no per-parent values."""
+        statistiche = statistiche_cardinalita({})
+        self.assertEqual(statistiche['padri'], 0)
+        self.assertIsNone(statistiche['media'])
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(RelazioniPluginStatisticheTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
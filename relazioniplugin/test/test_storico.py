@@ -0,0 +1,149 @@
+# coding=utf-8
+"""Persistent history test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'gianoli.federico@gmail.com'
+__date__ = '2024-10-03'
+__copyright__ = 'Copyright 2024, Federico Gianoli'
+
+import os
+import tempfile
+import unittest
+
+from RelazioniPlugin_storico import (
+    CREA, ELIMINA, ESTERNA, IN_MEMORIA, INTERVALLO_ISTANTANEE, MODIFICA, StoricoRelazioni, differenze, percorso_storico
+)
+
+
+def record(relazione_id, nome=None, chiavi=None, layer_padre='Parcels'):
+    """Build a snapshot record."""
+    return {
+        'id': relazione_id,
+        'nome': nome or relazione_id,
+        'layer_padre_id': 'parcels_1',
+        'layer_figlio_id': 'buildings_1',
+        'layer_padre': layer_padre,
+        'layer_figlio': 'Buildings',
+        'chiavi': chiavi or {'parcel_id': 'id'},
+        'forza': 'Association'
+    }
+
+
+class RelazioniPluginStoricoTest(unittest.TestCase):
+    """Test the versioned, disk-backed history journal."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.cartella = tempfile.TemporaryDirectory()
+        self.percorso = percorso_storico(os.path.join(self.cartella.name, 'project.qgz'))
+
+    def tearDown(self):
+        """Runs after each test."""
+        self.cartella.cleanup()
+
+    def test_path(self):
+        """The journal sits next to the project, unsaved projects keep it in memory."""
+        self.assertEqual(os.path.dirname(self.percorso), self.cartella.name)
+        self.assertEqual(percorso_storico(''), IN_MEMORIA)
+
+    def test_differences(self):
+        """Added, changed and removed relationships; layer display names are ignored."""
+        prima = {'r1': record('r1'), 'r2': record('r2'), 'r3': record('r3')}
+        dopo = {'r1': record('r1', layer_padre='Renamed'), 'r2': record('r2', nome='new'), 'r4': record('r4')}
+        aggiunte, modificate, rimosse = differenze(prima, dopo)
+        self.assertEqual(list(aggiunte), ['r4'])
+        self.assertEqual(list(modificate), ['r2'])
+        self.assertEqual(list(rimosse), ['r3'])
+
+    def test_versions_store_only_changes(self):
+        """Each version stores only its changes and any snapshot can be rebuilt."""
+        storico = StoricoRelazioni(self.percorso)
+        stato = {'r1': record('r1'), 'r2': record('r2')}
+        iniziale = storico.allinea(stato)
+        self.assertIsNone(storico.allinea(stato))
+
+        stato = dict(stato, r3=record('r3'))
+        creata = storico.registra(CREA, "Created r3", stato)
+        stato = dict(stato, r1=record('r1', chiavi={'parcel': 'id'}))
+        storico.registra(MODIFICA, "Edited r1", stato)
+        del stato['r2']
+        storico.registra(ELIMINA, "Deleted r2", stato)
+        self.assertIsNone(storico.registra(CREA, "Nothing", stato))
+
+        self.assertEqual([versione[4] for versione in storico.versioni()], [2, 1, 1, 1])
+        self.assertEqual([versione[0] for versione in storico.versioni()], list(range(iniziale, iniziale + 4)))
+        storico.chiudi()
+
+        storico = StoricoRelazioni(self.percorso)
+        self.assertEqual(storico.ultima_istantanea(), stato)
+        self.assertEqual(set(storico.istantanea(creata)), {'r1', 'r2', 'r3'})
+        self.assertEqual(storico.istantanea(creata)['r1']['chiavi'], {'parcel_id': 'id'})
+        self.assertEqual(set(storico.istantanea_precedente(creata)), {'r1', 'r2'})
+        self.assertIsNone(storico.istantanea(999))
+        storico.chiudi()
+
+    def test_external_changes(self):
+        """Changes made between two versions are recorded on their own."""
+        storico = StoricoRelazioni()
+        storico.allinea({'r1': record('r1')})
+        seq = storico.allinea({})
+        self.assertEqual(storico.versione(seq)[2:], (ESTERNA, "Changes made outside the plugin", 1))
+
+    def test_eviction_folds_into_base(self):
+        """Versions beyond the limit are folded into the base, snapshots stay correct."""
+        storico = StoricoRelazioni(limite=2)
+        stato = {}
+        for numero in range(5):
+            stato = dict(stato, **{f'r{numero}': record(f'r{numero}')})
+            ultima = storico.registra(CREA, f"Created r{numero}", stato)
+        self.assertEqual(len(storico), 2)
+        self.assertEqual(set(storico.istantanea_precedente(ultima - 1)), {'r0', 'r1', 'r2'})
+        self.assertEqual(storico.istantanea(ultima), stato)
+
+        storico.imposta_limite(1)
+        self.assertEqual([versione[0] for versione in storico.versioni()], [ultima])
+        self.assertEqual(set(storico.istantanea_precedente(ultima)), {'r0', 'r1', 'r2', 'r3'})
+
+    def test_stored_snapshots(self):
+        """Versions are rebuilt from the stored full snapshots, also across reopening and eviction."""
+        storico = StoricoRelazioni(self.percorso, limite=INTERVALLO_ISTANTANEE * 2)
+        stati = {}
+        stato = {}
+        for numero in range(INTERVALLO_ISTANTANEE * 3):
+            stato = dict(stato, r1=record('r1', nome=f"Version {numero}"))
+            if numero % 7 == 0:
+                stato[f'r{numero}'] = record(f'r{numero}')
+            stati[storico.registra(MODIFICA, f"Version {numero}", stato)] = stato
+        storico.chiudi()
+
+        storico = StoricoRelazioni(self.percorso, limite=INTERVALLO_ISTANTANEE * 2)
+        self.assertEqual(storico.ultima_istantanea(), stato)
+        versioni = [versione[0] for versione in storico.versioni()]
+        self.assertEqual(len(versioni), INTERVALLO_ISTANTANEE * 2)
+        for seq in versioni:
+            self.assertEqual(storico.istantanea(seq), stati[seq])
+        self.assertEqual(storico.istantanea_precedente(versioni[0]), stati[versioni[0] - 1])
+        storico.chiudi()
+
+    def test_copy(self):
+        """The versions of an in-memory journal move to the file of a newly saved project."""
+        in_memoria = StoricoRelazioni()
+        in_memoria.registra(CREA, "Created r1", {'r1': record('r1')}, '2024-10-03 10:00:00')
+        in_memoria.registra(ELIMINA, "Deleted r1", {})
+        storico = StoricoRelazioni(self.percorso)
+        in_memoria.copia_in(storico)
+        self.assertEqual(storico.versioni()[0][1:4], ('2024-10-03 10:00:00', CREA, "Created r1"))
+        self.assertEqual(storico.ultima_istantanea(), {})
+        storico.chiudi()
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(RelazioniPluginStoricoTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)